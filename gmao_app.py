@@ -1,11 +1,41 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
 import json
 import hashlib
+import io
 import time
+import os
+import sqlite3
+import threading
+import bisect
+import calendar
+import heapq
+import itertools
+import re
+import unicodedata
+import tempfile
+import zipfile
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows : verrouillage limité au processus
+    fcntl = None
+
+try:
+    import openpyxl
+except ImportError:  # Import Excel indisponible : seuls les fichiers CSV sont acceptés
+    openpyxl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Export Parquet indisponible : CSV et JSON lignes uniquement
+    pa = pq = None
+
 # ========== CONFIGURATION ==========
 st.set_page_config(
     page_title="GMAO Pro",
@@ -14,52 +44,2884 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Copy-on-Write : les DataFrames mis en cache sont partagés sans copie (comportement par défaut à partir de pandas 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# ========== STOCKAGE ==========
+@st.cache_resource
+def classe_conflit():
+    """Classe ConflictError unique pour le processus (les except des pages attrapent celle que lève le gestionnaire partagé)"""
+    class ConflictError(Exception):
+        """Levée quand un enregistrement a été modifié par une autre session depuis sa lecture"""
+    return ConflictError
+
+ConflictError = classe_conflit()
+
+@contextmanager
+def file_lock(lock_path):
+    """Verrou exclusif inter-processus sur un fichier de verrou (sans effet si fcntl est indisponible)"""
+    with open(lock_path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def write_atomic(path, data):
+    """Écrit un document JSON dans un fichier temporaire puis le renomme sur la cible"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class JsonStorage:
+    """Stockage dans data/*.json : les modifications sont ajoutées à un journal JSON-lines, compacté en arrière-plan"""
+    
+    label = "JSON"
+    
+    # Collection -> (fichier, clé dans le document JSON ou None si le document est une liste)
+    FILES = {
+        "users": ("users.json", None),
+        "fournisseurs": ("tiers.json", "fournisseurs"),
+        "soustraitants": ("tiers.json", "soustraitants"),
+        "outillages": ("outillages.json", "outillages"),
+        "personnels": ("personnels.json", None),
+        "interventions": ("interventions.json", None),
+        "bons_travail": ("bons_travail.json", None),
+        "plans_preventifs": ("plans_preventifs.json", None),
+        "habilitations": ("habilitations.json", None),
+        # Articles et mouvements partagent un fichier : un mouvement et le solde de l'article s'écrivent ensemble
+        "articles": ("stocks.json", "articles"),
+        "mouvements_stock": ("stocks.json", "mouvements"),
+        # Emprunts rangés avec les outillages : l'événement et la disponibilité de l'outillage s'écrivent ensemble
+        "emprunts": ("outillages.json", "emprunts"),
+        "reservations_outillage": ("outillages.json", "reservations"),
+        "equipements": ("equipements.json", None),
+        "demandes_intervention": ("demandes_intervention.json", None)
+    }
+    
+    # Taille du journal (octets) au-delà de laquelle il est replié dans un nouvel instantané
+    COMPACTION_THRESHOLD = 1_000_000
+    
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._lock = threading.RLock()
+        # Enregistrements connus par collection, indexés par id (ordre d'insertion conservé)
+        self._records = {}
+        # Par fichier : identité de l'instantané chargé et position atteinte dans le journal
+        self._snapshot_ids = {}
+        self._journal_offsets = {}
+        # Fichiers en cours de compactage
+        self._compacting = set()
+        # Version de chaque collection : +1 par écriture, portée par les lignes du journal
+        self._versions = {}
+        self._recover_transactions()
+    
+    def _path(self, collection):
+        return self.data_dir / self.FILES[collection][0]
+    
+    def _journal_path(self, filename):
+        return self.data_dir / (Path(filename).stem + ".journal.jsonl")
+    
+    def _lock_path(self, filename):
+        return self.data_dir / (Path(filename).stem + ".lock")
+    
+    def _versions_path(self, filename):
+        return self.data_dir / (Path(filename).stem + ".versions.json")
+    
+    def _transaction_path(self, transaction):
+        return self.data_dir / f"{transaction}.transaction.json"
+    
+    def _collections_in(self, filename):
+        return [c for c, (f, _) in self.FILES.items() if f == filename]
+    
+    def _snapshot_id(self, filename):
+        """Identité de l'instantané sur disque (change à chaque renommage atomique)"""
+        try:
+            stat = (self.data_dir / filename).stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def exists(self, collection):
+        """Indique si la collection a déjà été enregistrée"""
+        filename, key = self.FILES[collection]
+        journal = self._journal_path(filename)
+        if key is None:
+            return self._path(collection).exists() or journal.exists()
+        # tiers.json regroupe plusieurs collections : la clé doit être présente
+        if self._path(collection).exists():
+            with open(self._path(collection), 'r', encoding='utf-8') as f:
+                if key in json.load(f):
+                    return True
+        if journal.exists():
+            marker = json.dumps({"collection": collection}, ensure_ascii=False)[1:-1]
+            with open(journal, 'r', encoding='utf-8') as f:
+                return any(marker in line for line in f)
+        return False
+    
+    def signature(self, collection):
+        """Version de la collection (écritures des autres processus comprises), indépendante des collections voisines"""
+        with self._lock:
+            self._catch_up(self.FILES[collection][0])
+            return self._versions.get(collection, 0)
+    
+    def load(self, collection):
+        """Retourne la liste des enregistrements : dernier instantané + rejeu du journal"""
+        with self._lock:
+            self._load_file(self.FILES[collection][0])
+            return list(self._records.get(collection, {}).values())
+    
+    def iter_blocs(self, collection, taille):
+        """Parcourt la collection par blocs de taille enregistrements (état au début du parcours)"""
+        with self._lock:
+            self._catch_up(self.FILES[collection][0])
+            # Copie des seules références : les enregistrements ne sont pas dupliqués
+            records = list(self._records.get(collection, {}).values())
+        for debut in range(0, len(records), taille):
+            yield records[debut:debut + taille]
+    
+    def _load_file(self, filename):
+        """Charge toutes les collections d'un fichier (instantané puis journal)"""
+        self._snapshot_ids[filename] = self._snapshot_id(filename)
+        # Versions au dernier compactage ; le journal les fait ensuite avancer
+        versions = {}
+        if self._versions_path(filename).exists():
+            with open(self._versions_path(filename), 'r', encoding='utf-8') as f:
+                versions = json.load(f)
+        for collection in self._collections_in(filename):
+            self._versions[collection] = versions.get(collection, 0)
+        document = None
+        if (self.data_dir / filename).exists():
+            with open(self.data_dir / filename, 'r', encoding='utf-8') as f:
+                document = json.load(f)
+        for collection in self._collections_in(filename):
+            key = self.FILES[collection][1]
+            if document is None or (key is not None and key not in document):
+                self._records.pop(collection, None)
+                continue
+            records = document if key is None else document[key]
+            self._records[collection] = {r["id"]: r for r in records}
+        self._journal_offsets[filename] = 0
+        self._replay_journal(filename)
+    
+    def _replay_journal(self, filename):
+        """Applique les lignes du journal ajoutées depuis la dernière lecture"""
+        journal = self._journal_path(filename)
+        if not journal.exists():
+            self._journal_offsets[filename] = 0
+            return
+        with open(journal, 'rb') as f:
+            f.seek(self._journal_offsets.get(filename, 0))
+            chunk = f.read()
+        # Une dernière ligne incomplète (écriture en cours) sera relue au prochain passage
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._apply(entry)
+        self._journal_offsets[filename] = self._journal_offsets.get(filename, 0) + end
+    
+    def _apply(self, entry):
+        for collection, version in entry.get("versions", {}).items():
+            self._versions[collection] = max(self._versions.get(collection, 0), version)
+        if entry["op"] == "batch":
+            for sub_entry in entry["entries"]:
+                self._apply(sub_entry)
+            return
+        records = self._records.setdefault(entry["collection"], {})
+        if entry["op"] == "delete":
+            records.pop(entry["id"], None)
+        else:
+            records[entry["id"]] = entry["record"]
+    
+    def _catch_up(self, filename):
+        """Intègre les écritures des autres processus avant de modifier un fichier"""
+        if self._snapshot_id(filename) != self._snapshot_ids.get(filename):
+            # Un autre processus a compacté le fichier : rechargement complet
+            self._load_file(filename)
+        else:
+            self._replay_journal(filename)
+    
+    def insert(self, collection, record):
+        record["_rev"] = 1
+        self._write(collection, {"op": "upsert", "id": record["id"], "record": record}, must_be_new=True)
+    
+    def update(self, collection, record, expected_rev=None):
+        self._write(collection, {"op": "upsert", "id": record["id"], "record": record}, expected_rev=expected_rev)
+    
+    def delete(self, collection, record_id, expected_rev=None):
+        self._write(collection, {"op": "delete", "id": record_id}, expected_rev=expected_rev)
+    
+    def write_batch(self, operations):
+        """Enregistre des opérations (op, collection, enregistrement, révision attendue) en tout ou rien, une ligne de journal par fichier"""
+        entries_by_file = {}
+        for op, collection, record, expected_rev in operations:
+            if op == "insert":
+                record["_rev"] = 1
+            entry = {"collection": collection, "op": "delete" if op == "delete" else "upsert", "id": record["id"]}
+            if op != "delete":
+                entry["record"] = record
+            entries_by_file.setdefault(self.FILES[collection][0], []).append((entry, expected_rev, op == "insert"))
+        if len(entries_by_file) == 1:
+            self._write_entries(*entries_by_file.popitem())
+        elif entries_by_file:
+            self._write_transaction(entries_by_file)
+    
+    def replace_all(self, collection, records):
+        filename = self.FILES[collection][0]
+        with file_lock(self._lock_path(filename)), self._lock:
+            self._catch_up(filename)
+            self._records[collection] = {r["id"]: r for r in records}
+            self._versions[collection] = self._versions.get(collection, 0) + 1
+            self._compact_locked(filename)
+    
+    def _write(self, collection, entry, expected_rev=None, must_be_new=False):
+        """Vérifie la révision puis ajoute une ligne au journal, sous verrou du fichier"""
+        self._write_entries(self.FILES[collection][0], [({"collection": collection, **entry}, expected_rev, must_be_new)])
+    
+    def _write_entries(self, filename, entries):
+        """Vérifie les révisions de toutes les entrées puis les ajoute au journal en une seule ligne"""
+        with file_lock(self._lock_path(filename)), self._lock:
+            self._catch_up(filename)
+            retained = self._check_entries(entries)
+            if not retained:
+                return
+            start_compaction = self._append(filename, self._document(retained))
+        
+        if start_compaction:
+            threading.Thread(target=self._compact, args=(filename,), daemon=True).start()
+    
+    def _write_transaction(self, entries_by_file):
+        """Écrit un lot portant sur plusieurs fichiers : tout est vérifié avant la première ligne, et l'intention est rejouée après un arrêt brutal"""
+        filenames = sorted(entries_by_file)
+        with ExitStack() as stack:
+            # Verrous pris dans l'ordre des noms : deux lots concurrents ne peuvent pas s'attendre mutuellement
+            for filename in filenames:
+                stack.enter_context(file_lock(self._lock_path(filename)))
+            stack.enter_context(self._lock)
+            for filename in filenames:
+                self._catch_up(filename)
+            retained = {filename: self._check_entries(entries_by_file[filename]) for filename in filenames}
+            transaction = f"{os.getpid()}.{threading.get_ident()}.{time.time_ns()}"
+            documents = {
+                filename: {**self._document(entries), "transaction": transaction}
+                for filename, entries in retained.items() if entries
+            }
+            if not documents:
+                return
+            intent = self._transaction_path(transaction)
+            write_atomic(intent, documents)
+            start_compaction = [filename for filename, document in documents.items() if self._append(filename, document)]
+            intent.unlink()
+        
+        for filename in start_compaction:
+            threading.Thread(target=self._compact, args=(filename,), daemon=True).start()
+    
+    def _recover_transactions(self):
+        """Ajoute aux journaux les lignes manquantes des lots multi-fichiers interrompus par un arrêt brutal"""
+        for intent in sorted(self.data_dir.glob("*.transaction.json")):
+            try:
+                with open(intent, 'r', encoding='utf-8') as f:
+                    documents = json.load(f)
+            except FileNotFoundError:
+                continue
+            with ExitStack() as stack:
+                for filename in sorted(documents):
+                    stack.enter_context(file_lock(self._lock_path(filename)))
+                stack.enter_context(self._lock)
+                # Lot d'un autre processus terminé pendant l'attente des verrous
+                if not intent.exists():
+                    continue
+                for filename, document in documents.items():
+                    journal = self._journal_path(filename)
+                    marker = json.dumps({"transaction": document["transaction"]})[1:-1]
+                    if journal.exists() and marker in journal.read_text(encoding='utf-8'):
+                        continue
+                    self._catch_up(filename)
+                    # Les versions repartent de l'état courant : d'autres écritures ont pu suivre l'interruption
+                    self._append(filename, {**document, "versions": {
+                        collection: self._versions.get(collection, 0) + 1 for collection in document["versions"]
+                    }})
+                intent.unlink()
+    
+    def _check_entries(self, entries):
+        """Contrôle existence et révision de chaque entrée ; retourne les entrées à écrire avec l'enregistrement courant"""
+        retained = []
+        for entry, expected_rev, must_be_new in entries:
+            collection = entry["collection"]
+            current = self._records.get(collection, {}).get(entry["id"])
+            if must_be_new and current is not None:
+                raise ConflictError(f"{collection} #{entry['id']} existe déjà")
+            if entry["op"] == "delete" and current is None:
+                continue
+            if not must_be_new and current is None:
+                raise ConflictError(f"{collection} #{entry['id']} a été supprimé")
+            if expected_rev is not None and current.get("_rev", 0) != expected_rev:
+                raise ConflictError(f"{collection} #{entry['id']} a été modifié par une autre session")
+            retained.append((entry, current, must_be_new))
+        return retained
+    
+    def _document(self, retained):
+        """Construit la ligne de journal des entrées contrôlées (révisions et versions incrémentées)"""
+        for entry, current, must_be_new in retained:
+            if entry["op"] == "upsert" and not must_be_new:
+                entry["record"]["_rev"] = current.get("_rev", 0) + 1
+        
+        entries = [entry for entry, _, _ in retained]
+        document = entries[0] if len(entries) == 1 else {"op": "batch", "entries": entries}
+        # Une écriture fait avancer d'une unité la version de chaque collection touchée
+        return {**document, "versions": {
+            collection: self._versions.get(collection, 0) + 1
+            for collection in dict.fromkeys(entry["collection"] for entry in entries)
+        }}
+    
+    def _append(self, filename, document):
+        """Ajoute une ligne au journal du fichier (verrou déjà pris) ; indique s'il faut lancer un compactage"""
+        line = (json.dumps(document, ensure_ascii=False) + "\n").encode("utf-8")
+        journal = self._journal_path(filename)
+        with open(journal, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(document)
+        self._journal_offsets[filename] = self._journal_offsets.get(filename, 0) + len(line)
+        
+        start_compaction = (
+            self._journal_offsets[filename] > self.COMPACTION_THRESHOLD and filename not in self._compacting
+        )
+        if start_compaction:
+            self._compacting.add(filename)
+        return start_compaction
+    
+    def next_id(self, collection, floor=0, count=1):
+        """Alloue le prochain id de la collection, ou le premier d'un bloc de count ids (séquence dans data/sequences.json)"""
+        filename = self.FILES[collection][0]
+        sequences_path = self.data_dir / "sequences.json"
+        with file_lock(self._lock_path(filename)), file_lock(self.data_dir / "sequences.lock"), self._lock:
+            self._catch_up(filename)
+            sequences = {}
+            if sequences_path.exists():
+                with open(sequences_path, 'r', encoding='utf-8') as f:
+                    sequences = json.load(f)
+            current = sequences.get(collection)
+            if current is None:
+                # Première allocation : on repart du plus grand id existant
+                current = max(
+                    (i for i in self._records.get(collection, {}) if isinstance(i, int)), default=0
+                )
+            new_id = max(current, floor) + 1
+            sequences[collection] = new_id + count - 1
+            write_atomic(sequences_path, sequences)
+        return new_id
+    
+    def _compact(self, filename):
+        """Replie le journal dans un nouvel instantané (exécuté en arrière-plan)"""
+        try:
+            with file_lock(self._lock_path(filename)), self._lock:
+                self._catch_up(filename)
+                # Un lot interrompu non encore rejoué repère ses lignes dans le journal : on le conserve
+                if not any(self.data_dir.glob("*.transaction.json")):
+                    self._compact_locked(filename)
+        finally:
+            with self._lock:
+                self._compacting.discard(filename)
+    
+    def _compact_locked(self, filename):
+        """Écrit l'instantané de façon atomique puis vide le journal (verrou du fichier déjà pris)"""
+        loaded = [c for c in self._collections_in(filename) if c in self._records]
+        first = self._collections_in(filename)[0]
+        if self.FILES[first][1] is None:
+            document = list(self._records.get(first, {}).values())
+        else:
+            document = {self.FILES[c][1]: list(self._records[c].values()) for c in loaded}
+        
+        # Versions écrites avant l'instantané : le journal supprimé ensuite ne les porte plus
+        write_atomic(self._versions_path(filename), {c: self._versions.get(c, 0) for c in self._collections_in(filename)})
+        write_atomic(self.data_dir / filename, document)
+        journal = self._journal_path(filename)
+        if journal.exists():
+            journal.unlink()
+        self._snapshot_ids[filename] = self._snapshot_id(filename)
+        self._journal_offsets[filename] = 0
+
+class SQLiteStorage:
+    """Stockage SQLite (mode WAL) : chaque modification ne touche qu'une ligne"""
+    
+    label = "SQLite"
+    
+    def __init__(self, db_path, import_source=None):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        # Connexion partagée entre les threads des sessions, protégée par self._lock
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS collections (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                last_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                collection TEXT NOT NULL,
+                id NOT NULL,
+                data TEXT NOT NULL,
+                rev INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (collection, id)
+            );
+        """)
+        # Bases créées avant l'ajout des révisions et des séquences
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(records)")]
+        if "rev" not in columns:
+            self._conn.execute("ALTER TABLE records ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(collections)")]
+        if "last_id" not in columns:
+            self._conn.execute("ALTER TABLE collections ADD COLUMN last_id INTEGER")
+        
+        if import_source is not None:
+            self.import_from(import_source)
+    
+    @contextmanager
+    def _transaction(self):
+        """Transaction d'écriture (BEGIN IMMEDIATE pour prendre le verrou d'écriture tout de suite)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+    
+    def _bump_version(self, conn, collection):
+        conn.execute(
+            "INSERT INTO collections (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (collection,)
+        )
+    
+    def import_from(self, source):
+        """Importe les collections du stockage source qui n'existent pas encore dans la base"""
+        for collection in source.FILES:
+            if not self.exists(collection) and source.exists(collection):
+                self.replace_all(collection, source.load(collection))
+    
+    def exists(self, collection):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM collections WHERE name = ?", (collection,)).fetchone()
+        return row is not None
+    
+    def signature(self, collection):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM collections WHERE name = ?", (collection,)).fetchone()
+        return row[0] if row else None
+    
+    def load(self, collection):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM records WHERE collection = ? ORDER BY rowid", (collection,)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def iter_blocs(self, collection, taille):
+        """Parcourt la collection par blocs de taille enregistrements (pagination sur le rowid)"""
+        dernier = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT rowid, data FROM records WHERE collection = ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (collection, dernier, taille)
+                ).fetchall()
+            if not rows:
+                return
+            dernier = rows[-1][0]
+            yield [json.loads(data) for _, data in rows]
+    
+    def insert(self, collection, record):
+        with self._transaction() as conn:
+            self._insert_row(conn, collection, record)
+            self._bump_version(conn, collection)
+    
+    def update(self, collection, record, expected_rev=None):
+        with self._transaction() as conn:
+            self._update_row(conn, collection, record, expected_rev)
+            self._bump_version(conn, collection)
+    
+    def delete(self, collection, record_id, expected_rev=None):
+        with self._transaction() as conn:
+            self._delete_row(conn, collection, record_id, expected_rev)
+            self._bump_version(conn, collection)
+    
+    def write_batch(self, operations):
+        """Enregistre des opérations (op, collection, enregistrement, révision attendue) dans une seule transaction"""
+        with self._transaction() as conn:
+            for op, collection, record, expected_rev in operations:
+                if op == "insert":
+                    self._insert_row(conn, collection, record)
+                elif op == "update":
+                    self._update_row(conn, collection, record, expected_rev)
+                else:
+                    self._delete_row(conn, collection, record["id"], expected_rev)
+            for collection in dict.fromkeys(collection for _, collection, _, _ in operations):
+                self._bump_version(conn, collection)
+    
+    def _insert_row(self, conn, collection, record):
+        record["_rev"] = 1
+        try:
+            conn.execute(
+                "INSERT INTO records (collection, id, data, rev) VALUES (?, ?, ?, 1)",
+                (collection, record["id"], json.dumps(record, ensure_ascii=False))
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictError(f"{collection} #{record['id']} existe déjà")
+    
+    def _update_row(self, conn, collection, record, expected_rev):
+        row = conn.execute(
+            "SELECT rev FROM records WHERE collection = ? AND id = ?", (collection, record["id"])
+        ).fetchone()
+        if row is None:
+            raise ConflictError(f"{collection} #{record['id']} a été supprimé")
+        if expected_rev is not None and row[0] != expected_rev:
+            raise ConflictError(f"{collection} #{record['id']} a été modifié par une autre session")
+        record["_rev"] = row[0] + 1
+        conn.execute(
+            "UPDATE records SET data = ?, rev = ? WHERE collection = ? AND id = ?",
+            (json.dumps(record, ensure_ascii=False), record["_rev"], collection, record["id"])
+        )
+    
+    def _delete_row(self, conn, collection, record_id, expected_rev):
+        if expected_rev is not None:
+            row = conn.execute(
+                "SELECT rev FROM records WHERE collection = ? AND id = ?", (collection, record_id)
+            ).fetchone()
+            if row is not None and row[0] != expected_rev:
+                raise ConflictError(f"{collection} #{record_id} a été modifié par une autre session")
+        conn.execute("DELETE FROM records WHERE collection = ? AND id = ?", (collection, record_id))
+    
+    def next_id(self, collection, floor=0, count=1):
+        """Alloue le prochain id de la collection, ou le premier d'un bloc de count ids (séquence dans la table collections)"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT last_id FROM collections WHERE name = ?", (collection,)).fetchone()
+            current = row[0] if row else None
+            if current is None:
+                # Première allocation : on repart du plus grand id existant
+                current = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM records WHERE collection = ? AND typeof(id) = 'integer'",
+                    (collection,)
+                ).fetchone()[0]
+            new_id = max(current, floor) + 1
+            conn.execute(
+                "INSERT INTO collections (name, version, last_id) VALUES (?, 0, ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id",
+                (collection, new_id + count - 1)
+            )
+        return new_id
+    
+    def replace_all(self, collection, records):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM records WHERE collection = ?", (collection,))
+            conn.executemany(
+                "INSERT INTO records (collection, id, data, rev) VALUES (?, ?, ?, ?)",
+                [(collection, r["id"], json.dumps(r, ensure_ascii=False), r.get("_rev", 0)) for r in records]
+            )
+            self._bump_version(conn, collection)
+
+def create_storage(data_dir):
+    """Crée le backend de stockage choisi par la variable GMAO_STORAGE ("sqlite" par défaut, ou "json")"""
+    if os.environ.get("GMAO_STORAGE", "sqlite").lower() == "json":
+        return JsonStorage(data_dir)
+    # Les fichiers data/*.json existants sont importés automatiquement au premier lancement
+    return SQLiteStorage(data_dir / "gmao.db", import_source=JsonStorage(data_dir))
+
+# ========== RECHERCHE ==========
+def normaliser_texte(texte):
+    """Normalise un texte pour la recherche : minuscules, sans accents ni ponctuation"""
+    texte = unicodedata.normalize("NFKD", str(texte or "").lower())
+    texte = "".join(c for c in texte if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", texte).strip()
+
+def tokeniser(texte):
+    """Découpe un texte normalisé en mots"""
+    return normaliser_texte(texte).split()
+
+def distance_bornee(a, b, limite):
+    """Distance d'édition entre a et b, ou limite + 1 dès qu'elle dépasse limite"""
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    precedente = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        courante = [i]
+        for j, cb in enumerate(b, 1):
+            courante.append(min(precedente[j] + 1, courante[j - 1] + 1, precedente[j - 1] + (ca != cb)))
+        if min(courante) > limite:
+            return limite + 1
+        precedente = courante
+    return precedente[-1]
+
+class SearchIndex:
+    """Index inversé multi-collections : mot normalisé -> (collection, id) -> poids du champ"""
+    
+    # Facteur appliqué au poids selon le type de correspondance
+    EXACT, PREFIXE, APPROCHE = 1.0, 0.7, 0.4
+    # Longueur minimale d'un mot pour la recherche par préfixe et la tolérance aux fautes
+    PREFIXE_MIN, APPROCHE_MIN = 2, 4
+    
+    def __init__(self, fields):
+        # fields : collection -> {champ: poids}
+        self.fields = fields
+        self._postings = {}
+        self._vocabulary = []
+        self._documents = {}
+        self._by_collection = {collection: set() for collection in fields}
+    
+    def index_collection(self, collection, records):
+        """Réindexe entièrement une collection"""
+        for record_id in list(self._by_collection[collection]):
+            self.remove(collection, record_id)
+        for record in records:
+            self.add(collection, record)
+    
+    def apply(self, collection, op, record):
+        """Reporte une modification (op = "insert", "update" ou "delete") sur l'index"""
+        self.remove(collection, record["id"])
+        if op != "delete":
+            self.add(collection, record)
+    
+    def add(self, collection, record):
+        """Indexe les champs recherchables d'un enregistrement"""
+        doc = (collection, record["id"])
+        terms = {}
+        for field, weight in self.fields[collection].items():
+            value = record.get(field)
+            if isinstance(value, (list, tuple)):
+                value = " ".join(str(v) for v in value)
+            for token in tokeniser(value):
+                terms[token] = max(terms.get(token, 0), weight)
+        for token, weight in terms.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocabulary, token)
+            postings[doc] = weight
+        # Les mots sont mémorisés : l'enregistrement peut être modifié en place avant sa mise à jour
+        self._documents[doc] = terms
+        self._by_collection[collection].add(record["id"])
+    
+    def remove(self, collection, record_id):
+        """Retire un enregistrement de l'index"""
+        doc = (collection, record_id)
+        for token in self._documents.pop(doc, ()):
+            postings = self._postings[token]
+            del postings[doc]
+            if not postings:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+        self._by_collection[collection].discard(record_id)
+    
+    def _matching_tokens(self, token):
+        """Mots du vocabulaire correspondant à un mot recherché, avec leur facteur de pertinence"""
+        matches = {}
+        if token in self._postings:
+            matches[token] = self.EXACT
+        if len(token) >= self.PREFIXE_MIN:
+            for i in range(bisect.bisect_left(self._vocabulary, token), len(self._vocabulary)):
+                candidate = self._vocabulary[i]
+                if not candidate.startswith(token):
+                    break
+                matches.setdefault(candidate, self.PREFIXE)
+        if not matches and len(token) >= self.APPROCHE_MIN:
+            # Tolérance aux fautes : mots de même initiale à distance d'édition bornée
+            limite = 1 if len(token) < 8 else 2
+            debut = bisect.bisect_left(self._vocabulary, token[0])
+            fin = bisect.bisect_left(self._vocabulary, chr(ord(token[0]) + 1))
+            for candidate in self._vocabulary[debut:fin]:
+                if distance_bornee(token, candidate[:len(token) + limite], limite) <= limite:
+                    matches[candidate] = self.APPROCHE
+        return matches
+    
+    def search(self, texte, collections=None, limit=20):
+        """Retourne les (score, collection, id) correspondant à tous les mots du texte, par pertinence décroissante"""
+        # Mots les plus sélectifs d'abord : les suivants ne sont évalués que sur les documents restants
+        expansions = [self._matching_tokens(token) for token in tokeniser(texte)]
+        expansions.sort(key=lambda matches: sum(len(self._postings[candidate]) for candidate in matches))
+        scores = None
+        for matches in expansions:
+            token_scores = {}
+            if scores is None or len(scores) * len(matches) > sum(len(self._postings[c]) for c in matches):
+                for candidate, factor in matches.items():
+                    for doc, weight in self._postings[candidate].items():
+                        if collections is None or doc[0] in collections:
+                            score = weight * factor
+                            if score > token_scores.get(doc, 0):
+                                token_scores[doc] = score
+            else:
+                for doc in scores:
+                    for candidate, factor in matches.items():
+                        weight = self._postings[candidate].get(doc)
+                        if weight is not None and weight * factor > token_scores.get(doc, 0):
+                            token_scores[doc] = weight * factor
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc: score + token_scores[doc] for doc, score in scores.items() if doc in token_scores}
+            if not scores:
+                return []
+        if not scores:
+            return []
+        hits = ((score, doc[0], doc[1]) for doc, score in scores.items())
+        if limit is None:
+            return sorted(hits, key=lambda hit: hit[0], reverse=True)
+        return heapq.nlargest(limit, hits, key=lambda hit: hit[0])
+
+# ========== INDICATEURS DE MAINTENANCE ==========
+MOIS_FR = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
+           "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
+
+class KpiEngine:
+    """Agrégats courants des interventions par équipement, type et mois, mis à jour à chaque modification"""
+    
+    # Dimensions d'agrégation (la dimension "global" n'a qu'une valeur, None)
+    DIMENSIONS = ("global", "equipement", "type", "mois", "mois_type")
+    # Types d'intervention comptés comme des défaillances (MTBF, MTTR)
+    TYPES_DEFAILLANCE = ("Corrective", "Urgente")
+    # Performance et qualité ne sont pas encore mesurées : valeurs de référence pour le calcul de l'OEE
+    PERFORMANCE = 0.915
+    QUALITE = 0.983
+    # MTTR cible par équipement (heures)
+    OBJECTIF_MTTR = 4.0
+    
+    def __init__(self):
+        self._totaux = {dimension: {} for dimension in self.DIMENSIONS}
+        # id -> (clés d'agrégats, valeurs) ajoutées, pour retirer exactement la même contribution
+        self._contributions = {}
+    
+    def rebuild(self, interventions):
+        """Recalcule tous les agrégats (au chargement uniquement)"""
+        self._totaux = {dimension: {} for dimension in self.DIMENSIONS}
+        self._contributions = {}
+        for intervention in interventions:
+            self.add(intervention)
+    
+    def apply(self, op, intervention):
+        """Reporte une modification (op = "insert", "update" ou "delete") sur les agrégats"""
+        self.remove(intervention["id"])
+        if op != "delete":
+            self.add(intervention)
+    
+    def add(self, intervention):
+        """Ajoute la contribution d'une intervention"""
+        type_intervention = intervention.get("type", "Corrective")
+        mois = str(intervention.get("date", ""))[:7]
+        defaillance = type_intervention in self.TYPES_DEFAILLANCE
+        duree_arret = float(intervention.get("duree_arret") or 0)
+        valeurs = {
+            "interventions": 1,
+            "preventives": int(type_intervention == "Préventive"),
+            "defaillances": int(defaillance),
+            "arret": duree_arret,
+            "arret_defaillances": duree_arret if defaillance else 0.0,
+            "temps_passe": float(intervention.get("temps_passe") or 0),
+            "cout": float(intervention.get("cout") or 0)
+        }
+        cles = [
+            ("global", None),
+            ("equipement", intervention.get("equipement", "Non spécifié")),
+            ("type", type_intervention),
+            ("mois", mois),
+            ("mois_type", (mois, type_intervention))
+        ]
+        for dimension, valeur in cles:
+            totaux = self._totaux[dimension].setdefault(valeur, dict.fromkeys(valeurs, 0))
+            for champ, montant in valeurs.items():
+                totaux[champ] += montant
+        self._contributions[intervention["id"]] = (cles, valeurs)
+    
+    def remove(self, intervention_id):
+        """Retire la contribution d'une intervention"""
+        contribution = self._contributions.pop(intervention_id, None)
+        if contribution is None:
+            return
+        cles, valeurs = contribution
+        for dimension, valeur in cles:
+            totaux = self._totaux[dimension][valeur]
+            for champ, montant in valeurs.items():
+                totaux[champ] -= montant
+            if totaux["interventions"] <= 0:
+                del self._totaux[dimension][valeur]
+    
+    def totaux(self, dimension, valeur=None):
+        """Compteurs d'une valeur de dimension (copie, zéros si aucune intervention)"""
+        totaux = self._totaux[dimension].get(valeur)
+        if totaux is None:
+            return {"interventions": 0, "preventives": 0, "defaillances": 0, "arret": 0.0,
+                    "arret_defaillances": 0.0, "temps_passe": 0.0, "cout": 0.0}
+        return dict(totaux)
+    
+    def valeurs(self, dimension):
+        """Valeurs d'une dimension ayant au moins une intervention, triées"""
+        return sorted(self._totaux[dimension])
+    
+    def indicateurs(self, maintenant=None):
+        """MTBF, MTTR, disponibilité, taux préventif, coûts et OEE sur tout l'historique"""
+        maintenant = maintenant or datetime.datetime.now()
+        totaux = self.totaux("global")
+        nb_equipements = len(self._totaux["equipement"])
+        mois = self._totaux["mois"]
+        kpi = {"interventions": totaux["interventions"], "equipements": nb_equipements,
+               "mtbf": None, "mttr": None, "disponibilite": None, "taux_preventive": None,
+               "cout_total": totaux["cout"], "cout_mensuel": None, "nb_mois": 0, "oee": None,
+               "performance": self.PERFORMANCE, "qualite": self.QUALITE}
+        if not totaux["interventions"]:
+            return kpi
+        
+        # Période observée : du premier mois d'activité à maintenant, pour chaque équipement suivi
+        premier = min(m for m in mois if m) if any(mois) else maintenant.strftime("%Y-%m")
+        debut = datetime.datetime.strptime(premier, "%Y-%m")
+        heures = max((maintenant - debut).total_seconds() / 3600, 1.0)
+        temps_requis = nb_equipements * heures
+        temps_fonctionnement = max(temps_requis - totaux["arret"], 0.0)
+        
+        kpi["nb_mois"] = (maintenant.year - debut.year) * 12 + maintenant.month - debut.month + 1
+        kpi["cout_mensuel"] = totaux["cout"] / kpi["nb_mois"]
+        kpi["taux_preventive"] = totaux["preventives"] / totaux["interventions"]
+        kpi["disponibilite"] = temps_fonctionnement / temps_requis
+        if totaux["defaillances"]:
+            kpi["mtbf"] = temps_fonctionnement / totaux["defaillances"]
+            kpi["mttr"] = totaux["arret_defaillances"] / totaux["defaillances"]
+        kpi["oee"] = kpi["disponibilite"] * self.PERFORMANCE * self.QUALITE
+        return kpi
+    
+    def mttr_par_equipement(self, limit=5):
+        """MTTR des équipements ayant le plus de défaillances"""
+        equipements = [(valeur, totaux) for valeur, totaux in self._totaux["equipement"].items() if totaux["defaillances"]]
+        plus_defaillants = heapq.nlargest(limit, equipements, key=lambda item: item[1]["defaillances"])
+        return [(valeur, totaux["arret_defaillances"] / totaux["defaillances"], totaux["defaillances"])
+                for valeur, totaux in plus_defaillants]
+
+# ========== FIABILITÉ DES ÉQUIPEMENTS ==========
+# Statuts d'une demande d'intervention : en file d'attente, prise en charge, BT émis, équipement remis en service
+DEMANDE_EN_ATTENTE, DEMANDE_PRISE_EN_CHARGE = "🟡 En attente", "🟠 Prise en charge"
+DEMANDE_BT_EMIS, DEMANDE_CLOTUREE = "🔵 BT émis", "🟢 Clôturée"
+STATUTS_DEMANDE = [DEMANDE_EN_ATTENTE, DEMANDE_PRISE_EN_CHARGE, DEMANDE_BT_EMIS, DEMANDE_CLOTUREE]
+# Horizon (jours) du risque de défaillance servant à classer les équipements à surveiller
+HORIZON_FIABILITE = 30
+
+def analyser_fiabilite(demandes, maintenant=None, horizon=HORIZON_FIABILITE):
+    """MTBF, MTTR, loi de Weibull (régression sur les rangs médians) et risque de défaillance à l'horizon, par équipement"""
+    colonnes = ["defaillances", "mtbf", "mttr", "beta", "eta", "derniere", "depuis", "risque"]
+    if demandes.empty:
+        return pd.DataFrame(columns=colonnes)
+    maintenant = pd.Timestamp(maintenant or datetime.datetime.now())
+    
+    # Une ligne par défaillance, triée par équipement puis par date de détection
+    heure = demandes.reindex(columns=["heure_detection"])["heure_detection"].fillna("00:00:00").astype(str)
+    evenements = pd.DataFrame({
+        "equipement": demandes["reference_equipement"].astype(str),
+        "date": pd.to_datetime(demandes["date_detection"].astype(str).str[:10] + "T" + heure, format="ISO8601", errors="coerce"),
+        "arret": pd.to_numeric(demandes.reindex(columns=["duree_arret"])["duree_arret"], errors="coerce")
+    }).dropna(subset=["date"]).sort_values(["equipement", "date"], kind="stable")
+    if evenements.empty:
+        return pd.DataFrame(columns=colonnes)
+    codes, equipements = pd.factorize(evenements["equipement"])
+    nb = len(equipements)
+    heures = evenements["date"].to_numpy(dtype="datetime64[s]").astype(np.int64) / 3600
+    arret = evenements["arret"].to_numpy(dtype=float)
+    
+    # Temps entre défaillances successives d'un même équipement (la première n'en a pas)
+    suite = np.r_[False, codes[1:] == codes[:-1]]
+    tbf = np.where(suite, np.diff(heures, prepend=np.nan), np.nan)
+    defaillances = np.bincount(codes, minlength=nb)
+    intervalles = np.bincount(codes, weights=suite, minlength=nb)
+    mtbf = np.divide(np.bincount(codes, weights=np.where(suite, tbf, 0.0), minlength=nb), intervalles,
+                     out=np.full(nb, np.nan), where=intervalles > 0)
+    repare = ~np.isnan(arret)
+    reparations = np.bincount(codes, weights=repare, minlength=nb)
+    mttr = np.divide(np.bincount(codes, weights=np.where(repare, arret, 0.0), minlength=nb), reparations,
+                     out=np.full(nb, np.nan), where=reparations > 0)
+    
+    # Weibull : rangs médians de Bernard F = (i - 0.3) / (n + 0.4) sur les TBF triés de chaque équipement,
+    # puis droite ln(-ln(1 - F)) = beta * ln(t) - beta * ln(eta) ajustée par moindres carrés (sommes par équipement)
+    positifs = suite & (tbf > 0)
+    groupe, temps = codes[positifs], tbf[positifs]
+    ordre = np.lexsort((temps, groupe))
+    groupe, temps = groupe[ordre], temps[ordre]
+    n = np.bincount(groupe, minlength=nb).astype(float)
+    debuts = np.cumsum(n) - n
+    rang = np.arange(len(groupe)) - debuts[groupe] + 1
+    x = np.log(temps)
+    y = np.log(-np.log(1 - (rang - 0.3) / (n[groupe] + 0.4)))
+    sx, sy = np.bincount(groupe, x, nb), np.bincount(groupe, y, nb)
+    sxx, sxy = np.bincount(groupe, x * x, nb), np.bincount(groupe, x * y, nb)
+    denominateur = n * sxx - sx ** 2
+    # Au moins trois intervalles : une droite passant par deux points n'estime rien
+    ajustable = (n >= 3) & (denominateur > 1e-12)
+    beta = np.divide(n * sxy - sx * sy, denominateur, out=np.full(nb, np.nan), where=ajustable)
+    ajustable &= beta > 0
+    beta[~ajustable] = np.nan
+    ordonnee = np.divide(sy - beta * sx, n, out=np.full(nb, np.nan), where=ajustable)
+    eta = np.exp(np.divide(-ordonnee, beta, out=np.full(nb, np.nan), where=ajustable))
+    
+    # Risque de défaillance dans l'horizon sachant le temps écoulé depuis la dernière panne :
+    # loi de Weibull conditionnelle si elle est ajustée, loi exponentielle de moyenne MTBF sinon
+    derniere = heures[np.r_[codes[1:] != codes[:-1], True]]
+    depuis = np.maximum(maintenant.to_datetime64().astype("datetime64[s]").astype(np.int64) / 3600 - derniere, 0.0)
+    h = horizon * 24.0
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        risque_weibull = 1 - np.exp((depuis / eta) ** beta - ((depuis + h) / eta) ** beta)
+        risque_exponentiel = 1 - np.exp(-h / mtbf)
+    risque = np.where(ajustable, risque_weibull, risque_exponentiel)
+    
+    return pd.DataFrame({
+        "defaillances": defaillances,
+        "mtbf": mtbf,
+        "mttr": mttr,
+        "beta": beta,
+        "eta": eta,
+        "derniere": pd.to_datetime(derniere * 3600, unit="s"),
+        "depuis": depuis,
+        "risque": risque
+    }, index=pd.Index(equipements, name="reference_equipement")).sort_values("risque", ascending=False, na_position="last")
+
+# ========== FILE DES DEMANDES D'INTERVENTION ==========
+# Points de score par niveau ; une demande en attente gagne VIEILLISSEMENT_PAR_HEURE point par heure,
+# si bien qu'une demande basse finit par passer devant une demande urgente arrivée bien après elle
+POINTS_PRIORITE = {"Basse": 0, "Normale": 24, "Haute": 48, "Urgente": 96}
+POINTS_CRITICITE = {"Faible": 0, "Moyenne": 4, "Haute": 8, "Critique": 16}
+POINTS_IMPACT = {"Aucun": 0, "Ralentissement": 4, "Arrêt partiel": 8, "Arrêt total": 16}
+VIEILLISSEMENT_PAR_HEURE = 1.0
+
+def calculer_priorite(criticite, impact_production):
+    """Calcule la priorité en fonction de la criticité et de l'impact"""
+    if criticite == "Critique" or impact_production == "Arrêt total":
+        return "Urgente"
+    elif criticite == "Haute" or impact_production == "Arrêt partiel":
+        return "Haute"
+    elif criticite == "Moyenne" or impact_production == "Ralentissement":
+        return "Normale"
+    else:
+        return "Basse"
+
+def heures_epoch(horodatage):
+    """Horodatage ISO (date seule acceptée) en heures depuis l'origine Unix"""
+    moment = datetime.datetime.fromisoformat(str(horodatage))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return (moment - datetime.datetime(1970, 1, 1)).total_seconds() / 3600
+
+def points_demande(demande):
+    """Score de base d'une demande : priorité calculée, criticité et impact sur la production"""
+    priorite = demande.get("priorite") or calculer_priorite(demande.get("criticite"), demande.get("impact_production"))
+    return (POINTS_PRIORITE.get(priorite, 0) + POINTS_CRITICITE.get(demande.get("criticite"), 0)
+            + POINTS_IMPACT.get(demande.get("impact_production"), 0))
+
+def score_demande(demande, maintenant=None):
+    """Score courant d'une demande en attente : score de base + vieillissement depuis la soumission"""
+    maintenant = maintenant or datetime.datetime.now()
+    attente = heures_epoch(maintenant.isoformat()) - heures_epoch(demande.get("date_soumission") or demande["date_detection"])
+    return points_demande(demande) + VIEILLISSEMENT_PAR_HEURE * max(attente, 0.0)
+
+class FileDemandes:
+    """Demandes en attente dans un tas binaire, de la plus urgente à la moins urgente (vieillissement sans re-tri)"""
+    
+    # Le score base + k × (maintenant - soumission) ordonne les demandes comme base - k × soumission :
+    # la clé ne dépend pas de l'heure courante. Une demande modifiée ou sortie de l'attente laisse
+    # son ancienne entrée dans le tas, ignorée à la lecture (suppression paresseuse) : seule l'entrée
+    # du dernier ajout, repérée par son numéro d'ordre, est valide, même si la clé revient à une valeur antérieure.
+    
+    def __init__(self):
+        # Tas de (clé, demande_id, numéro d'ordre) et entrée en vigueur par demande en attente
+        self._tas = []
+        self._cles = {}
+        self._ordre = itertools.count()
+    
+    def __len__(self):
+        return len(self._cles)
+    
+    @staticmethod
+    def cle(demande):
+        """Clé de tri (la plus petite est la plus urgente)"""
+        soumission = heures_epoch(demande.get("date_soumission") or demande["date_detection"])
+        return VIEILLISSEMENT_PAR_HEURE * soumission - points_demande(demande), demande["id"]
+    
+    def rebuild(self, demandes):
+        """Reconstruit la file (au chargement uniquement)"""
+        self._cles = {d["id"]: (*self.cle(d), next(self._ordre)) for d in demandes if d.get("statut") == DEMANDE_EN_ATTENTE}
+        self._tas = list(self._cles.values())
+        heapq.heapify(self._tas)
+    
+    def apply(self, op, demande):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'une demande"""
+        if op == "delete" or demande.get("statut") != DEMANDE_EN_ATTENTE:
+            self._cles.pop(demande["id"], None)
+        else:
+            cle = self.cle(demande)
+            if self._cles.get(demande["id"], ())[:2] != cle:
+                entree = (*cle, next(self._ordre))
+                self._cles[demande["id"]] = entree
+                heapq.heappush(self._tas, entree)
+        # Les entrées périmées sont purgées quand elles dépassent la moitié du tas
+        if len(self._tas) > 2 * len(self._cles) + 64:
+            self._tas = list(self._cles.values())
+            heapq.heapify(self._tas)
+    
+    def _valide(self, entree):
+        return self._cles.get(entree[1]) == entree
+    
+    def peek(self, n=1):
+        """Ids des n demandes les plus urgentes, sans les retirer (parcours du tas par ordre de clé, O(n log n))"""
+        resultat = []
+        frontiere = [(self._tas[0], 0)] if self._tas else []
+        while frontiere and len(resultat) < n:
+            entree, i = heapq.heappop(frontiere)
+            if self._valide(entree):
+                resultat.append(entree[1])
+            for enfant in (2 * i + 1, 2 * i + 2):
+                if enfant < len(self._tas):
+                    heapq.heappush(frontiere, (self._tas[enfant], enfant))
+        return resultat
+    
+    def pop(self, n=1):
+        """Retire et retourne les ids des n demandes les plus urgentes (O(log n) chacune)"""
+        resultat = []
+        while self._tas and len(resultat) < n:
+            entree = heapq.heappop(self._tas)
+            if self._valide(entree):
+                del self._cles[entree[1]]
+                resultat.append(entree[1])
+        return resultat
+
+# ========== BONS DE TRAVAIL ==========
+class BonTravailInvalideError(ValueError):
+    """Numéro de Bon de Travail déjà utilisé"""
+
+# ========== PLANIFICATION PRÉVENTIVE ==========
+# Périodicité des plans : (unité, intervalle)
+PERIODICITES = {
+    "Hebdomadaire": ("jours", 7),
+    "Mensuelle": ("mois", 1),
+    "Trimestrielle": ("mois", 3),
+    "Semestrielle": ("mois", 6),
+    "Annuelle": ("mois", 12)
+}
+
+def regle_plan(plan):
+    """Règle de récurrence d'un plan : (date de début, unité, intervalle), fréquence en jours prioritaire sur le type"""
+    debut = datetime.date.fromisoformat(plan["date_debut"])
+    if plan.get("frequence_jours"):
+        return debut, "jours", int(plan["frequence_jours"])
+    return (debut,) + PERIODICITES[plan["type"]]
+
+def _date_rang(regle, rang):
+    """Date de la rang-ième occurrence d'une règle, calculée directement depuis sa date de début"""
+    debut, unite, intervalle = regle
+    if unite == "jours":
+        return debut + datetime.timedelta(days=rang * intervalle)
+    mois = debut.month - 1 + rang * intervalle
+    annee, mois = debut.year + mois // 12, mois % 12 + 1
+    # Un plan ancré le 31 tombe le dernier jour des mois plus courts
+    return datetime.date(annee, mois, min(debut.day, calendar.monthrange(annee, mois)[1]))
+
+def _premier_rang(regle, jour):
+    """Rang de la première occurrence tombant le jour donné ou après (saut arithmétique, sans itérer depuis le début)"""
+    debut, unite, intervalle = regle
+    if jour <= debut:
+        return 0
+    if unite == "jours":
+        return -(-(jour - debut).days // intervalle)
+    rang = ((jour.year - debut.year) * 12 + jour.month - debut.month) // intervalle
+    while _date_rang(regle, rang) < jour:
+        rang += 1
+    return rang
+
+def date_occurrence(plan, rang):
+    """Date de la rang-ième occurrence d'un plan"""
+    return _date_rang(regle_plan(plan), rang)
+
+def premier_rang(plan, jour):
+    """Rang de la première occurrence d'un plan tombant le jour donné ou après"""
+    return _premier_rang(regle_plan(plan), jour)
+
+def _borne_plan(plan, fin):
+    """Fin de fenêtre limitée à la date de fin du plan"""
+    if plan.get("date_fin"):
+        return min(fin, datetime.date.fromisoformat(plan["date_fin"]))
+    return fin
+
+def occurrences_plan(plan, debut, fin):
+    """Génère à la demande les occurrences d'un plan dont la date effective est dans [debut, fin], par date"""
+    if not plan.get("actif", True):
+        return iter(())
+    exceptions = plan.get("exceptions", {})
+    
+    def occurrence(date_prevue, exception):
+        return {
+            "plan": plan,
+            "date_prevue": date_prevue,
+            "date": exception.get("date", date_prevue),
+            "etat": exception.get("etat", "🟢 Planifié"),
+            "bt": exception.get("bt")
+        }
+    
+    def regulieres():
+        regle = regle_plan(plan)
+        borne = _borne_plan(plan, fin)
+        rang = _premier_rang(regle, debut)
+        jour = _date_rang(regle, rang)
+        while jour <= borne:
+            date_prevue = jour.isoformat()
+            exception = exceptions.get(date_prevue, {})
+            # Les occurrences sautées sont omises, les reportées sont produites à leur nouvelle date
+            if exception.get("etat") != "⏭️ Sautée" and exception.get("date", date_prevue) == date_prevue:
+                yield occurrence(date_prevue, exception)
+            rang += 1
+            jour = _date_rang(regle, rang)
+    
+    # Les exceptions sont peu nombreuses : les reports entrant dans la fenêtre sont triés puis fusionnés
+    debut_iso, fin_iso, fin_plan_iso = debut.isoformat(), fin.isoformat(), plan.get("date_fin") or "9999-12-31"
+    reportees = sorted(
+        (occurrence(date_prevue, exception) for date_prevue, exception in exceptions.items()
+         if exception.get("etat") != "⏭️ Sautée" and exception.get("date", date_prevue) != date_prevue
+         and date_prevue <= fin_plan_iso and debut_iso <= exception["date"] <= fin_iso),
+        key=lambda o: o["date"]
+    )
+    if not reportees:
+        return regulieres()
+    return heapq.merge(regulieres(), reportees, key=lambda o: o["date"])
+
+def compter_occurrences(plan, debut, fin):
+    """Nombre d'occurrences d'un plan dans [debut, fin], calculé sans les générer"""
+    if not plan.get("actif", True):
+        return 0
+    regle = regle_plan(plan)
+    borne = _borne_plan(plan, fin)
+    nombre = max(_premier_rang(regle, borne + datetime.timedelta(days=1)) - _premier_rang(regle, debut), 0)
+    debut_iso, borne_iso, fin_iso = debut.isoformat(), borne.isoformat(), fin.isoformat()
+    fin_plan_iso = plan.get("date_fin") or "9999-12-31"
+    for date_prevue, exception in plan.get("exceptions", {}).items():
+        date_effective = exception.get("date", date_prevue)
+        dans_fenetre = debut_iso <= date_prevue <= borne_iso
+        if exception.get("etat") == "⏭️ Sautée":
+            nombre -= int(dans_fenetre)
+            continue
+        reste = date_prevue <= fin_plan_iso and debut_iso <= date_effective <= fin_iso
+        nombre += int(reste) - int(dans_fenetre)
+    return nombre
+
+def planning_preventif(plans, debut, fin):
+    """Occurrences de plusieurs plans fusionnées par date, produites à la demande"""
+    return heapq.merge(*(occurrences_plan(plan, debut, fin) for plan in plans), key=lambda o: o["date"])
+
+def fenetre_periode(periode, aujourd_hui=None):
+    """Bornes (début, fin) d'une période du planning"""
+    aujourd_hui = aujourd_hui or datetime.date.today()
+    if periode == "Semaine en cours":
+        debut = aujourd_hui - datetime.timedelta(days=aujourd_hui.weekday())
+        return debut, debut + datetime.timedelta(days=6)
+    if periode == "Mois en cours":
+        debut = aujourd_hui.replace(day=1)
+        return debut, debut.replace(day=calendar.monthrange(debut.year, debut.month)[1])
+    if periode == "Trimestre":
+        mois = (aujourd_hui.month - 1) // 3 * 3 + 1
+        debut = aujourd_hui.replace(month=mois, day=1)
+        return debut, debut.replace(month=mois + 2, day=calendar.monthrange(debut.year, mois + 2)[1])
+    return aujourd_hui.replace(month=1, day=1), aujourd_hui.replace(month=12, day=31)
+
+# ========== HABILITATIONS ==========
+# Durée de validité (années) des habilitations à recycler, reconnues au début de leur libellé
+VALIDITE_HABILITATIONS = {
+    "Habilitation Électrique": 3,
+    "Sauveteur Secouriste du Travail": 2,
+    "Travaux en Hauteur": 3,
+    "CACES": 5,
+    "ATEX": 3
+}
+
+def validite_habilitation(libelle):
+    """Durée de validité en années d'une habilitation d'après son libellé (None si elle n'expire pas)"""
+    return next((annees for prefixe, annees in VALIDITE_HABILITATIONS.items() if libelle.startswith(prefixe)), None)
+
+def ajouter_annees(date_iso, annees):
+    """Date ISO décalée d'un nombre d'années (le 29 février devient le 28)"""
+    date = datetime.date.fromisoformat(date_iso[:10])
+    try:
+        return date.replace(year=date.year + annees).isoformat()
+    except ValueError:
+        return date.replace(year=date.year + annees, day=28).isoformat()
+
+def titre_provisoire(habilitation):
+    """Indique si un titre est celui créé sans dates pour une habilitation listée sur la fiche, en attente du titre réel"""
+    return not habilitation.get("date_obtention") and not habilitation.get("date_expiration")
+
+class ValiditesHabilitations:
+    """Échéance en vigueur de chaque (personnel, habilitation), pour un contrôle de validité en temps constant"""
+    
+    def __init__(self):
+        # (personnel_id, libelle) -> {id: date_expiration} de tous les titres (renouvellements compris), id -> clé
+        self._titres = {}
+        self._cles = {}
+        # ids des titres provisoires (sans dates), écartés dès qu'un titre daté existe
+        self._provisoires = set()
+        # (personnel_id, libelle) -> (id, date_expiration) du titre en vigueur ; "" = sans échéance
+        self.en_vigueur = {}
+    
+    def rebuild(self, habilitations):
+        """Recalcule l'index (au chargement uniquement)"""
+        self.__init__()
+        for habilitation in habilitations:
+            self.add(habilitation)
+    
+    def apply(self, op, habilitation):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'un titre d'habilitation"""
+        self.remove(habilitation["id"])
+        if op != "delete":
+            self.add(habilitation)
+    
+    def add(self, habilitation):
+        """Ajoute un titre à l'index"""
+        cle = (habilitation["personnel_id"], habilitation["libelle"])
+        self._cles[habilitation["id"]] = cle
+        self._titres.setdefault(cle, {})[habilitation["id"]] = habilitation.get("date_expiration") or ""
+        if titre_provisoire(habilitation):
+            self._provisoires.add(habilitation["id"])
+        self._elire(cle)
+    
+    def remove(self, habilitation_id):
+        """Retire un titre de l'index"""
+        cle = self._cles.pop(habilitation_id, None)
+        if cle is None:
+            return
+        self._provisoires.discard(habilitation_id)
+        titres = self._titres[cle]
+        del titres[habilitation_id]
+        if not titres:
+            del self._titres[cle]
+        self._elire(cle)
+    
+    def _elire(self, cle):
+        """Le titre en vigueur est celui qui expire le plus tard (un titre sans échéance l'emporte, un titre provisoire jamais)"""
+        titres = self._titres.get(cle)
+        if not titres:
+            self.en_vigueur.pop(cle, None)
+        else:
+            self.en_vigueur[cle] = max(titres.items(), key=lambda titre: (
+                titre[0] not in self._provisoires, titre[1] or "9999-12-31", titre[0]))
+    
+    def valide(self, personnel_id, libelle, jour):
+        """Indique si l'habilitation est valide le jour donné (date ou ISO) ; une aptitude sans titre suivi l'est toujours"""
+        titre = self.en_vigueur.get((personnel_id, libelle))
+        return titre is None or not titre[1] or str(jour)[:10] <= titre[1]
+    
+    def est_en_vigueur(self, habilitation):
+        """Indique si un titre est celui en vigueur pour son (personnel, habilitation), et non un titre renouvelé"""
+        titre = self.en_vigueur.get((habilitation["personnel_id"], habilitation["libelle"]))
+        return titre is not None and titre[0] == habilitation["id"]
+
+# ========== ORDONNANCEMENT DES TECHNICIENS ==========
+class Ordonnanceur:
+    """Affectation gloutonne des Bons de Travail ouverts aux techniciens disponibles et aptes, tenue à jour BT par BT"""
+    
+    # Capacité d'un technicien par jour ouvré et temps de trajet entre deux ateliers (heures)
+    CAPACITE_JOUR = 8.0
+    DEPLACEMENT = 0.5
+    DUREE_DEFAUT = 2.0
+    HEURE_DEBUT = 8
+    # Nombre de jours ouvrés au-delà de la date souhaitée avant de déclarer un BT non affecté
+    REPORT_MAX = 5
+    STATUT_DISPONIBLE = "🟢 Actif"
+    STATUTS_CLOS = ("🟢 Terminé", "✅ Clôturé", "✅ Réalisé")
+    # Un BT commencé reste au technicien qui l'a démarré
+    STATUTS_EN_COURS = ("🔵 En cours", "🟡 En cours")
+    RANG_PRIORITE = {"Urgente": 0, "Haute": 1, "Normale": 2, "Basse": 3}
+    # Aptitudes exigées d'après le type de travaux et les risques identifiés sur le BT
+    HABILITATION_ELECTRIQUE = "Habilitation Électrique B2V-H2V"
+    EXIGENCES_TYPE = {
+        "Électrique": (HABILITATION_ELECTRIQUE,),
+        "Électronique": (HABILITATION_ELECTRIQUE,),
+        "Automatisme": (HABILITATION_ELECTRIQUE,)
+    }
+    EXIGENCES_RISQUES = {
+        "Électrique": (HABILITATION_ELECTRIQUE,),
+        "Hauteur": ("Travaux en Hauteur Niveau 3",)
+    }
+    
+    def __init__(self, aujourd_hui=None, validites=None):
+        self.aujourd_hui = aujourd_hui
+        # Échéances des habilitations (ValiditesHabilitations) : un titre expiré écarte le technicien ce jour-là
+        self.validites = validites
+        # id -> {"nom", "aptitudes"} pour tout l'effectif, nom -> id
+        self.techniciens = {}
+        self._par_nom = {}
+        # Aptitude -> ids des techniciens disponibles, exigences -> ids éligibles (vidé quand l'effectif change)
+        self._par_aptitude = {}
+        self._eligibles = {}
+        # (technicien, jour) -> ids des BT dans l'ordre de passage, heures occupées (trajets compris)
+        self._journees = {}
+        self._charges = {}
+        # Technicien -> ids des BT affectés, heures affectées sur tout l'horizon
+        self._par_technicien = {}
+        self._charge_totale = {}
+        # Caractéristiques d'ordonnancement de chaque BT ouvert
+        self._taches = {}
+        # bt_id -> {"technicien", "jour", "debut", "fin"} ; bt_id -> motif
+        self.affectations = {}
+        self.non_affectes = {}
+    
+    def charger(self, personnels, bons_travail):
+        """Construit le plan complet (au premier usage uniquement) : BT triés par date, priorité puis durée décroissante"""
+        for personnel in personnels:
+            self._ajouter_technicien(personnel)
+        taches = [self._tache(bt) for bt in bons_travail if self._ouvert(bt)]
+        taches.sort(key=lambda t: (t["jour"], self.RANG_PRIORITE.get(t["priorite"], 2), -t["duree"], t["id"]))
+        for tache in taches:
+            self._taches[tache["id"]] = tache
+            self._placer(tache)
+    
+    def apply(self, collection, op, record):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'un BT ou d'un personnel sur le plan"""
+        if collection == "bons_travail":
+            libere = record["id"] in self.affectations
+            self._retirer(record["id"])
+            if op != "delete" and self._ouvert(record):
+                tache = self._tache(record)
+                self._taches[tache["id"]] = tache
+                self._placer(tache)
+            # La capacité libérée profite aux BT restés sans technicien
+            if libere:
+                self._reessayer()
+        elif collection == "personnels":
+            self._retirer_technicien(record["id"])
+            if op != "delete":
+                self._ajouter_technicien(record)
+            # Seuls les BT du technicien modifié et ceux restés sans technicien sont replanifiés
+            for bt_id in sorted(self._par_technicien.pop(record["id"], set())):
+                self._liberer(bt_id)
+                self._placer(self._taches[bt_id])
+            self._reessayer()
+    
+    # --- Effectif ---
+    
+    def _ajouter_technicien(self, personnel):
+        aptitudes = set(personnel.get("competences") or []) | set(personnel.get("habilitations") or [])
+        self.techniciens[personnel["id"]] = {"nom": personnel.get("nom", ""), "aptitudes": aptitudes}
+        self._par_nom[personnel.get("nom", "")] = personnel["id"]
+        if personnel.get("statut") == self.STATUT_DISPONIBLE:
+            for aptitude in aptitudes | {None}:
+                self._par_aptitude.setdefault(aptitude, set()).add(personnel["id"])
+        self._eligibles = {}
+    
+    def _retirer_technicien(self, technicien_id):
+        technicien = self.techniciens.pop(technicien_id, None)
+        if technicien is None:
+            return
+        if self._par_nom.get(technicien["nom"]) == technicien_id:
+            del self._par_nom[technicien["nom"]]
+        for aptitude in technicien["aptitudes"] | {None}:
+            self._par_aptitude.get(aptitude, set()).discard(technicien_id)
+        self._eligibles = {}
+    
+    def _eligibles_pour(self, exigences):
+        """Techniciens disponibles possédant toutes les aptitudes exigées (intersection, plus petit ensemble d'abord)"""
+        eligibles = self._eligibles.get(exigences)
+        if eligibles is None:
+            ensembles = sorted((self._par_aptitude.get(aptitude, set()) for aptitude in exigences | {None}), key=len)
+            eligibles = set(ensembles[0]).intersection(*ensembles[1:])
+            self._eligibles[exigences] = eligibles
+        return eligibles
+    
+    # --- Bons de Travail ---
+    
+    def _ouvert(self, bt):
+        return bt.get("statut") not in self.STATUTS_CLOS
+    
+    def _tache(self, bt):
+        """Caractéristiques d'ordonnancement d'un BT : aptitudes exigées, jour souhaité, durée, atelier"""
+        exigences = set(bt.get("competences_requises") or []) | set(bt.get("habilitations_requises") or [])
+        exigences.update(self.EXIGENCES_TYPE.get(bt.get("type"), ()))
+        for risque in bt.get("risques") or []:
+            exigences.update(self.EXIGENCES_RISQUES.get(risque, ()))
+        date_souhaitee = bt.get("date_planifiee") or bt.get("date_intervention") or bt.get("date_prevue") or bt.get("date_creation")
+        aujourd_hui = self.aujourd_hui or datetime.date.today()
+        try:
+            jour = max(datetime.date.fromisoformat(str(date_souhaitee)[:10]), aujourd_hui)
+        except ValueError:
+            jour = aujourd_hui
+        return {
+            "id": bt.get("id"),
+            "exigences": frozenset(exigences),
+            "jour": jour,
+            "duree": min(duree_heures(bt.get("temps_estime"), self.DUREE_DEFAUT), self.CAPACITE_JOUR),
+            "atelier": atelier_de(bt.get("localisation")),
+            "priorite": bt.get("priorite", "Normale"),
+            "prefere": self._par_nom.get(bt.get("technicien")),
+            "fige": bt.get("statut") in self.STATUTS_EN_COURS
+        }
+    
+    def _jours_ouvres(self, jour):
+        """Jour souhaité (ou le jour ouvré suivant) puis les REPORT_MAX jours ouvrés suivants ; le dimanche est chômé"""
+        nombre = 0
+        while nombre <= self.REPORT_MAX:
+            if jour.weekday() != 6:
+                yield jour
+                nombre += 1
+            jour += datetime.timedelta(days=1)
+    
+    def _trajet(self, atelier_a, atelier_b):
+        return self.DEPLACEMENT if atelier_a and atelier_b and atelier_a != atelier_b else 0.0
+    
+    def _evaluer(self, technicien_id, jour, tache, forcer=False):
+        """Meilleure position d'insertion du BT dans la journée du technicien : (charge finale, trajet ajouté, position)"""
+        cle = (technicien_id, jour)
+        journee = self._journees.get(cle, [])
+        ateliers = [self._taches[bt_id]["atelier"] for bt_id in journee]
+        atelier = tache["atelier"]
+        meilleur = None
+        for position in range(len(journee) + 1):
+            precedent = ateliers[position - 1] if position else ""
+            suivant = ateliers[position] if position < len(ateliers) else ""
+            trajet = self._trajet(precedent, atelier) + self._trajet(atelier, suivant) - self._trajet(precedent, suivant)
+            if meilleur is None or trajet < meilleur[1]:
+                meilleur = (self._charges.get(cle, 0.0) + trajet + tache["duree"], trajet, position)
+        if meilleur[0] > self.CAPACITE_JOUR + 1e-9 and journee and not forcer:
+            return None
+        return meilleur
+    
+    def _meilleure_option(self, tache):
+        """Technicien, jour et position minimisant la fin de journée (makespan) puis les trajets et la charge cumulée"""
+        if tache["fige"]:
+            if tache["prefere"] not in self.techniciens:
+                return None
+            evaluation = self._evaluer(tache["prefere"], tache["jour"], tache, forcer=True)
+            return tache["prefere"], tache["jour"], evaluation[2]
+        eligibles = self._eligibles_pour(tache["exigences"])
+        for jour in self._jours_ouvres(tache["jour"]):
+            # Le technicien déjà indiqué sur le BT est conservé s'il est apte et disponible ce jour-là
+            if tache["prefere"] in eligibles and self._habilite(tache["prefere"], tache, jour):
+                evaluation = self._evaluer(tache["prefere"], jour, tache)
+                if evaluation is not None:
+                    return tache["prefere"], jour, evaluation[2]
+            meilleur = None
+            for technicien_id in eligibles:
+                if not self._habilite(technicien_id, tache, jour):
+                    continue
+                evaluation = self._evaluer(technicien_id, jour, tache)
+                if evaluation is None:
+                    continue
+                cle = (evaluation[0], evaluation[1], self._charge_totale.get(technicien_id, 0.0), technicien_id)
+                if meilleur is None or cle < meilleur[0]:
+                    meilleur = (cle, technicien_id, evaluation[2])
+            if meilleur is not None:
+                return meilleur[1], jour, meilleur[2]
+        return None
+    
+    def _habilite(self, technicien_id, tache, jour):
+        """Toutes les habilitations exigées du technicien sont en cours de validité ce jour-là (une lecture par exigence)"""
+        return self.validites is None or all(
+            self.validites.valide(technicien_id, exigence, jour) for exigence in tache["exigences"]
+        )
+    
+    def _motif(self, tache):
+        if tache["fige"]:
+            return "Démarré par un technicien absent de l'effectif"
+        eligibles = self._eligibles_pour(tache["exigences"])
+        if not eligibles:
+            return "Aucun technicien disponible avec les aptitudes requises"
+        if not any(self._habilite(technicien_id, tache, tache["jour"]) for technicien_id in eligibles):
+            return "Habilitation requise expirée pour tous les techniciens aptes"
+        return f"Capacité insuffisante jusqu'à {self.REPORT_MAX} jours ouvrés après la date souhaitée"
+    
+    def _placer(self, tache):
+        option = self._meilleure_option(tache)
+        if option is None:
+            self.non_affectes[tache["id"]] = self._motif(tache)
+            return
+        technicien_id, jour, position = option
+        self._journees.setdefault((technicien_id, jour), []).insert(position, tache["id"])
+        self._par_technicien.setdefault(technicien_id, set()).add(tache["id"])
+        self._charge_totale[technicien_id] = self._charge_totale.get(technicien_id, 0.0) + tache["duree"]
+        self.affectations[tache["id"]] = {"technicien": technicien_id, "jour": jour}
+        self._recalculer_journee(technicien_id, jour)
+    
+    def _liberer(self, bt_id):
+        """Retire un BT de sa journée sans oublier ses caractéristiques"""
+        self.non_affectes.pop(bt_id, None)
+        affectation = self.affectations.pop(bt_id, None)
+        if affectation is None:
+            return
+        technicien_id, jour = affectation["technicien"], affectation["jour"]
+        self._journees[(technicien_id, jour)].remove(bt_id)
+        self._par_technicien.get(technicien_id, set()).discard(bt_id)
+        self._charge_totale[technicien_id] -= self._taches[bt_id]["duree"]
+        self._recalculer_journee(technicien_id, jour)
+    
+    def _retirer(self, bt_id):
+        if bt_id in self._taches:
+            self._liberer(bt_id)
+            del self._taches[bt_id]
+    
+    def _recalculer_journee(self, technicien_id, jour):
+        """Horaires de passage et charge d'une journée (quelques BT au plus)"""
+        cle = (technicien_id, jour)
+        heure, atelier = 0.0, ""
+        for bt_id in self._journees.get(cle, []):
+            tache = self._taches[bt_id]
+            heure += self._trajet(atelier, tache["atelier"])
+            self.affectations[bt_id].update(debut=heure, fin=heure + tache["duree"])
+            heure += tache["duree"]
+            atelier = tache["atelier"]
+        if self._journees.get(cle):
+            self._charges[cle] = heure
+        else:
+            self._charges.pop(cle, None)
+            self._journees.pop(cle, None)
+    
+    def _reessayer(self):
+        """Tente de placer les BT restés sans technicien (capacité ou effectif libérés)"""
+        for bt_id in sorted(self.non_affectes):
+            del self.non_affectes[bt_id]
+            self._placer(self._taches[bt_id])
+    
+    # --- Consultation ---
+    
+    def proposer(self, bt):
+        """Technicien et jour qui seraient retenus pour un BT, sans modifier le plan (None si aucun)"""
+        tache = self._tache(bt)
+        tache["fige"] = False
+        if tache["id"] in self._taches:
+            return self.affectation(tache["id"])
+        option = self._meilleure_option(tache)
+        if option is None:
+            return None
+        return {"technicien": self.techniciens[option[0]]["nom"], "jour": option[1]}
+    
+    def affectation(self, bt_id):
+        """Affectation courante d'un BT : nom du technicien, jour et horaires (None si non affecté)"""
+        affectation = self.affectations.get(bt_id)
+        if affectation is None:
+            return None
+        return {**affectation, "technicien": self.techniciens[affectation["technicien"]]["nom"]}
+    
+    def plan(self, debut=None, fin=None):
+        """Affectations d'une période triées par jour, technicien puis heure de passage"""
+        lignes = [
+            {"bt_id": bt_id, **self.affectation(bt_id)} for bt_id, affectation in self.affectations.items()
+            if (debut is None or affectation["jour"] >= debut) and (fin is None or affectation["jour"] <= fin)
+        ]
+        lignes.sort(key=lambda ligne: (ligne["jour"], ligne["technicien"], ligne["debut"]))
+        return lignes
+    
+    def charges(self, debut=None, fin=None):
+        """Heures occupées (trajets compris) par technicien et par jour sur une période"""
+        charges = {}
+        for (technicien_id, jour), heures in self._charges.items():
+            if (debut is None or jour >= debut) and (fin is None or jour <= fin):
+                charges.setdefault(self.techniciens[technicien_id]["nom"], {})[jour] = heures
+        return charges
+
+def duree_heures(temps_estime, defaut=2.0):
+    """Durée en heures d'un temps estimé saisi ("2h", "1h30", "1 jour", "Plus" ou nombre)"""
+    texte = str(temps_estime or "").strip().lower().replace(",", ".")
+    if not texte:
+        return defaut
+    if "jour" in texte or texte == "plus":
+        return Ordonnanceur.CAPACITE_JOUR
+    correspondance = re.match(r"(\d+(?:\.\d+)?)\s*h?\s*(\d+)?", texte)
+    if not correspondance:
+        return defaut
+    return float(correspondance.group(1)) + int(correspondance.group(2) or 0) / 60
+
+def atelier_de(localisation):
+    """Atelier d'une localisation ("Atelier A - Rack O1" -> "Atelier A")"""
+    return str(localisation or "").split(" - ")[0].strip()
+
+# ========== EMPRUNTS D'OUTILLAGES ==========
+EMPRUNT, RETOUR = "📤 Emprunt", "📥 Retour"
+
+class EmpruntsEnCours:
+    """Emprunts ouverts par outillage, triés sur la date de retour prévue, tenus à jour à chaque événement"""
+    
+    def __init__(self):
+        # outillage_id -> événement d'emprunt ouvert, id d'emprunt -> événement de retour
+        self.ouverts = {}
+        self.retours = {}
+        # (date_retour_prevue, outillage_id) des emprunts ouverts, triés
+        self._echeances = []
+    
+    def rebuild(self, evenements):
+        """Rejoue tous les événements dans l'ordre de leurs ids (au chargement uniquement)"""
+        self.__init__()
+        for evenement in sorted(evenements, key=lambda evenement: evenement["id"]):
+            self.add(evenement)
+    
+    def add(self, evenement):
+        """Reporte un nouvel événement d'emprunt ou de retour"""
+        outillage_id = evenement["outillage_id"]
+        if evenement["type"] == EMPRUNT:
+            self._fermer(outillage_id)
+            self.ouverts[outillage_id] = evenement
+            bisect.insort(self._echeances, (evenement["date_retour_prevue"], outillage_id))
+            return
+        self.retours[evenement["emprunt_id"]] = evenement
+        ouvert = self.ouverts.get(outillage_id)
+        if ouvert is not None and ouvert["id"] == evenement["emprunt_id"]:
+            self._fermer(outillage_id)
+    
+    def _fermer(self, outillage_id):
+        """Retire l'emprunt ouvert d'un outillage de l'index des échéances"""
+        ouvert = self.ouverts.pop(outillage_id, None)
+        if ouvert is not None:
+            del self._echeances[bisect.bisect_left(self._echeances, (ouvert["date_retour_prevue"], outillage_id))]
+    
+    def echeant_avant(self, date=None):
+        """Ids des outillages empruntés dont le retour est prévu avant une date ISO (tous sans date), par échéance"""
+        fin = bisect.bisect_left(self._echeances, (date,)) if date is not None else len(self._echeances)
+        return [outillage_id for _, outillage_id in self._echeances[:fin]]
+
+# Disponibilités permettant une réservation (un outillage emprunté peut être réservé après son retour prévu)
+DISPONIBILITES_RESERVABLES = ("🟢 Disponible", "🟡 Emprunté")
+
+class ReservationConflitError(ValueError):
+    """Période déjà réservée ou empruntée pour cet outillage"""
+
+class PlanningReservations:
+    """Périodes réservées de chaque outillage : intervalles disjoints triés par début, vérifiés par dichotomie"""
+    
+    def __init__(self):
+        # outillage_id -> liste triée de (debut, fin, reservation_id), dates ISO incluses
+        self._periodes = {}
+        # reservation_id -> (outillage_id, debut, fin) pour retirer exactement l'entrée indexée
+        self._reservations = {}
+    
+    def rebuild(self, reservations):
+        """Recalcule l'index (au chargement uniquement)"""
+        self.__init__()
+        for reservation in reservations:
+            self.add(reservation)
+    
+    def apply(self, op, reservation):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'une réservation"""
+        self.remove(reservation["id"])
+        if op != "delete":
+            self.add(reservation)
+    
+    def add(self, reservation):
+        """Ajoute une réservation à l'index"""
+        entree = (reservation["debut"], reservation["fin"], reservation["id"])
+        self._reservations[reservation["id"]] = (reservation["outillage_id"], *entree[:2])
+        bisect.insort(self._periodes.setdefault(reservation["outillage_id"], []), entree)
+    
+    def remove(self, reservation_id):
+        """Retire une réservation de l'index"""
+        indexee = self._reservations.pop(reservation_id, None)
+        if indexee is None:
+            return
+        outillage_id, debut, fin = indexee
+        periodes = self._periodes[outillage_id]
+        del periodes[bisect.bisect_left(periodes, (debut, fin, reservation_id))]
+    
+    def conflit(self, outillage_id, debut, fin, ignorer=()):
+        """Id de la première réservation de l'outillage chevauchant [debut, fin] (hors ids ignorés), ou None"""
+        periodes = self._periodes.get(outillage_id, [])
+        # Les périodes commençant au plus tard à fin ; disjointes, leurs fins sont triées aussi :
+        # celles qui se terminent après debut forment la fin de cette tranche
+        i = bisect.bisect_right(periodes, (fin, "\uffff"))
+        while i > 0 and periodes[i - 1][1] >= debut:
+            i -= 1
+            if periodes[i][2] not in ignorer:
+                return periodes[i][2]
+        return None
+    
+    def periodes(self, outillage_id):
+        """(debut, fin, reservation_id) des réservations d'un outillage, par date de début"""
+        return list(self._periodes.get(outillage_id, []))
+
+# ========== VÉRIFICATIONS DES OUTILLAGES ==========
+TYPE_BT_VERIFICATION = "Vérification outillage"
+# Périodicité appliquée quand la fiche ne permet pas de la déduire (jours)
+PERIODICITE_VERIFICATION_DEFAUT = 180
+CHECKLIST_VERIFICATION = [
+    "Contrôler l'état général et la propreté",
+    "Vérifier le fonctionnement et les sécurités",
+    "Étalonner ou comparer à la référence si applicable",
+    "Mettre à jour l'étiquette de vérification"
+]
+
+def periodicite_verification(outillage):
+    """Périodicité de vérification d'un outillage (jours), déduite de l'écart entre ses deux dernières échéances"""
+    try:
+        ecart = (datetime.date.fromisoformat(outillage["date_prochaine_verification"][:10])
+                 - datetime.date.fromisoformat(outillage["date_derniere_verification"][:10])).days
+    except (KeyError, TypeError, ValueError):
+        return PERIODICITE_VERIFICATION_DEFAUT
+    return ecart if ecart > 0 else PERIODICITE_VERIFICATION_DEFAUT
+
+# ========== PARC D'ÉQUIPEMENTS ==========
+# Niveaux de l'arborescence, du plus large au plus fin : un nœud est rattaché à un niveau supérieur au sien
+NIVEAUX_EQUIPEMENT = ["Site", "Zone", "Ligne", "Équipement"]
+ETATS_EQUIPEMENT = ["✅ Opérationnel", "⚠️ Maintenance", "❌ Hors service"]
+TYPES_EQUIPEMENT = ["Formage", "Usinage", "Traitement thermique", "Assemblage", "Utilitaire", "Transport", "Contrôle"]
+
+class EquipementInvalideError(ValueError):
+    """Code en double ou rattachement impossible dans l'arborescence du parc"""
+
+class HierarchieEquipements:
+    """Arborescence du parc : parent, enfants, chemin depuis la racine et ensemble des descendants de chaque nœud"""
+    
+    def __init__(self):
+        # id -> id du parent (None pour une racine), id -> ids des enfants directs
+        self.parents = {}
+        self.enfants = {}
+        # id -> ids des ancêtres de la racine au parent, id -> ids de tous les descendants (fermeture transitive)
+        self.chemins = {}
+        self.descendants = {}
+    
+    def rebuild(self, equipements):
+        """Recalcule l'arborescence (au chargement uniquement)"""
+        self.__init__()
+        for equipement in equipements:
+            self.parents[equipement["id"]] = equipement.get("parent_id")
+            self.enfants.setdefault(equipement["id"], set())
+            self.descendants.setdefault(equipement["id"], set())
+        for equipement_id, parent_id in self.parents.items():
+            if parent_id is not None:
+                self.enfants.setdefault(parent_id, set()).add(equipement_id)
+        for equipement_id in self.parents:
+            chemin = self._chemin(equipement_id)
+            for ancetre_id in chemin:
+                self.descendants.setdefault(ancetre_id, set()).add(equipement_id)
+    
+    def _chemin(self, equipement_id):
+        """Chemin d'un nœud, calculé en remontant jusqu'au premier ancêtre dont le chemin est connu"""
+        remontee = []
+        noeud = equipement_id
+        while noeud in self.parents and noeud not in self.chemins and noeud not in remontee:
+            remontee.append(noeud)
+            noeud = self.parents[noeud]
+        # Un parent inconnu ou une boucle (données corrompues) fait du nœud une racine
+        chemin = self.chemins[noeud] + (noeud,) if noeud in self.chemins else ()
+        for noeud in reversed(remontee):
+            self.chemins[noeud] = chemin
+            chemin = chemin + (noeud,)
+        return self.chemins[equipement_id]
+    
+    def apply(self, op, equipement):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'un nœud"""
+        equipement_id = equipement["id"]
+        if op == "delete":
+            # Les enfants éventuels deviennent des racines
+            for enfant_id in list(self.enfants.get(equipement_id, ())):
+                self._deplacer(enfant_id, None)
+            self._deplacer(equipement_id, None)
+            for table in (self.parents, self.enfants, self.chemins, self.descendants):
+                table.pop(equipement_id, None)
+        elif op == "insert" or self.parents.get(equipement_id) != equipement.get("parent_id"):
+            self._deplacer(equipement_id, equipement.get("parent_id"))
+    
+    def _deplacer(self, equipement_id, parent_id):
+        """Rattache un nœud (et son sous-arbre) à un nouveau parent : seuls les ancêtres et le sous-arbre concernés changent"""
+        sous_arbre = {equipement_id} | self.descendants.setdefault(equipement_id, set())
+        ancien_chemin = self.chemins.get(equipement_id, ())
+        for ancetre_id in ancien_chemin:
+            self.descendants[ancetre_id] -= sous_arbre
+        ancien_parent = self.parents.get(equipement_id)
+        if ancien_parent is not None:
+            self.enfants.get(ancien_parent, set()).discard(equipement_id)
+        
+        self.parents[equipement_id] = parent_id
+        self.enfants.setdefault(equipement_id, set())
+        nouveau_chemin = ()
+        if parent_id in self.parents:
+            nouveau_chemin = self.chemins[parent_id] + (parent_id,)
+            self.enfants[parent_id].add(equipement_id)
+        for ancetre_id in nouveau_chemin:
+            self.descendants[ancetre_id] |= sous_arbre
+        # Le chemin de chaque nœud du sous-arbre garde sa partie située sous le nœud déplacé
+        profondeur = len(ancien_chemin)
+        for noeud in sous_arbre:
+            self.chemins[noeud] = nouveau_chemin + self.chemins.get(noeud, ancien_chemin)[profondeur:]
+    
+    def sous_arbre(self, equipement_id):
+        """Ids d'un nœud et de tous ses descendants (une lecture de la fermeture)"""
+        return {equipement_id} | self.descendants.get(equipement_id, set())
+
+# ========== STOCKS ==========
+ENTREE, SORTIE, AJUSTEMENT = "📥 Entrée", "📤 Sortie", "⚖️ Ajustement"
+TYPES_MOUVEMENT = (ENTREE, SORTIE, AJUSTEMENT)
+
+class StockInsuffisantError(ValueError):
+    """Levée quand un mouvement rendrait négatif le stock d'un article"""
+
+def solde_apres_mouvement(article, quantite, prix_unitaire=None):
+    """Solde (quantité, valeur) d'un article après un mouvement signé : entrée au prix d'achat, le reste au coût moyen pondéré"""
+    stock, valeur = article.get("quantite", 0), article.get("valeur", 0.0)
+    nouveau_stock = stock + quantite
+    if nouveau_stock < 0:
+        raise StockInsuffisantError(f"Stock insuffisant pour {article.get('reference', '')} : {stock:g} disponible(s)")
+    if quantite > 0 and prix_unitaire is not None:
+        return nouveau_stock, round(valeur + quantite * prix_unitaire, 2)
+    if nouveau_stock == 0:
+        return 0, 0.0
+    cout_moyen = valeur / stock if stock else article.get("prix_unitaire", 0.0)
+    return nouveau_stock, round(valeur + quantite * cout_moyen, 2)
+
+def etat_stock(article):
+    """État d'un article d'après son solde et son seuil minimum"""
+    if article.get("quantite", 0) <= 0:
+        return "🔴 Rupture"
+    if article.get("quantite", 0) <= article.get("seuil_minimum", 0):
+        return "⚠️ Critique"
+    return "✅ Suffisant"
+
+def ratio_stock(article):
+    """Stock rapporté au seuil minimum (0 pour une rupture, infini sans seuil)"""
+    quantite, seuil = article.get("quantite", 0), article.get("seuil_minimum", 0)
+    if quantite <= 0:
+        return 0.0
+    return quantite / seuil if seuil > 0 else float("inf")
+
+class AlertesStock:
+    """Articles sous leur seuil minimum et totaux du stock, tenus à jour à chaque mouvement (sans parcourir les articles)"""
+    
+    # Le tas est reconstruit quand il contient plus de ce multiple d'entrées que d'articles critiques
+    FACTEUR_COMPACTAGE = 2
+    
+    def __init__(self):
+        # id -> ratio stock/seuil des articles critiques, ids en rupture, ids avec une commande en cours
+        self.critiques = {}
+        self.ruptures = set()
+        self.en_commande = set()
+        # (ratio, id) des articles critiques ; une entrée dont le ratio ne correspond plus est périmée et ignorée
+        self._tas = []
+        # id -> valeur de stock ajoutée au total, pour retirer exactement la même contribution
+        self._valeurs = {}
+        self.valeur_totale = 0.0
+    
+    def rebuild(self, articles):
+        """Recalcule l'index (au chargement uniquement)"""
+        self.__init__()
+        for article in articles:
+            self.add(article)
+    
+    def apply(self, op, article):
+        """Reporte une modification (op = "insert", "update" ou "delete") d'un article"""
+        self.remove(article["id"])
+        if op != "delete":
+            self.add(article)
+    
+    def add(self, article):
+        """Ajoute un article à l'index"""
+        article_id = article["id"]
+        self._valeurs[article_id] = article.get("valeur", 0.0)
+        self.valeur_totale += self._valeurs[article_id]
+        if article.get("en_commande"):
+            self.en_commande.add(article_id)
+        if etat_stock(article) == "✅ Suffisant":
+            return
+        if article.get("quantite", 0) <= 0:
+            self.ruptures.add(article_id)
+        ratio = ratio_stock(article)
+        self.critiques[article_id] = ratio
+        heapq.heappush(self._tas, (ratio, article_id))
+    
+    def remove(self, article_id):
+        """Retire un article de l'index (son entrée dans le tas devient périmée)"""
+        if article_id not in self._valeurs:
+            return
+        self.valeur_totale -= self._valeurs.pop(article_id)
+        self.en_commande.discard(article_id)
+        self.ruptures.discard(article_id)
+        self.critiques.pop(article_id, None)
+        if len(self._tas) > self.FACTEUR_COMPACTAGE * len(self.critiques) + 64:
+            self._tas = [(ratio, article_id) for article_id, ratio in self.critiques.items()]
+            heapq.heapify(self._tas)
+    
+    def plus_critiques(self, limit=None):
+        """Ids des articles critiques du plus faible ratio stock/seuil au plus élevé (les entrées périmées sont purgées)"""
+        retenus = []
+        vus = set()
+        while self._tas and (limit is None or len(retenus) < limit):
+            ratio, article_id = heapq.heappop(self._tas)
+            if self.critiques.get(article_id) == ratio and article_id not in vus:
+                retenus.append((ratio, article_id))
+                vus.add(article_id)
+        for entree in retenus:
+            heapq.heappush(self._tas, entree)
+        return [article_id for _, article_id in retenus]
+    
+    def synthese(self):
+        """Nombre d'articles, valeur totale, articles sous le seuil, ruptures et commandes en cours"""
+        return {"articles": len(self._valeurs), "valeur": round(self.valeur_totale, 2),
+                "a_reapprovisionner": len(self.critiques), "ruptures": len(self.ruptures),
+                "en_commande": len(self.en_commande)}
+
+# Paramètres du calcul de réapprovisionnement
+HISTORIQUE_CONSOMMATION_SEMAINES = 52
+COEFFICIENT_SERVICE = 1.65  # taux de service visé de 95 %
+COUT_PASSATION_COMMANDE = 50.0  # € par commande
+TAUX_POSSESSION_ANNUEL = 0.25  # coût de possession annuel, en part du prix unitaire
+DELAI_LIVRAISON_DEFAUT = 7  # jours, fournisseur inconnu
+NOTE_FIABILITE_DEFAUT = 3.0  # sur 5, fournisseur inconnu
+
+def consommation_hebdomadaire(mouvements, aujourd_hui):
+    """Somme et somme des carrés des sorties hebdomadaires par article sur l'historique de consommation"""
+    vide = pd.DataFrame({"somme": pd.Series(dtype=float), "carres": pd.Series(dtype=float)})
+    if mouvements.empty:
+        return vide
+    # Semaines pleines se terminant aujourd'hui inclus
+    debut = pd.Timestamp(aujourd_hui - datetime.timedelta(weeks=HISTORIQUE_CONSOMMATION_SEMAINES, days=-1))
+    dates = pd.to_datetime(mouvements["date"], errors="coerce")
+    masque = (mouvements["type"] == SORTIE) & (dates >= debut)
+    if not masque.any():
+        return vide
+    hebdo = pd.DataFrame({
+        "article_id": mouvements.loc[masque, "article_id"].to_numpy(),
+        "semaine": ((dates[masque] - debut).dt.days // 7).to_numpy(),
+        "quantite": -pd.to_numeric(mouvements.loc[masque, "quantite"]).to_numpy()
+    }).groupby(["article_id", "semaine"])["quantite"].sum()
+    return pd.DataFrame({
+        "somme": hebdo.groupby(level=0).sum(),
+        "carres": hebdo.pow(2).groupby(level=0).sum()
+    })
+
+def calculer_reapprovisionnement(articles, mouvements, fournisseurs, aujourd_hui=None):
+    """Stock de sécurité, point de commande, quantité économique et commande proposée de tous les articles (calcul vectorisé)"""
+    aujourd_hui = aujourd_hui or datetime.date.today()
+    if articles.empty:
+        return pd.DataFrame()
+    
+    # Demande journalière moyenne et écart-type, semaines sans sortie comprises
+    semaines = HISTORIQUE_CONSOMMATION_SEMAINES
+    consommation = consommation_hebdomadaire(mouvements, aujourd_hui).reindex(articles.index, fill_value=0.0)
+    moyenne = consommation["somme"].to_numpy(dtype=float) / semaines
+    variance = np.maximum(consommation["carres"].to_numpy(dtype=float) / semaines - moyenne ** 2, 0.0) * semaines / (semaines - 1)
+    demande = moyenne / 7
+    ecart_type = np.sqrt(variance / 7)
+    
+    # Délai moyen du fournisseur ; un fournisseur peu fiable a des délais plus dispersés
+    if fournisseurs.empty:
+        references = pd.DataFrame(columns=["delai_livraison_moyen", "note_fiabilite"])
+    else:
+        references = fournisseurs.drop_duplicates("nom").set_index("nom").reindex(
+            columns=["delai_livraison_moyen", "note_fiabilite"])
+    fournisseur = articles["fournisseur"].fillna("")
+    delai = pd.to_numeric(fournisseur.map(references["delai_livraison_moyen"]), errors="coerce").fillna(DELAI_LIVRAISON_DEFAUT).to_numpy(dtype=float)
+    note = pd.to_numeric(fournisseur.map(references["note_fiabilite"]), errors="coerce").fillna(NOTE_FIABILITE_DEFAUT).to_numpy(dtype=float)
+    ecart_type_delai = delai * (1 - np.clip(note, 0, 5) / 5)
+    
+    stock_securite = COEFFICIENT_SERVICE * np.sqrt(delai * ecart_type ** 2 + demande ** 2 * ecart_type_delai ** 2)
+    point_commande = demande * delai + stock_securite
+    
+    # Quantité économique de Wilson : racine(2 × demande annuelle × coût de commande / coût de possession unitaire)
+    prix = pd.to_numeric(articles["prix_unitaire"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    possession = TAUX_POSSESSION_ANNUEL * prix
+    quantite_economique = np.sqrt(np.divide(2 * demande * 365 * COUT_PASSATION_COMMANDE, possession,
+                                            out=np.zeros_like(possession), where=possession > 0))
+    
+    # Le seuil minimum saisi reste un plancher ; on commande au moins la quantité économique,
+    # et de quoi remonter au double du point de commande (même règle que les alertes)
+    quantite = pd.to_numeric(articles["quantite"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    en_commande = pd.to_numeric(articles.reindex(columns=["en_commande"])["en_commande"].astype(object).str.get("quantite"), errors="coerce")
+    commande_ouverte = en_commande.notna().to_numpy()
+    position = quantite + en_commande.fillna(0.0).to_numpy(dtype=float)
+    seuil = pd.to_numeric(articles["seuil_minimum"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    point = np.maximum(point_commande, seuil)
+    proposee = np.ceil(np.maximum(quantite_economique, 2 * point - position))
+    proposee = np.where((position <= point) & ~commande_ouverte & (proposee > 0), proposee, 0.0)
+    
+    return pd.DataFrame({
+        "reference": articles["reference"],
+        "designation": articles["designation"],
+        "fournisseur": fournisseur,
+        "demande_jour": demande.round(3),
+        "delai": delai,
+        "stock_securite": stock_securite.round(1),
+        "point_commande": point.round(1),
+        "quantite_economique": quantite_economique.round(1),
+        "position": position,
+        "quantite_proposee": proposee,
+        "montant": (proposee * prix).round(2)
+    }, index=articles.index)
+
+def regrouper_par_fournisseur(propositions):
+    """Commandes proposées regroupées par fournisseur : nombre de lignes, quantités, montant et délai le plus long"""
+    lignes = propositions[propositions["quantite_proposee"] > 0] if not propositions.empty else propositions
+    if lignes.empty:
+        return pd.DataFrame(columns=["lignes", "quantite", "montant", "delai"])
+    return lignes.groupby("fournisseur").agg(
+        lignes=("reference", "size"), quantite=("quantite_proposee", "sum"),
+        montant=("montant", "sum"), delai=("delai", "max")
+    ).sort_values("montant", ascending=False)
+
+# ========== IMPORT EN MASSE ==========
+# Nombre de lignes lues et validées à la fois
+TAILLE_BLOC_IMPORT = 5000
+# Séparateur des valeurs multiples dans une cellule (compétences, habilitations, certifications)
+SEPARATEUR_LISTE = ";"
+VALEURS_VRAI = {"oui", "o", "vrai", "true", "1", "x"}
+VALEURS_FAUX = {"non", "n", "faux", "false", "0"}
+
+class ImportInvalideError(ValueError):
+    """Fichier illisible ou colonne obligatoire absente : rien n'est importé"""
+
+def completer_personnels(champs):
+    """Champs calculés d'un personnel importé (comme à la saisie) : ancienneté, dates de création et d'évaluation"""
+    aujourd_hui = datetime.date.today()
+    embauche = pd.to_datetime(champs["date_embauche"], errors="coerce") if "date_embauche" in champs else pd.Series(pd.NaT, index=champs.index)
+    anniversaire_passe = (embauche.dt.month < aujourd_hui.month) | ((embauche.dt.month == aujourd_hui.month) & (embauche.dt.day <= aujourd_hui.day))
+    annees = aujourd_hui.year - embauche.dt.year - (~anniversaire_passe).astype(int)
+    return {
+        "experience": (annees.astype("Int64").astype(str) + " an(s)").where(embauche.notna(), ""),
+        "date_creation": datetime.datetime.now().isoformat(),
+        "derniere_evaluation": aujourd_hui.isoformat()
+    }
+
+# Collections importables : colonnes (champ -> (libellé, type, valeur par défaut)), valeurs permises,
+# champs obligatoires, clé métier (doublons, mises à jour), champs fixés à la création et champs calculés
+SCHEMAS_IMPORT = {
+    "outillages": {
+        "libelle": "🛠️ Outillages",
+        "cle": "reference",
+        "obligatoires": ["reference", "nom", "localisation"],
+        "colonnes": {
+            "reference": ("Référence", "texte", ""),
+            "nom": ("Nom", "texte", ""),
+            "type": ("Type", "texte", "Autre"),
+            "marque": ("Marque", "texte", ""),
+            "modele": ("Modèle", "texte", ""),
+            "numero_serie": ("Numéro de série", "texte", ""),
+            "etat": ("État", "texte", "✅ Bon"),
+            "etat_detail": ("Détails état", "texte", ""),
+            "localisation": ("Localisation", "texte", ""),
+            "date_acquisition": ("Date d'acquisition", "date", ""),
+            "date_derniere_verification": ("Dernière vérification", "date", ""),
+            "date_prochaine_verification": ("Prochaine vérification", "date", ""),
+            "prix_acquisition": ("Prix d'acquisition", "nombre", 0.0),
+            "valeur_actuelle": ("Valeur actuelle", "nombre", 0.0),
+            "disponibilite": ("Disponibilité", "texte", "🟢 Disponible"),
+            "utilisation": ("Utilisation", "texte", ""),
+            "consommables_associes": ("Consommables associés", "texte", ""),
+            "fiche_technique": ("Fiche technique", "texte", ""),
+            "notes": ("Notes", "texte", "")
+        },
+        "choix": {
+            "type": ["Électroportatif", "Manuel", "Mesure", "Test", "Sécurité", "Transport", "Soudage", "Autre"],
+            "etat": ["✅ Excellent", "✅ Bon", "🟡 Correct", "🔴 Mauvais"],
+            # Un emprunt ne s'importe pas : il passe par le registre des emprunts
+            "disponibilite": ["🟢 Disponible", "🟡 En maintenance", "🔴 Hors service"]
+        },
+        "fixes": {"dernier_utilisateur": "", "date_dernier_emprunt": ""}
+    },
+    "personnels": {
+        "libelle": "👥 Personnels",
+        "cle": "matricule",
+        "obligatoires": ["nom", "matricule"],
+        "colonnes": {
+            "nom": ("Nom complet", "texte", ""),
+            "matricule": ("Matricule", "texte", ""),
+            "poste": ("Poste", "texte", ""),
+            "service": ("Service", "texte", "Non spécifié"),
+            "cout_horaire": ("Coût horaire", "nombre", 45.0),
+            "statut": ("Statut", "texte", "🟢 Actif"),
+            "competences": ("Compétences", "liste", []),
+            "habilitations": ("Habilitations", "liste", []),
+            "date_embauche": ("Date d'embauche", "date", ""),
+            "date_naissance": ("Date de naissance", "date", ""),
+            "telephone": ("Téléphone", "texte", ""),
+            "email": ("Email", "texte", ""),
+            "type_contrat": ("Type de contrat", "texte", "CDI"),
+            "adresse": ("Adresse", "texte", ""),
+            "diplome": ("Diplôme", "texte", ""),
+            "specialite": ("Spécialité", "texte", ""),
+            "notes": ("Notes", "texte", "")
+        },
+        "choix": {
+            "statut": ["🟢 Actif", "🟡 Congés", "🔴 Absent", "🟣 Formation", "⚫ Détaché"],
+            "type_contrat": ["CDI", "CDD", "Intérim", "Apprentissage", "Stage", "Consultant"]
+        },
+        "completer": completer_personnels
+    },
+    "fournisseurs": {
+        "libelle": "🏭 Fournisseurs",
+        "cle": "nom",
+        "obligatoires": ["nom"],
+        "colonnes": {
+            "nom": ("Nom", "texte", ""),
+            "specialite": ("Spécialité", "texte", ""),
+            "contact_nom": ("Contact", "texte", ""),
+            "contact_email": ("Email", "texte", ""),
+            "contact_telephone": ("Téléphone", "texte", ""),
+            "adresse": ("Adresse", "texte", ""),
+            "delai_livraison_moyen": ("Délai de livraison", "nombre", float(DELAI_LIVRAISON_DEFAUT)),
+            "mode_livraison": ("Mode de livraison", "texte", "Standard"),
+            "note_fiabilite": ("Note de fiabilité", "nombre", NOTE_FIABILITE_DEFAUT),
+            "contrat_actif": ("Contrat actif", "booleen", True),
+            "date_debut_contrat": ("Début du contrat", "date", ""),
+            "date_fin_contrat": ("Fin du contrat", "date", ""),
+            "conditions_paiement": ("Conditions de paiement", "texte", ""),
+            "notes": ("Notes", "texte", "")
+        },
+        "fixes": {"type": "fournisseur"}
+    },
+    "soustraitants": {
+        "libelle": "🤝 Sous-traitants",
+        "cle": "nom",
+        "obligatoires": ["nom"],
+        "colonnes": {
+            "nom": ("Nom", "texte", ""),
+            "specialite": ("Spécialité", "texte", ""),
+            "contact_nom": ("Contact", "texte", ""),
+            "contact_email": ("Email", "texte", ""),
+            "contact_telephone": ("Téléphone", "texte", ""),
+            "adresse": ("Adresse", "texte", ""),
+            "intervention_type": ("Type d'intervention", "texte", ""),
+            "taux_horaire": ("Taux horaire", "nombre", 0.0),
+            "zone_intervention": ("Zone d'intervention", "texte", ""),
+            "certifications": ("Certifications", "liste", []),
+            "contrat_actif": ("Contrat actif", "booleen", True),
+            "date_debut_contrat": ("Début du contrat", "date", ""),
+            "date_fin_contrat": ("Fin du contrat", "date", ""),
+            "assurance_rc_pro": ("Assurance RC Pro", "booleen", False),
+            "montant_assurance": ("Montant assurance", "texte", ""),
+            "notes": ("Notes", "texte", "")
+        },
+        "fixes": {"type": "soustraitant"},
+        # Les sous-traitants sont numérotés à partir de 101
+        "premier_id": 100
+    }
+}
+
+def colonnes_import(entetes, schema):
+    """Associe les en-têtes du fichier aux champs du schéma (nom du champ ou libellé, sans casse ni accents)"""
+    alias = {}
+    for champ, (libelle, _, _) in schema["colonnes"].items():
+        alias[normaliser_texte(champ)] = champ
+        alias[normaliser_texte(libelle)] = champ
+    correspondances = {}
+    for entete in entetes:
+        champ = alias.get(normaliser_texte(entete))
+        if champ is not None and champ not in correspondances.values():
+            correspondances[entete] = champ
+    manquantes = [schema["colonnes"][champ][0] for champ in schema["obligatoires"] if champ not in correspondances.values()]
+    if manquantes:
+        raise ImportInvalideError(f"Colonne(s) obligatoire(s) absente(s) : {', '.join(manquantes)}")
+    return correspondances
+
+def valider_bloc(bloc, schema, correspondances):
+    """Convertit un bloc de lignes (texte) colonne par colonne : (valeurs converties, cellules vides, erreurs)"""
+    # Une cellule vide prend la valeur par défaut ; chaque erreur est un (ligne, colonne, valeur, message)
+    champs, vides, erreurs = {}, {}, []
+    for entete, champ in correspondances.items():
+        libelle, type_champ, defaut = schema["colonnes"][champ]
+        texte = bloc[entete].fillna("").astype(str).str.strip()
+        vide = texte == ""
+        
+        def signaler(masque, message):
+            # Ligne 1 : en-têtes ; l'index du bloc compte les lignes de données à partir de 0
+            erreurs.extend((index + 2, libelle, texte.at[index], message) for index in masque[masque].index)
+        
+        if type_champ == "nombre":
+            # Espaces (y compris insécables) comme séparateurs de milliers, virgule décimale acceptée
+            valeurs = pd.to_numeric(texte.str.replace(r"\s", "", regex=True).str.replace(",", "."), errors="coerce")
+            signaler(~vide & (valeurs.isna() | (valeurs < 0)), "nombre positif attendu")
+            valeurs = valeurs.fillna(defaut).astype(float)
+        elif type_champ == "date":
+            # Format ISO (AAAA-MM-JJ, éventuellement suivi d'une heure) ou JJ/MM/AAAA
+            dates = pd.to_datetime(texte.str[:10], format="%Y-%m-%d", errors="coerce")
+            dates = dates.fillna(pd.to_datetime(texte, format="%d/%m/%Y", errors="coerce"))
+            signaler(~vide & dates.isna(), "date attendue (AAAA-MM-JJ ou JJ/MM/AAAA)")
+            valeurs = dates.dt.strftime("%Y-%m-%d").fillna(defaut)
+        elif type_champ == "liste":
+            valeurs = texte.str.split(SEPARATEUR_LISTE).map(lambda elements: [e.strip() for e in elements if e.strip()])
+        elif type_champ == "booleen":
+            minuscules = texte.str.lower()
+            signaler(~vide & ~minuscules.isin(VALEURS_VRAI | VALEURS_FAUX), "oui/non attendu")
+            valeurs = minuscules.isin(VALEURS_VRAI).where(~vide, defaut)
+        else:
+            valeurs = texte.where(~vide, defaut)
+            if champ in schema.get("choix", {}):
+                signaler(~vide & ~texte.isin(schema["choix"][champ]), "valeur non reconnue")
+        if champ in schema["obligatoires"]:
+            signaler(vide, "valeur obligatoire")
+        champs[champ], vides[champ] = valeurs, vide
+    return pd.DataFrame(champs, index=bloc.index), pd.DataFrame(vides, index=bloc.index), erreurs
+
+def lire_blocs(fichier, nom_fichier, taille=TAILLE_BLOC_IMPORT):
+    """Lit un fichier CSV ou Excel (.xlsx) par blocs de lignes, toutes les valeurs en texte"""
+    if nom_fichier.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ImportInvalideError("La lecture des fichiers Excel nécessite le paquet openpyxl (ou importez un CSV)")
+        classeur = openpyxl.load_workbook(fichier, read_only=True, data_only=True)
+        try:
+            lignes = classeur.active.iter_rows(values_only=True)
+            entetes = [str(valeur).strip() if valeur is not None else "" for valeur in next(lignes, ())]
+            largeur, debut = len(entetes), 0
+            while True:
+                paquet = [tuple(ligne[:largeur]) + (None,) * (largeur - len(ligne)) for ligne in itertools.islice(lignes, taille)]
+                if not paquet:
+                    return
+                bloc = pd.DataFrame(paquet, columns=entetes, index=range(debut, debut + len(paquet)), dtype=object)
+                # Dates Excel : la partie date suffit ; cellules vides : chaîne vide
+                yield bloc.map(lambda v: v.date().isoformat() if isinstance(v, datetime.datetime) else ("" if v is None else str(v)))
+                debut += len(paquet)
+        finally:
+            classeur.close()
+    else:
+        # Séparateur le plus fréquent de la ligne d'en-tête (Excel français : point-virgule)
+        entete = fichier.readline().decode("utf-8-sig", errors="replace")
+        fichier.seek(0)
+        separateur = max([";", ",", "\t"], key=entete.count)
+        try:
+            yield from pd.read_csv(fichier, sep=separateur, dtype=str, keep_default_na=False,
+                                   encoding="utf-8-sig", chunksize=taille)
+        except pd.errors.EmptyDataError:
+            raise ImportInvalideError("Fichier vide")
+        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            raise ImportInvalideError(f"Fichier CSV illisible : {e}")
+
+def modele_import(collection):
+    """Fichier CSV modèle (en-têtes seuls) pour une collection importable"""
+    colonnes = SCHEMAS_IMPORT[collection]["colonnes"]
+    return pd.DataFrame(columns=[libelle for libelle, _, _ in colonnes.values()]).to_csv(index=False, sep=";")
+
+# ========== EXPORTS ==========
+# Nombre d'enregistrements lus et écrits à la fois
+TAILLE_BLOC_EXPORT = 5000
+
+# Collections exportables
+COLLECTIONS_EXPORT = {
+    "outillages": "🛠️ Outillages",
+    "personnels": "👥 Personnels",
+    "fournisseurs": "🏭 Fournisseurs",
+    "soustraitants": "🤝 Sous-traitants",
+    "bons_travail": "📋 Bons de travail",
+    "articles": "📦 Articles",
+    "mouvements_stock": "🔄 Mouvements de stock"
+}
+
+# Format -> (libellé, extension, type MIME)
+FORMATS_EXPORT = {
+    "csv": ("CSV", "csv", "text/csv"),
+    "jsonl": ("JSON lignes", "jsonl", "application/x-ndjson"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet")
+}
+
+def formats_export():
+    """Formats d'export disponibles (Parquet seulement si pyarrow est installé)"""
+    return [f for f in FORMATS_EXPORT if f != "parquet" or pq is not None]
+
+def profiler_colonnes(blocs):
+    """Colonnes rencontrées (ordre d'apparition) et leur type d'export : booleen, entier, nombre, liste ou texte"""
+    # Premier passage : seuls les types vus par colonne sont conservés
+    types = {}
+    for bloc in blocs:
+        for champ in dict.fromkeys(itertools.chain.from_iterable(bloc)):
+            valeurs = [record.get(champ) for record in bloc]
+            vus = {type(valeur).__name__ for valeur in valeurs}
+            # Une chaîne vide dans une colonne numérique ou booléenne vaut valeur absente
+            if "str" in vus and not any(isinstance(valeur, str) and valeur for valeur in valeurs):
+                vus.discard("str")
+            types.setdefault(champ, set()).update(vus - {"NoneType"})
+    types.pop("_rev", None)
+    colonnes = {}
+    for champ, vus in types.items():
+        if vus == {"bool"}:
+            colonnes[champ] = "booleen"
+        elif vus and vus <= {"int"}:
+            colonnes[champ] = "entier"
+        elif vus and vus <= {"int", "float"}:
+            colonnes[champ] = "nombre"
+        elif vus == {"list"}:
+            colonnes[champ] = "liste"
+        else:
+            colonnes[champ] = "texte"
+    return colonnes
+
+def normaliser_bloc(bloc, colonnes):
+    """DataFrame d'un bloc d'enregistrements aux colonnes et types du profil (valeur absente : vide)"""
+    frame = pd.DataFrame.from_records(bloc, columns=list(colonnes))
+    for champ, type_export in colonnes.items():
+        valeurs = frame[champ]
+        if type_export == "booleen":
+            frame[champ] = valeurs.map(lambda v: v if isinstance(v, bool) else None).astype("boolean")
+        elif type_export == "entier":
+            frame[champ] = pd.to_numeric(valeurs.replace("", None), errors="coerce").astype("Int64")
+        elif type_export == "nombre":
+            frame[champ] = pd.to_numeric(valeurs.replace("", None), errors="coerce").astype(float)
+        elif type_export == "liste":
+            frame[champ] = valeurs.map(lambda v: [str(e) for e in v] if isinstance(v, list) else [])
+        elif pd.api.types.is_string_dtype(valeurs):
+            frame[champ] = valeurs.fillna("")
+        else:
+            frame[champ] = valeurs.map(lambda v: "" if v is None or v is np.nan else
+                                       json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else str(v))
+    return frame
+
+def schema_parquet(colonnes):
+    """Schéma pyarrow correspondant au profil des colonnes"""
+    types = {"booleen": pa.bool_(), "entier": pa.int64(), "nombre": pa.float64(),
+             "liste": pa.list_(pa.string()), "texte": pa.string()}
+    return pa.schema([(champ, types[type_export]) for champ, type_export in colonnes.items()])
+
+def relire_export(fichier):
+    """Rembobine un fichier temporaire d'export et le retourne en lecture seule (type accepté par st.download_button)"""
+    fichier.seek(0)
+    # detach : le descripteur passe au lecteur, l'objet d'origine ne le fermera pas en étant libéré
+    return io.BufferedReader(fichier.detach())
+
+def ecrire_export(fichier, format_export, blocs):
+    """Écrit les blocs d'enregistrements dans un fichier binaire ; blocs() relance un parcours ; retourne le nombre de lignes"""
+    lignes = 0
+    if format_export == "jsonl":
+        # Aucun profil nécessaire : un seul passage
+        for bloc in blocs():
+            fichier.write("".join(json.dumps({k: v for k, v in record.items() if k != "_rev"}, ensure_ascii=False) + "\n"
+                                  for record in bloc).encode("utf-8"))
+            lignes += len(bloc)
+        return lignes
+    
+    # CSV et Parquet ont des colonnes fixes : un premier passage les détermine
+    colonnes = profiler_colonnes(blocs())
+    if format_export == "parquet":
+        if pq is None:
+            raise ValueError("L'export Parquet nécessite le paquet pyarrow")
+        schema = schema_parquet(colonnes)
+        with pq.ParquetWriter(fichier, schema) as writer:
+            for bloc in blocs():
+                writer.write_table(pa.Table.from_pandas(normaliser_bloc(bloc, colonnes), schema=schema, preserve_index=False))
+                lignes += len(bloc)
+        return lignes
+    
+    # CSV au format de l'import en masse : point-virgule, listes jointes, UTF-8 avec BOM pour Excel
+    fichier.write("\ufeff".encode("utf-8"))
+    listes = [champ for champ, type_export in colonnes.items() if type_export == "liste"]
+    entetes = True
+    for bloc in blocs():
+        frame = normaliser_bloc(bloc, colonnes)
+        for champ in listes:
+            frame[champ] = frame[champ].map(SEPARATEUR_LISTE.join)
+        fichier.write(frame.to_csv(index=False, header=entetes, sep=";").encode("utf-8"))
+        entetes = False
+        lignes += len(bloc)
+    if entetes:
+        fichier.write((";".join(colonnes) + "\n").encode("utf-8"))
+    return lignes
+
 # ========== GESTION DES DONNÉES ==========
 class DataManager:
-    def __init__(self):
+    # Collections persistées, dans l'ordre de chargement
+    COLLECTIONS = ["users", "fournisseurs", "soustraitants", "outillages", "personnels", "interventions", "bons_travail",
+                   "plans_preventifs", "articles", "mouvements_stock", "emprunts",
+                   "reservations_outillage", "habilitations", "equipements", "demandes_intervention"]
+    
+    # Clés métier uniques indexées en plus de l'id
+    UNIQUE_KEYS = {"users": "username", "outillages": "reference", "personnels": "matricule", "bons_travail": "numero",
+                   "articles": "reference", "equipements": "code", "demandes_intervention": "numero"}
+    
+    # Champs à facettes (valeur -> ids), champs texte indexés par mot et champs triés (tri, plages) pour le filtrage
+    FACET_FIELDS = {
+        "personnels": ["service", "statut"],
+        "bons_travail": ["categorie", "statut", "priorite", "technicien", "outillage_id"],
+        "plans_preventifs": ["type", "technicien"],
+        "articles": ["categorie", "fournisseur"],
+        "mouvements_stock": ["article_id", "type", "bt"],
+        "outillages": ["type"],
+        "emprunts": ["outillage_id", "utilisateur", "type"],
+        "reservations_outillage": ["outillage_id", "utilisateur", "bt"],
+        "habilitations": ["personnel_id", "libelle"],
+        "equipements": ["niveau", "type", "etat"],
+        "demandes_intervention": ["reference_equipement", "statut", "criticite"]
+    }
+    TEXT_FIELDS = {"personnels": ["nom", "matricule"], "equipements": ["code", "nom", "marque", "modele", "numero_serie"]}
+    SORTED_FIELDS = {"bons_travail": ["date_creation", "date_planifiee"], "mouvements_stock": ["date"], "emprunts": ["date"],
+                     "reservations_outillage": ["debut"], "outillages": ["date_prochaine_verification"],
+                     "habilitations": ["date_expiration"], "equipements": ["code"],
+                     "demandes_intervention": ["date_detection"]}
+    
+    # Champs couverts par la recherche globale, avec leur poids dans le classement
+    TIERS_SEARCH_FIELDS = {"nom": 5, "specialite": 3, "contact_nom": 2, "contact_email": 1, "contact_telephone": 1}
+    SEARCH_FIELDS = {
+        "outillages": {"reference": 5, "nom": 4, "numero_serie": 3, "marque": 2, "modele": 2},
+        "fournisseurs": TIERS_SEARCH_FIELDS,
+        "soustraitants": TIERS_SEARCH_FIELDS,
+        "personnels": {"nom": 5, "matricule": 5, "poste": 2, "competences": 2, "habilitations": 1},
+        "articles": {"reference": 5, "designation": 4, "categorie": 2, "fournisseur": 1},
+        "equipements": {"code": 5, "nom": 4, "numero_serie": 3, "marque": 2, "modele": 2}
+    }
+    
+    # Au-delà de ce nombre de modifications en attente, le DataFrame en cache est reconstruit plutôt que corrigé
+    FRAME_PATCH_LIMIT = 50
+    
+    def __init__(self, storage=None):
         self.data_dir = Path("data")
         self.data_dir.mkdir(exist_ok=True)
         
-        self.users_file = self.data_dir / "users.json"
-        self.tiers_file = self.data_dir / "tiers.json"
-        self.outillages_file = self.data_dir / "outillages.json"
-        self.personnels_file = self.data_dir / "personnels.json"
+        self.storage = storage or create_storage(self.data_dir)
+        
+        # Instance partagée entre les sessions Streamlit : les écritures sont sérialisées
+        self._lock = threading.RLock()
+        # Signature de chaque collection au dernier chargement/écriture de ce processus
+        self._signatures = {}
+        # Index par collection : id -> enregistrement, id -> position dans la liste, clé métier -> enregistrement
+        self._by_id = {}
+        self._positions = {}
+        self._by_key = {}
+        # Index de filtrage : champ -> valeur -> ids, mot -> ids (+ vocabulaire trié),
+        # champ -> liste triée de (valeur, id), id -> termes indexés
+        self._facets = {}
+        self._tokens = {}
+        self._vocabulary = {}
+        self._sorted = {}
+        self._indexed_terms = {}
+        # Recherche plein texte sur l'ensemble des collections
+        self.search_index = SearchIndex(self.SEARCH_FIELDS)
+        # Indicateurs de maintenance calculés sur l'historique des interventions
+        self.kpi = KpiEngine()
+        # Articles sous le seuil minimum et totaux du stock, mis à jour à chaque mouvement
+        self.alertes_stock = AlertesStock()
+        # Emprunts d'outillages ouverts, triés sur la date de retour prévue
+        self.emprunts_en_cours = EmpruntsEnCours()
+        # Périodes réservées par outillage, pour les contrôles de chevauchement
+        self.planning_reservations = PlanningReservations()
+        # Titre d'habilitation en vigueur par (personnel, habilitation), pour les contrôles de validité
+        self.validites_habilitations = ValiditesHabilitations()
+        # Arborescence site > zone > ligne > équipement, avec la fermeture des descendants de chaque nœud
+        self.hierarchie_equipements = HierarchieEquipements()
+        # Demandes d'intervention en attente, de la plus urgente à la moins urgente
+        self.file_demandes = FileDemandes()
+        # Affectation des BT ouverts aux techniciens, construite au premier usage
+        self._ordonnanceur = None
+        # Compteur de version par collection, incrémenté à chaque modification
+        self._versions = {collection: 0 for collection in self.COLLECTIONS}
+        # DataFrames en cache et modifications à y reporter au prochain accès
+        self._frames = {}
+        self._pending_changes = {}
+        self._tiers_frame = None
+        self._propositions_reappro = None
+        self._fiabilite = None
+        
+        self.users = []
+        self.personnels = []
+        self.outillages = {"outillages": []}
+        self.tiers = {"fournisseurs": [], "soustraitants": []}
+        self.interventions = []
+        self.bons_travail = []
+        self.plans_preventifs = []
+        self.articles = []
+        self.mouvements_stock = []
+        self.emprunts = []
+        self.reservations_outillage = []
+        self.habilitations = []
+        self.equipements = []
+        self.demandes_intervention = []
         
         self.load_all_data()
     
+    def _records(self, collection):
+        """Retourne la liste en mémoire d'une collection"""
+        if collection == "outillages":
+            return self.outillages["outillages"]
+        if collection in ("fournisseurs", "soustraitants"):
+            return self.tiers[collection]
+        return getattr(self, collection)
+    
+    def _set_records(self, collection, records):
+        """Remplace la liste en mémoire d'une collection"""
+        if collection == "outillages":
+            self.outillages = {"outillages": records}
+        elif collection in ("fournisseurs", "soustraitants"):
+            self.tiers = {**self.tiers, collection: records}
+        else:
+            setattr(self, collection, records)
+        self._index_collection(collection)
+        if collection in self.SEARCH_FIELDS:
+            self.search_index.index_collection(collection, records)
+        if collection == "interventions":
+            self.kpi.rebuild(records)
+        if collection in ("personnels", "bons_travail", "habilitations"):
+            self._ordonnanceur = None
+        if collection == "habilitations":
+            self.validites_habilitations.rebuild(records)
+        if collection == "articles":
+            self.alertes_stock.rebuild(records)
+        if collection == "emprunts":
+            self.emprunts_en_cours.rebuild(records)
+        if collection == "reservations_outillage":
+            self.planning_reservations.rebuild(records)
+        if collection == "equipements":
+            self.hierarchie_equipements.rebuild(records)
+        if collection == "demandes_intervention":
+            self.file_demandes.rebuild(records)
+        self._versions[collection] = self._versions.get(collection, 0) + 1
+        self._frames.pop(collection, None)
+        self._pending_changes.pop(collection, None)
+    
+    def _index_collection(self, collection):
+        """Reconstruit les index d'une collection (au chargement uniquement)"""
+        records = self._records(collection)
+        self._by_id[collection] = {r["id"]: r for r in records}
+        self._positions[collection] = {r["id"]: i for i, r in enumerate(records)}
+        key = self.UNIQUE_KEYS.get(collection)
+        if key:
+            self._by_key[collection] = {r[key]: r for r in records if r.get(key)}
+        if collection in self.FACET_FIELDS or collection in self.TEXT_FIELDS or collection in self.SORTED_FIELDS:
+            self._facets[collection] = {field: {} for field in self.FACET_FIELDS.get(collection, [])}
+            self._tokens[collection] = {}
+            self._vocabulary[collection] = []
+            self._sorted[collection] = {field: [] for field in self.SORTED_FIELDS.get(collection, [])}
+            self._indexed_terms[collection] = {}
+            for record in records:
+                self._index_terms(collection, record)
+    
+    def _index_record(self, collection, record, previous=None):
+        """Met à jour les index après l'ajout ou la modification d'un enregistrement"""
+        self._by_id[collection][record["id"]] = record
+        key = self.UNIQUE_KEYS.get(collection)
+        if key:
+            if previous is not None and previous.get(key) != record.get(key):
+                self._by_key[collection].pop(previous.get(key), None)
+            if record.get(key):
+                self._by_key[collection][record[key]] = record
+        if collection in self._indexed_terms:
+            self._unindex_terms(collection, record["id"])
+            self._index_terms(collection, record)
+    
+    def _unindex_record(self, collection, record):
+        """Retire un enregistrement des index"""
+        self._by_id[collection].pop(record["id"], None)
+        key = self.UNIQUE_KEYS.get(collection)
+        if key and self._by_key[collection].get(record.get(key)) is record:
+            del self._by_key[collection][record[key]]
+        if collection in self._indexed_terms:
+            self._unindex_terms(collection, record["id"])
+    
+    def _index_terms(self, collection, record):
+        """Ajoute les valeurs de facettes et les mots d'un enregistrement aux index de filtrage"""
+        record_id = record["id"]
+        facets = {field: record.get(field, "Non spécifié") for field in self.FACET_FIELDS.get(collection, [])}
+        for field, value in facets.items():
+            self._facets[collection][field].setdefault(value, set()).add(record_id)
+        tokens = {token for field in self.TEXT_FIELDS.get(collection, []) for token in tokeniser(record.get(field))}
+        vocabulary = self._vocabulary[collection]
+        for token in tokens:
+            ids = self._tokens[collection].get(token)
+            if ids is None:
+                ids = self._tokens[collection][token] = set()
+                bisect.insort(vocabulary, token)
+            ids.add(record_id)
+        sort_values = {field: str(record.get(field) or "") for field in self.SORTED_FIELDS.get(collection, [])}
+        for field, value in sort_values.items():
+            bisect.insort(self._sorted[collection][field], (value, record_id))
+        # Les termes sont mémorisés : l'enregistrement peut être modifié en place avant sa mise à jour
+        self._indexed_terms[collection][record_id] = (facets, tokens, sort_values)
+    
+    def _unindex_terms(self, collection, record_id):
+        """Retire les termes mémorisés d'un enregistrement des index de filtrage"""
+        facets, tokens, sort_values = self._indexed_terms[collection].pop(record_id, ({}, (), {}))
+        for field, value in facets.items():
+            ids = self._facets[collection][field].get(value)
+            if ids is not None:
+                ids.discard(record_id)
+                if not ids:
+                    del self._facets[collection][field][value]
+        vocabulary = self._vocabulary[collection]
+        for token in tokens:
+            ids = self._tokens[collection].get(token)
+            if ids is not None:
+                ids.discard(record_id)
+                if not ids:
+                    del self._tokens[collection][token]
+                    del vocabulary[bisect.bisect_left(vocabulary, token)]
+        for field, value in sort_values.items():
+            entries = self._sorted[collection][field]
+            del entries[bisect.bisect_left(entries, (value, record_id))]
+    
+    def _prefix_ids(self, collection, prefix):
+        """Ids des enregistrements ayant un mot commençant par prefix (recherche dichotomique dans le vocabulaire)"""
+        vocabulary = self._vocabulary[collection]
+        ids = set()
+        for i in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            ids |= self._tokens[collection][vocabulary[i]]
+        return ids
+    
+    def query_ids(self, collection, filters=None, texte=""):
+        """Ids correspondant aux facettes (champ -> valeurs acceptées) et au texte (préfixes de mots), ou None sans critère"""
+        with self._lock:
+            result = None
+            for field, values in (filters or {}).items():
+                if values:
+                    index = self._facets[collection][field]
+                    ids = set().union(*(index.get(value, ()) for value in values))
+                    result = ids if result is None else result & ids
+            for token in tokeniser(texte):
+                ids = self._prefix_ids(collection, token)
+                result = ids if result is None else result & ids
+            return result
+    
+    def facet_counts(self, collection, field, ids=None):
+        """Nombre d'enregistrements par valeur d'une facette, éventuellement restreint à un ensemble d'ids"""
+        with self._lock:
+            index = self._facets[collection][field]
+            if ids is None:
+                return {value: len(value_ids) for value, value_ids in index.items()}
+            return {value: len(value_ids & ids) for value, value_ids in index.items()}
+    
+    def search(self, texte, collections=None, limit=20):
+        """Recherche plein texte : retourne les (collection, enregistrement, score) par pertinence décroissante"""
+        with self._lock:
+            return [
+                (collection, self._by_id[collection][record_id], score)
+                for score, collection, record_id in self.search_index.search(texte, collections, limit)
+            ]
+    
+    def range_ids(self, collection, field, debut=None, fin=None, ordered=False):
+        """Ids dont la valeur d'un champ trié est comprise entre debut et fin (préfixes inclus, bornes optionnelles),
+        en ensemble ou en liste triée sur ce champ"""
+        with self._lock:
+            entries = self._sorted[collection][field]
+            i = bisect.bisect_left(entries, (debut,)) if debut is not None else 0
+            j = bisect.bisect_right(entries, (fin + "\uffff",)) if fin is not None else len(entries)
+            if ordered:
+                return [record_id for _, record_id in entries[i:j]]
+            return {record_id for _, record_id in entries[i:j]}
+    
+    def ordered_ids(self, collection, ids=None, by=None, reverse=False):
+        """Ids dans l'ordre de la collection, ou triés sur un champ de SORTED_FIELDS (tous si ids vaut None)"""
+        with self._lock:
+            if by is not None:
+                if ids is None:
+                    ordered = [record_id for _, record_id in self._sorted[collection][by]]
+                    return ordered[::-1] if reverse else ordered
+                terms = self._indexed_terms[collection]
+                return sorted(ids, key=lambda record_id: (terms[record_id][2][by], record_id), reverse=reverse)
+            if ids is None:
+                return [r["id"] for r in self._records(collection)]
+            return sorted(ids, key=self._positions[collection].__getitem__)
+    
+    def _record_change(self, collection, op, record):
+        """Enregistre une modification (op = "insert", "update" ou "delete") pour les caches dérivés"""
+        self._versions[collection] += 1
+        if collection in self._frames:
+            self._pending_changes.setdefault(collection, []).append((op, record))
+        if collection in self.SEARCH_FIELDS:
+            self.search_index.apply(collection, op, record)
+        if collection == "interventions":
+            self.kpi.apply(op, record)
+        if collection in ("personnels", "bons_travail") and self._ordonnanceur is not None:
+            self._ordonnanceur.apply(collection, op, record)
+        if collection == "articles":
+            self.alertes_stock.apply(op, record)
+        if collection == "emprunts":
+            if op == "insert":
+                self.emprunts_en_cours.add(record)
+            else:
+                # Les événements ne sont pas censés changer : une correction rejoue tout l'historique
+                self.emprunts_en_cours.rebuild(self.emprunts)
+        if collection == "reservations_outillage":
+            self.planning_reservations.apply(op, record)
+        if collection == "equipements":
+            self.hierarchie_equipements.apply(op, record)
+        if collection == "demandes_intervention":
+            self.file_demandes.apply(op, record)
+        if collection == "habilitations":
+            self.validites_habilitations.apply(op, record)
+            # Seuls les BT du titulaire sont replanifiés
+            personnel = self.get_personnel(record["personnel_id"])
+            if personnel is not None and self._ordonnanceur is not None:
+                self._ordonnanceur.apply("personnels", "update", personnel)
+    
+    def collection_version(self, collection):
+        """Version courante d'une collection (change à chaque modification)"""
+        return self._versions[collection]
+    
+    def _frame(self, collection):
+        """Retourne le DataFrame d'une collection, construit une fois puis corrigé à chaque modification"""
+        with self._lock:
+            pending = self._pending_changes.pop(collection, [])
+            frame = self._frames.get(collection)
+            if frame is None or len(pending) > self.FRAME_PATCH_LIMIT:
+                records = self._records(collection)
+                frame = pd.DataFrame(records, index=[r["id"] for r in records])
+            else:
+                for op, record in pending:
+                    frame = self._patch_frame(frame, op, record)
+            self._frames[collection] = frame
+            # Vue superficielle : avec Copy-on-Write, une modification par l'appelant n'atteint pas le cache
+            return frame.copy(deep=False)
+    
+    def _patch_frame(self, frame, op, record):
+        """Reporte une modification unitaire sur un DataFrame en cache"""
+        if op == "delete":
+            return frame.drop(index=record["id"], errors="ignore")
+        for column in record.keys() - set(frame.columns):
+            frame[column] = None
+        frame.loc[record["id"]] = pd.Series(record, dtype=object).reindex(frame.columns)
+        return frame
+    
+    def _next_id(self, collection, floor=0):
+        """Alloue un nouvel id via la séquence persistée du stockage"""
+        return self.storage.next_id(collection, floor)
+    
+    def _next_ids(self, collection, count, floor=0):
+        """Alloue un bloc de count ids consécutifs en un seul accès à la séquence"""
+        if not count:
+            return range(0)
+        first = self.storage.next_id(collection, floor, count)
+        return range(first, first + count)
+    
+    def get_record(self, collection, record_id):
+        """Retourne un enregistrement par id (ou None)"""
+        return self._by_id[collection].get(record_id)
+    
+    def get_record_by_key(self, collection, value):
+        """Retourne un enregistrement par sa clé métier unique (référence, matricule, username)"""
+        return self._by_key[collection].get(value)
+    
+    def _default_records(self, collection):
+        """Retourne les enregistrements par défaut d'une collection"""
+        if collection == "outillages":
+            return self.create_default_outillages()["outillages"]
+        if collection in ("fournisseurs", "soustraitants"):
+            return self.create_default_tiers()[collection]
+        return getattr(self, f"create_default_{collection}")()
+    
     def load_all_data(self):
         """Charge toutes les données"""
-        # Utilisateurs
-        if self.users_file.exists():
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.users = json.load(f)
-        else:
-            self.users = self.create_default_users()
-            self.save_users()
-        
-        # Tiers
-        if self.tiers_file.exists():
-            with open(self.tiers_file, 'r', encoding='utf-8') as f:
-                self.tiers = json.load(f)
-        else:
-            self.tiers = self.create_default_tiers()
-            self.save_tiers()
-        
-        # Outillages
-        if self.outillages_file.exists():
-            with open(self.outillages_file, 'r', encoding='utf-8') as f:
-                self.outillages = json.load(f)
+        with self._lock:
+            for collection in self.COLLECTIONS:
+                self._load_collection(collection)
+    
+    def _load_collection(self, collection):
+        """Charge une collection depuis le stockage, ou l'initialise avec les valeurs par défaut"""
+        if self.storage.exists(collection):
+            # Version lue avant les données : une écriture concurrente sera rechargée au prochain refresh()
+            signature = self.storage.signature(collection)
+            records = self.storage.load(collection)
         else:
-            self.outillages = self.create_default_outillages()
-            self.save_outillages()
-        
-        # Personnels - NOUVEAU
-        if self.personnels_file.exists():
-            with open(self.personnels_file, 'r', encoding='utf-8') as f:
-                self.personnels = json.load(f)
-        else:
-            self.personnels = self.create_default_personnels()
-            self.save_personnels()
+            records = self._default_records(collection)
+            self.storage.replace_all(collection, records)
+            signature = self.storage.signature(collection)
+        for record in records:
+            record.setdefault("_rev", 0)
+        self._set_records(collection, records)
+        self._signatures[collection] = signature
+    
+    def _avancer_signature(self, collection):
+        """Après une écriture locale, mémorise la nouvelle version si aucune autre session n'a écrit depuis le dernier chargement"""
+        # Sinon (version +2 ou plus), la version mémorisée reste en retard et refresh() rechargera la collection
+        version = self.storage.signature(collection)
+        if version == (self._signatures.get(collection) or 0) + 1:
+            self._signatures[collection] = version
+    
+    def refresh(self):
+        """Recharge uniquement les collections modifiées depuis le dernier chargement"""
+        with self._lock:
+            for collection in self.COLLECTIONS:
+                if self.storage.signature(collection) != self._signatures.get(collection):
+                    self._load_collection(collection)
+    
+    def _insert(self, collection, record):
+        """Ajoute un enregistrement en mémoire et dans le stockage"""
+        with self._lock:
+            try:
+                self.storage.insert(collection, record)
+            except ConflictError:
+                self._load_collection(collection)
+                raise
+            self._insert_in_memory(collection, record)
+            self._avancer_signature(collection)
+    
+    def _update(self, collection, record_id, record, expected_rev=None):
+        """Remplace un enregistrement ; lève ConflictError si sa révision n'est plus expected_rev (None : sans contrôle)"""
+        # expected_rev est la révision lue par l'appelant (à l'affichage du formulaire), jamais celle de l'enregistrement courant
+        with self._lock:
+            existing = self._by_id[collection].get(record_id)
+            if existing is None:
+                return
+            record["id"] = existing["id"]
+            try:
+                self.storage.update(collection, record, expected_rev)
+            except ConflictError:
+                self._load_collection(collection)
+                raise
+            self._update_in_memory(collection, record, existing)
+            self._avancer_signature(collection)
+    
+    def _delete(self, collection, record_id, expected_rev=None):
+        """Supprime un enregistrement en mémoire et dans le stockage"""
+        with self._lock:
+            existing = self._by_id[collection].get(record_id)
+            if existing is not None:
+                try:
+                    self.storage.delete(collection, existing["id"], expected_rev)
+                except ConflictError:
+                    self._load_collection(collection)
+                    raise
+                self._delete_in_memory(collection, existing)
+                self._avancer_signature(collection)
+    
+    def _write_batch(self, operations):
+        """Enregistre plusieurs modifications (op, collection, enregistrement) en une seule écriture atomique"""
+        # Les enregistrements modifiés sont des copies lues sous verrou : leur _rev est la révision attendue
+        with self._lock:
+            storage_operations = [(op, collection, record, record.get("_rev") if op != "insert" else None)
+                                  for op, collection, record in operations]
+            collections = list(dict.fromkeys(collection for _, collection, _ in operations))
+            try:
+                self.storage.write_batch(storage_operations)
+            except ConflictError:
+                for collection in collections:
+                    self._load_collection(collection)
+                raise
+            for op, collection, record in operations:
+                existing = self._by_id[collection].get(record["id"])
+                if op == "insert":
+                    self._insert_in_memory(collection, record)
+                elif op == "update":
+                    self._update_in_memory(collection, record, existing)
+                elif existing is not None:
+                    self._delete_in_memory(collection, existing)
+            for collection in collections:
+                self._avancer_signature(collection)
+    
+    def _insert_in_memory(self, collection, record):
+        records = self._records(collection)
+        self._positions[collection][record["id"]] = len(records)
+        records.append(record)
+        self._index_record(collection, record)
+        self._record_change(collection, "insert", record)
+    
+    def _update_in_memory(self, collection, record, existing):
+        self._records(collection)[self._positions[collection][record["id"]]] = record
+        self._index_record(collection, record, previous=existing)
+        self._record_change(collection, "update", record)
+    
+    def _delete_in_memory(self, collection, existing):
+        records = self._records(collection)
+        positions = self._positions[collection]
+        position = positions.pop(existing["id"])
+        del records[position]
+        for i in range(position, len(records)):
+            positions[records[i]["id"]] = i
+        self._unindex_record(collection, existing)
+        self._record_change(collection, "delete", existing)
+    
+    def _save_collection(self, collection):
+        """Réécrit entièrement une collection dans le stockage"""
+        with self._lock:
+            self.storage.replace_all(collection, self._records(collection))
+            self._signatures[collection] = self.storage.signature(collection)
     
     def create_default_personnels(self):
         """Crée les personnels par défaut avec noms tunisiens"""
@@ -221,37 +3083,281 @@ class DataManager:
     
     def save_personnels(self):
         """Sauvegarde les personnels"""
-        with open(self.personnels_file, 'w', encoding='utf-8') as f:
-            json.dump(self.personnels, f, ensure_ascii=False, indent=2)
+        self._save_collection("personnels")
     
     def get_all_personnels(self):
         """Retourne tous les personnels"""
         return self.personnels
     
     def add_personnel(self, personnel_data):
-        """Ajoute un nouveau personnel"""
-        if self.personnels:
-            max_id = max([p["id"] for p in self.personnels], default=0)
-            personnel_data["id"] = max_id + 1
-        else:
-            personnel_data["id"] = 1
-        
-        self.personnels.append(personnel_data)
-        self.save_personnels()
-        return personnel_data["id"]
-    
-    def update_personnel(self, personnel_id, personnel_data):
-        """Met à jour un personnel"""
-        for i, personnel in enumerate(self.personnels):
-            if personnel["id"] == personnel_id:
-                self.personnels[i] = personnel_data
-                break
-        self.save_personnels()
+        """Ajoute un nouveau personnel (un titre sans dates est créé pour chacune de ses habilitations)"""
+        with self._lock:
+            personnel_data["id"] = self._next_id("personnels")
+            # Fiche et titres dans le même lot : tout ou rien
+            self._write_batch([("insert", "personnels", personnel_data)] + self._operations_habilitations(personnel_data))
+            return personnel_data["id"]
+    
+    def get_personnel(self, personnel_id):
+        """Retourne un personnel par id (ou None)"""
+        return self.get_record("personnels", personnel_id)
+    
+    def get_personnel_by_matricule(self, matricule):
+        """Retourne un personnel par matricule (ou None)"""
+        return self.get_record_by_key("personnels", matricule)
+    
+    def update_personnel(self, personnel_id, personnel_data, expected_rev=None):
+        """Met à jour un personnel et aligne ses titres d'habilitation sur la liste de ses habilitations"""
+        with self._lock:
+            # _update ignore un enregistrement disparu : une fiche supprimée entre-temps est un conflit
+            if self.get_personnel(personnel_id) is None:
+                raise ConflictError(f"personnels #{personnel_id} a été supprimé")
+            # Le lot contrôle la révision portée par l'enregistrement : celle lue à l'ouverture du formulaire
+            personnel_data.update(id=personnel_id, _rev=expected_rev)
+            self._write_batch([("update", "personnels", personnel_data)] + self._operations_habilitations(personnel_data))
     
     def delete_personnel(self, personnel_id):
-        """Supprime un personnel"""
-        self.personnels = [p for p in self.personnels if p["id"] != personnel_id]
-        self.save_personnels()
+        """Supprime un personnel et ses titres d'habilitation (en une seule écriture)"""
+        with self._lock:
+            personnel = self.get_personnel(personnel_id)
+            if personnel is None:
+                return
+            self._write_batch([("delete", "personnels", personnel)] +
+                              [("delete", "habilitations", titre) for titre in self.get_habilitations_personnel(personnel_id)])
+    
+    def _operations_habilitations(self, *personnels):
+        """Opérations de lot (op, collection, enregistrement) alignant les titres sur les fiches : un titre sans dates
+        pour chaque habilitation listée qui n'en a pas, suppression des titres des habilitations retirées"""
+        ecarts = []
+        for personnel in personnels:
+            libelles = set(personnel.get("habilitations") or [])
+            titres = [self.get_habilitation(habilitation_id)
+                      for habilitation_id in self.query_ids("habilitations", {"personnel_id": [personnel["id"]]}) or ()]
+            ecarts.append((personnel, [titre for titre in titres if titre["libelle"] not in libelles],
+                           sorted(libelles - {titre["libelle"] for titre in titres})))
+        # Un seul bloc d'ids, quel que soit le nombre de personnels
+        ids = iter(self._next_ids("habilitations", sum(len(nouveaux) for _, _, nouveaux in ecarts)))
+        operations = []
+        for personnel, retires, nouveaux in ecarts:
+            operations += [("delete", "habilitations", titre) for titre in retires]
+            operations += [("insert", "habilitations", {
+                "id": next(ids), "personnel_id": personnel["id"], "libelle": libelle,
+                "date_obtention": "", "date_expiration": "", "organisme": "", "numero": ""
+            }) for libelle in nouveaux]
+        return operations
+    
+    def create_default_habilitations(self):
+        """Reprend les habilitations listées sur les fiches personnels en titres d'habilitation"""
+        # La date d'obtention n'est pas connue : la dernière évaluation sert de départ aux habilitations à recycler
+        habilitations = []
+        for personnel in self.personnels:
+            obtention = personnel.get("derniere_evaluation") or personnel.get("date_embauche") or ""
+            for libelle in personnel.get("habilitations") or []:
+                annees = validite_habilitation(libelle)
+                habilitations.append({
+                    "id": len(habilitations) + 1,
+                    "personnel_id": personnel["id"],
+                    "libelle": libelle,
+                    "date_obtention": obtention if annees else "",
+                    "date_expiration": ajouter_annees(obtention, annees) if annees and obtention else "",
+                    "organisme": "",
+                    "numero": ""
+                })
+        return habilitations
+    
+    def get_habilitation(self, habilitation_id):
+        """Retourne un titre d'habilitation par id (ou None)"""
+        return self.get_record("habilitations", habilitation_id)
+    
+    def get_habilitations_personnel(self, personnel_id):
+        """Titres d'habilitation d'un personnel (renouvellements compris), par libellé puis échéance"""
+        with self._lock:
+            ids = self.query_ids("habilitations", {"personnel_id": [personnel_id]}) or ()
+            return sorted((self.get_habilitation(habilitation_id) for habilitation_id in ids),
+                          key=lambda titre: (titre["libelle"], titre.get("date_expiration") or "9999"))
+    
+    def ajouter_habilitation(self, personnel_id, libelle, date_obtention, date_expiration="", organisme="", numero=""):
+        """Enregistre un titre (nouvelle habilitation ou renouvellement) et l'ajoute à la fiche du personnel si besoin"""
+        with self._lock:
+            personnel = self.get_personnel(personnel_id)
+            if personnel is None:
+                raise ConflictError(f"personnels #{personnel_id} a été supprimé")
+            habilitation = {
+                "id": self._next_id("habilitations"),
+                "personnel_id": personnel_id,
+                "libelle": libelle,
+                "date_obtention": date_obtention,
+                "date_expiration": date_expiration,
+                "organisme": organisme,
+                "numero": numero
+            }
+            # Le titre remplace le titre provisoire de la même habilitation ; titre et fiche sont écrits ensemble
+            operations = [("insert", "habilitations", habilitation)]
+            if not titre_provisoire(habilitation):
+                operations += [("delete", "habilitations", titre) for titre in self.get_habilitations_personnel(personnel_id)
+                               if titre["libelle"] == libelle and titre_provisoire(titre)]
+            if libelle not in (personnel.get("habilitations") or []):
+                operations.append(("update", "personnels",
+                                   {**personnel, "habilitations": list(personnel.get("habilitations") or []) + [libelle]}))
+            self._write_batch(operations)
+            return habilitation["id"]
+    
+    def habilitation_valide(self, personnel_id, libelle, jour=None):
+        """Indique si une habilitation d'un personnel est valide à une date (aujourd'hui par défaut)"""
+        return self.validites_habilitations.valide(personnel_id, libelle, jour or datetime.date.today())
+    
+    def get_habilitations_echeant(self, fin, debut="0"):
+        """Titres en vigueur expirant entre debut et fin (dates ISO), par échéance ; les titres renouvelés sont écartés"""
+        # Borne basse "0" : les titres sans échéance (chaîne vide) sont exclus
+        with self._lock:
+            titres = (self.get_habilitation(habilitation_id)
+                      for habilitation_id in self.range_ids("habilitations", "date_expiration", debut, fin, ordered=True))
+            return [titre for titre in titres if self.validites_habilitations.est_en_vigueur(titre)]
+    
+    def get_habilitations_expirees(self, aujourd_hui=None):
+        """Titres en vigueur dont l'échéance est dépassée"""
+        aujourd_hui = aujourd_hui or datetime.date.today()
+        return self.get_habilitations_echeant((aujourd_hui - datetime.timedelta(days=1)).isoformat())
+    
+    def get_habilitations_a_renouveler(self, jours, aujourd_hui=None):
+        """Titres en vigueur expirant dans les N prochains jours (aujourd'hui inclus)"""
+        aujourd_hui = aujourd_hui or datetime.date.today()
+        return self.get_habilitations_echeant((aujourd_hui + datetime.timedelta(days=jours)).isoformat(), aujourd_hui.isoformat())
+    
+    def create_default_equipements(self):
+        """Crée le parc par défaut : un site, ses zones et lignes, et les équipements suivis en maintenance"""
+        # (code, nom, niveau, code du parent, type, marque, modèle, n° de série, installation, état)
+        noeuds = [
+            ("SITE-01", "Usine de Sfax", "Site", None, "", "", "", "", "", "✅ Opérationnel"),
+            ("ZON-ATA", "Atelier A", "Zone", "SITE-01", "", "", "", "", "", "✅ Opérationnel"),
+            ("ZON-ATB", "Atelier B", "Zone", "SITE-01", "", "", "", "", "", "✅ Opérationnel"),
+            ("ZON-CHF", "Zone chauffage", "Zone", "SITE-01", "", "", "", "", "", "✅ Opérationnel"),
+            ("ZON-TEC", "Salle technique", "Zone", "SITE-01", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-A1", "Ligne formage", "Ligne", "ZON-ATA", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-A2", "Ligne convoyage", "Ligne", "ZON-ATA", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-B1", "Ligne usinage", "Ligne", "ZON-ATB", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-B2", "Ligne 2", "Ligne", "ZON-ATB", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-C1", "Ligne traitement thermique", "Ligne", "ZON-CHF", "", "", "", "", "", "✅ Opérationnel"),
+            ("LIG-T1", "Utilités", "Ligne", "ZON-TEC", "", "", "", "", "", "✅ Opérationnel"),
+            ("EQ-001", "Presse hydraulique 100T", "Équipement", "LIG-A1", "Formage", "Schuler", "HPX-100", "SCH-88123", "2018-03-12", "✅ Opérationnel"),
+            ("EQUIP-045", "Convoyeur bande C-205", "Équipement", "LIG-A2", "Transport", "Interroll", "BM-8400", "IR-20456", "2019-09-02", "⚠️ Maintenance"),
+            ("EQ-002", "Tour CNC 5 axes", "Équipement", "LIG-B1", "Usinage", "DMG Mori", "NTX-2000", "DMG-55012", "2020-06-15", "✅ Opérationnel"),
+            ("EQ-004", "Robot soudeur KUKA", "Équipement", "LIG-B2", "Assemblage", "KUKA", "KR-16", "KUKA-77310", "2021-01-20", "❌ Hors service"),
+            ("EQ-003", "Four industriel 800°C", "Équipement", "LIG-C1", "Traitement thermique", "Nabertherm", "N-1500", "NAB-40981", "2017-11-08", "✅ Opérationnel"),
+            ("EQ-006", "Four F-03", "Équipement", "LIG-C1", "Traitement thermique", "Nabertherm", "N-2200", "NAB-41277", "2016-05-30", "✅ Opérationnel"),
+            ("EQ-007", "Ventilateur V-45", "Équipement", "LIG-C1", "Utilitaire", "Soler & Palau", "CMB-450", "SP-18834", "2016-05-30", "✅ Opérationnel"),
+            ("EQ-005", "Compresseur Atlas", "Équipement", "LIG-T1", "Utilitaire", "Atlas Copco", "GA-37", "AC-91544", "2019-02-11", "⚠️ Maintenance"),
+            ("EQ-008", "Compresseur CMP-01", "Équipement", "LIG-T1", "Utilitaire", "Atlas Copco", "GA-22", "AC-90872", "2015-10-04", "✅ Opérationnel"),
+            ("EQUIP-023", "Pompe centrifuge P-101", "Équipement", "LIG-T1", "Utilitaire", "Grundfos", "NB-65", "GF-33019", "2018-07-23", "✅ Opérationnel")
+        ]
+        ids = {code: i for i, (code, *_) in enumerate(noeuds, start=1)}
+        return [
+            {
+                "id": ids[code],
+                "code": code,
+                "nom": nom,
+                "niveau": niveau,
+                "parent_id": ids.get(parent),
+                "type": type_eq,
+                "marque": marque,
+                "modele": modele,
+                "numero_serie": numero_serie,
+                "date_installation": installation,
+                "etat": etat,
+                "notes": ""
+            }
+            for code, nom, niveau, parent, type_eq, marque, modele, numero_serie, installation, etat in noeuds
+        ]
+    
+    def get_equipement(self, equipement_id):
+        """Retourne un nœud du parc par id (ou None)"""
+        return self.get_record("equipements", equipement_id)
+    
+    def get_equipement_by_code(self, code):
+        """Retourne un nœud du parc par code (ou None)"""
+        return self.get_record_by_key("equipements", code)
+    
+    def _verifier_equipement(self, equipement, equipement_id=None):
+        """Contrôle le code et le rattachement d'un nœud (niveau du parent supérieur au sien, des enfants inférieur, pas de boucle)"""
+        if not equipement.get("code"):
+            raise EquipementInvalideError("Le code est obligatoire")
+        homonyme = self.get_equipement_by_code(equipement["code"])
+        if homonyme is not None and homonyme["id"] != equipement_id:
+            raise EquipementInvalideError(f"Le code {equipement['code']} est déjà utilisé")
+        niveau = equipement.get("niveau")
+        if niveau not in NIVEAUX_EQUIPEMENT:
+            raise EquipementInvalideError(f"Niveau inconnu : {niveau}")
+        # Un changement de niveau doit laisser chaque enfant direct à un niveau inférieur
+        if equipement_id is not None:
+            for enfant_id in self.hierarchie_equipements.enfants.get(equipement_id, ()):
+                enfant = self.get_equipement(enfant_id)
+                if NIVEAUX_EQUIPEMENT.index(enfant["niveau"]) <= NIVEAUX_EQUIPEMENT.index(niveau):
+                    raise EquipementInvalideError(
+                        f"Un(e) {niveau} ne peut pas contenir {enfant['nom']} ({enfant['niveau']})")
+        parent_id = equipement.get("parent_id")
+        if parent_id is None:
+            return
+        parent = self.get_equipement(parent_id)
+        if parent is None:
+            raise EquipementInvalideError("Emplacement parent introuvable")
+        if NIVEAUX_EQUIPEMENT.index(parent["niveau"]) >= NIVEAUX_EQUIPEMENT.index(niveau):
+            raise EquipementInvalideError(f"Un(e) {niveau} ne peut pas être rattaché(e) à un(e) {parent['niveau']}")
+        if equipement_id is not None and parent_id in self.hierarchie_equipements.sous_arbre(equipement_id):
+            raise EquipementInvalideError("Un nœud ne peut pas être rattaché à l'un de ses descendants")
+    
+    def add_equipement(self, equipement_data):
+        """Ajoute un nœud au parc (site, zone, ligne ou équipement)"""
+        with self._lock:
+            equipement_data.setdefault("parent_id", None)
+            self._verifier_equipement(equipement_data)
+            equipement_data["id"] = self._next_id("equipements")
+            self._insert("equipements", equipement_data)
+            return equipement_data["id"]
+    
+    def update_equipement(self, equipement_id, equipement_data, expected_rev=None):
+        """Met à jour un nœud ; changer son parent déplace tout son sous-arbre"""
+        with self._lock:
+            self._verifier_equipement(equipement_data, equipement_id)
+            self._update("equipements", equipement_id, equipement_data, expected_rev)
+    
+    def delete_equipement(self, equipement_id):
+        """Supprime un nœud du parc, à condition qu'il n'ait plus d'enfants"""
+        with self._lock:
+            if self.hierarchie_equipements.enfants.get(equipement_id):
+                raise EquipementInvalideError("Déplacez ou supprimez d'abord les éléments rattachés à ce nœud")
+            self._delete("equipements", equipement_id)
+    
+    def get_equipements_ids(self, racine_id=None, types=None, etats=None, niveaux=None, texte=""):
+        """Ids des nœuds situés sous une racine (incluse) et correspondant aux facettes, triés par code"""
+        with self._lock:
+            ids = self.query_ids("equipements", {"type": types, "etat": etats, "niveau": niveaux}, texte)
+            if racine_id is not None:
+                sous_arbre = self.hierarchie_equipements.sous_arbre(racine_id)
+                ids = sous_arbre if ids is None else ids & sous_arbre
+            if ids is None:
+                return self.ordered_ids("equipements", by="code")
+            return self.ordered_ids("equipements", ids, by="code")
+    
+    def chemin_equipement(self, equipement_id, separateur=" › "):
+        """Emplacement lisible d'un nœud : noms de ses ancêtres, du site à son parent"""
+        with self._lock:
+            chemin = self.hierarchie_equipements.chemins.get(equipement_id, ())
+            return separateur.join(self.get_equipement(ancetre_id)["nom"] for ancetre_id in chemin)
+    
+    def get_synthese_equipements(self):
+        """Nombre d'équipements (hors sites, zones et lignes) au total et par état"""
+        with self._lock:
+            ids = self.query_ids("equipements", {"niveau": [NIVEAUX_EQUIPEMENT[-1]]}) or set()
+            return {"total": len(ids), **self.facet_counts("equipements", "etat", ids)}
+    
+    def get_emplacements(self):
+        """Sites, zones et lignes (nœuds pouvant contenir des équipements), dans l'ordre de l'arborescence"""
+        with self._lock:
+            hierarchie = self.hierarchie_equipements
+            ids = self.query_ids("equipements", {"niveau": NIVEAUX_EQUIPEMENT[:-1]}) or set()
+            
+            def noms(equipement_id):
+                return tuple(self.get_equipement(i)["nom"] for i in hierarchie.chemins.get(equipement_id, ()) + (equipement_id,))
+            return [self.get_equipement(equipement_id) for equipement_id in sorted(ids, key=noms)]
     
     def create_default_users(self):
         """Crée les utilisateurs par défaut"""
@@ -426,69 +3532,1131 @@ class DataManager:
     
     def save_users(self):
         """Sauvegarde les utilisateurs"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+        self._save_collection("users")
     
     def save_tiers(self):
         """Sauvegarde les tiers"""
-        with open(self.tiers_file, 'w', encoding='utf-8') as f:
-            json.dump(self.tiers, f, ensure_ascii=False, indent=2)
+        self._save_collection("fournisseurs")
+        self._save_collection("soustraitants")
     
     def save_outillages(self):
         """Sauvegarde les outillages"""
-        with open(self.outillages_file, 'w', encoding='utf-8') as f:
-            json.dump(self.outillages, f, ensure_ascii=False, indent=2)
+        self._save_collection("outillages")
     
     def authenticate(self, username, password):
         """Authentifie un utilisateur"""
-        user = next((u for u in self.users if u["username"] == username and u["is_active"]), None)
+        user = self.get_record_by_key("users", username)
         
-        if user and user["password_hash"] == self.hash_password(password):
+        if user and user["is_active"] and user["password_hash"] == self.hash_password(password):
             user["last_login"] = datetime.datetime.now().isoformat()
-            self.save_users()
+            self._update("users", user["id"], user)
             return user
         return None
     
     def get_all_outillages(self):
-        """Retourne tous les outillages"""
-        return pd.DataFrame(self.outillages["outillages"])
+        """Retourne tous les outillages (DataFrame en cache, à ne pas modifier)"""
+        return self._frame("outillages")
     
     def add_outillage(self, outillage_data):
         """Ajoute un nouvel outillage"""
-        max_id = max([o["id"] for o in self.outillages["outillages"]], default=0)
-        outillage_data["id"] = max_id + 1
-        self.outillages["outillages"].append(outillage_data)
-        self.save_outillages()
+        outillage_data["id"] = self._next_id("outillages")
+        self._insert("outillages", outillage_data)
         return outillage_data["id"]
     
-    def update_outillage(self, outillage_id, outillage_data):
+    def get_outillage(self, outillage_id):
+        """Retourne un outillage par id (ou None)"""
+        return self.get_record("outillages", outillage_id)
+    
+    def get_outillage_by_reference(self, reference):
+        """Retourne un outillage par référence (ou None)"""
+        return self.get_record_by_key("outillages", reference)
+    
+    def update_outillage(self, outillage_id, outillage_data, expected_rev=None):
         """Met à jour un outillage"""
-        for i, outillage in enumerate(self.outillages["outillages"]):
-            if outillage["id"] == outillage_id:
-                self.outillages["outillages"][i] = outillage_data
-                break
-        self.save_outillages()
+        self._update("outillages", outillage_id, outillage_data, expected_rev)
     
     def delete_outillage(self, outillage_id):
-        """Supprime un outillage"""
-        self.outillages["outillages"] = [o for o in self.outillages["outillages"] if o["id"] != outillage_id]
-        self.save_outillages()
+        """Supprime un outillage (son emprunt en cours est d'abord clôturé, l'historique est conservé)"""
+        with self._lock:
+            if outillage_id in self.emprunts_en_cours.ouverts:
+                self.retourner_outillage(outillage_id)
+            self._delete("outillages", outillage_id)
+    
+    def create_default_emprunts(self):
+        """Reprend le dernier emprunt inscrit sur chaque fiche outillage (emprunt ouvert si l'outillage est encore sorti)"""
+        evenements = []
+        for outillage in self.outillages["outillages"]:
+            if not outillage.get("dernier_utilisateur") or not outillage.get("date_dernier_emprunt"):
+                continue
+            date_emprunt = outillage["date_dernier_emprunt"]
+            emprunt = {
+                "id": len(evenements) + 1,
+                "outillage_id": outillage["id"],
+                "type": EMPRUNT,
+                "utilisateur": outillage["dernier_utilisateur"],
+                "date": date_emprunt,
+                "date_retour_prevue": outillage.get("date_retour_prevue") or (
+                    datetime.date.fromisoformat(date_emprunt[:10]) + datetime.timedelta(days=7)).isoformat(),
+                "motif": "Reprise de la fiche outillage"
+            }
+            evenements.append(emprunt)
+            if outillage.get("disponibilite") != "🟡 Emprunté":
+                evenements.append({
+                    "id": len(evenements) + 1,
+                    "outillage_id": outillage["id"],
+                    "type": RETOUR,
+                    "utilisateur": outillage["dernier_utilisateur"],
+                    "date": date_emprunt,
+                    "emprunt_id": emprunt["id"],
+                    "motif": "Reprise de la fiche outillage"
+                })
+        return evenements
+    
+    def emprunter_outillage(self, outillage_id, utilisateur, date_emprunt, date_retour_prevue, motif="", expected_rev=None):
+        """Enregistre l'événement d'emprunt et rend l'outillage indisponible en une écriture ; retourne l'id de l'emprunt"""
+        with self._lock:
+            outillage = dict(self.get_outillage(outillage_id))
+            if outillage["disponibilite"] != "🟢 Disponible":
+                raise ConflictError(f"{outillage['nom']} n'est plus disponible")
+            # Les réservations de l'emprunteur lui-même ne bloquent pas : il vient chercher l'outillage réservé
+            if not self.outillage_libre(outillage_id, date_emprunt, date_retour_prevue, utilisateur):
+                raise ReservationConflitError(f"{outillage['nom']} est réservé par un autre utilisateur sur cette période")
+            emprunt = {
+                "id": self._next_id("emprunts"),
+                "outillage_id": outillage_id,
+                "type": EMPRUNT,
+                "utilisateur": utilisateur,
+                "date": date_emprunt,
+                "date_retour_prevue": date_retour_prevue,
+                "motif": motif
+            }
+            outillage.update(disponibilite="🟡 Emprunté", dernier_utilisateur=utilisateur, date_dernier_emprunt=date_emprunt)
+            if expected_rev is not None:
+                outillage["_rev"] = expected_rev
+            self._write_batch([("insert", "emprunts", emprunt), ("update", "outillages", outillage)])
+            return emprunt["id"]
+    
+    def retourner_outillage(self, outillage_id, utilisateur="", date_retour=None, expected_rev=None):
+        """Enregistre le retour de l'emprunt ouvert d'un outillage et le rend disponible en une écriture"""
+        with self._lock:
+            emprunt = self.emprunts_en_cours.ouverts.get(outillage_id)
+            if emprunt is None:
+                raise ConflictError(f"outillages #{outillage_id} n'est pas emprunté")
+            retour = {
+                "id": self._next_id("emprunts"),
+                "outillage_id": outillage_id,
+                "type": RETOUR,
+                "utilisateur": utilisateur or emprunt["utilisateur"],
+                "date": date_retour or datetime.date.today().isoformat(),
+                "emprunt_id": emprunt["id"]
+            }
+            operations = [("insert", "emprunts", retour)]
+            outillage = self.get_outillage(outillage_id)
+            if outillage is not None:
+                outillage = dict(outillage, disponibilite="🟢 Disponible")
+                if expected_rev is not None:
+                    outillage["_rev"] = expected_rev
+                operations.append(("update", "outillages", outillage))
+            self._write_batch(operations)
+    
+    def get_emprunts_en_cours(self, avant=None):
+        """Emprunts ouverts (retour prévu avant une date ISO si elle est donnée), par date de retour prévue croissante"""
+        with self._lock:
+            return [self.emprunts_en_cours.ouverts[outillage_id]
+                    for outillage_id in self.emprunts_en_cours.echeant_avant(avant)]
+    
+    def get_emprunts_en_retard(self, aujourd_hui=None):
+        """Emprunts dont la date de retour prévue est dépassée (lus sur l'index des échéances)"""
+        return self.get_emprunts_en_cours((aujourd_hui or datetime.date.today()).isoformat())
+    
+    def get_historique_emprunts(self, outillage_id=None, utilisateur=None):
+        """Ids des emprunts d'un outillage et/ou d'un utilisateur, du plus récent au plus ancien"""
+        with self._lock:
+            ids = self.query_ids("emprunts", {
+                "outillage_id": [outillage_id] if outillage_id is not None else None,
+                "utilisateur": [utilisateur] if utilisateur else None,
+                "type": [EMPRUNT]
+            })
+            return self.ordered_ids("emprunts", ids, by="date", reverse=True)
+    
+    def get_emprunt(self, emprunt_id):
+        """Retourne un événement d'emprunt par id (ou None)"""
+        return self.get_record("emprunts", emprunt_id)
+    
+    def get_retour(self, emprunt_id):
+        """Retourne l'événement de retour d'un emprunt (ou None s'il est en cours)"""
+        with self._lock:
+            return self.emprunts_en_cours.retours.get(emprunt_id)
+    
+    def get_emprunteurs(self):
+        """Utilisateurs ayant emprunté au moins un outillage"""
+        with self._lock:
+            emprunts = self.query_ids("emprunts", {"type": [EMPRUNT]})
+            return sorted(utilisateur for utilisateur, nombre in self.facet_counts("emprunts", "utilisateur", emprunts).items() if nombre)
+    
+    def create_default_reservations_outillage(self):
+        """Aucune réservation au départ"""
+        return []
+    
+    def _periode_empruntee(self, outillage_id):
+        """Période occupée par l'emprunt en cours d'un outillage (jusqu'à aujourd'hui au moins s'il est en retard), ou None"""
+        emprunt = self.emprunts_en_cours.ouverts.get(outillage_id)
+        if emprunt is None:
+            return None
+        return emprunt["date"][:10], max(emprunt["date_retour_prevue"], datetime.date.today().isoformat())
+    
+    def outillage_libre(self, outillage_id, debut, fin, utilisateur=None):
+        """Indique si un outillage n'est ni réservé (par un autre utilisateur) ni emprunté sur [debut, fin] (dates ISO)"""
+        with self._lock:
+            emprunt = self._periode_empruntee(outillage_id)
+            if emprunt is not None and emprunt[0] <= fin and emprunt[1] >= debut:
+                return False
+            ignorer = {
+                reservation_id for reservation_id in self.query_ids("reservations_outillage", {"utilisateur": [utilisateur]}) or ()
+            } if utilisateur else ()
+            return self.planning_reservations.conflit(outillage_id, debut, fin, ignorer) is None
+    
+    def get_outillages_libres(self, type_outillage, debut, fin):
+        """Ids des outillages d'un type en état de servir et libres sur toute la période [debut, fin]"""
+        with self._lock:
+            ids = self.query_ids("outillages", {"type": [type_outillage]}) or set()
+            return [
+                outillage_id for outillage_id in self.ordered_ids("outillages", ids)
+                if self.get_outillage(outillage_id)["disponibilite"] in DISPONIBILITES_RESERVABLES
+                and self.outillage_libre(outillage_id, debut, fin)
+            ]
+    
+    def reserver_outillage(self, outillage_id, debut, fin, utilisateur, bt=None, motif=""):
+        """Réserve un outillage sur [debut, fin] (dates ISO incluses) ; lève ReservationConflitError si la période est prise"""
+        with self._lock:
+            outillage = dict(self.get_outillage(outillage_id))
+            if fin < debut:
+                raise ValueError("La date de fin précède la date de début")
+            if outillage["disponibilite"] not in DISPONIBILITES_RESERVABLES:
+                raise ReservationConflitError(f"{outillage['nom']} est {outillage['disponibilite']}")
+            if not self.outillage_libre(outillage_id, debut, fin):
+                raise ReservationConflitError(f"{outillage['nom']} est déjà réservé ou emprunté sur cette période")
+            reservation = {
+                "id": self._next_id("reservations_outillage"),
+                "outillage_id": outillage_id,
+                "debut": debut,
+                "fin": fin,
+                "utilisateur": utilisateur,
+                "bt": bt or None,
+                "motif": motif,
+                "date_creation": datetime.datetime.now().isoformat(timespec="seconds")
+            }
+            # La fiche outillage est réécrite avec la réservation, contre la révision lue ici : une réservation
+            # enregistrée entre-temps par une autre instance (absente du planning en mémoire) fait échouer le lot
+            outillage["derniere_reservation"] = reservation["id"]
+            self._write_batch([("insert", "reservations_outillage", reservation), ("update", "outillages", outillage)])
+            return reservation["id"]
+    
+    def annuler_reservation(self, reservation_id):
+        """Supprime une réservation"""
+        self._delete("reservations_outillage", reservation_id)
+    
+    def get_reservation(self, reservation_id):
+        """Retourne une réservation par id (ou None)"""
+        return self.get_record("reservations_outillage", reservation_id)
+    
+    def get_reservations_ids(self, outillage_id=None, bt=None, depuis=None):
+        """Ids des réservations filtrées (outillage, BT) se terminant à partir d'une date ISO, par date de début"""
+        with self._lock:
+            ids = self.query_ids("reservations_outillage", {
+                "outillage_id": [outillage_id] if outillage_id is not None else None,
+                "bt": [bt] if bt else None
+            })
+            ordered = self.ordered_ids("reservations_outillage", ids, by="debut")
+            if depuis is None:
+                return ordered
+            return [reservation_id for reservation_id in ordered if self.get_reservation(reservation_id)["fin"] >= depuis]
+    
+    def get_verifications_ids(self, fin, debut="0"):
+        """Ids des outillages dont la prochaine vérification tombe entre debut et fin (dates ISO), par échéance"""
+        # Borne basse "0" : les outillages sans échéance (chaîne vide) sont exclus
+        return self.range_ids("outillages", "date_prochaine_verification", debut, fin, ordered=True)
+    
+    def get_verifications_en_retard(self, aujourd_hui=None):
+        """Ids des outillages dont la vérification est dépassée, de la plus ancienne échéance à la plus récente"""
+        aujourd_hui = aujourd_hui or datetime.date.today()
+        return self.get_verifications_ids((aujourd_hui - datetime.timedelta(days=1)).isoformat())
+    
+    def get_verifications_a_venir(self, jours, aujourd_hui=None):
+        """Ids des outillages dont la vérification tombe dans les N prochains jours (aujourd'hui inclus)"""
+        aujourd_hui = aujourd_hui or datetime.date.today()
+        return self.get_verifications_ids((aujourd_hui + datetime.timedelta(days=jours)).isoformat(), aujourd_hui.isoformat())
+    
+    def get_bt_verification_ouvert(self, outillage_id):
+        """BT de vérification non clôturé d'un outillage (ou None)"""
+        with self._lock:
+            for bt_id in self.query_ids("bons_travail", {"outillage_id": [outillage_id]}) or ():
+                bt = self.get_bon_travail(bt_id)
+                if bt.get("statut") not in Ordonnanceur.STATUTS_CLOS:
+                    return bt
+            return None
+    
+    def generer_bts_verification(self, jours, technicien="À affecter", aujourd_hui=None):
+        """Crée en une écriture un BT de vérification pour chaque outillage échu ou à échéance dans N jours qui n'en a pas"""
+        with self._lock:
+            aujourd_hui = aujourd_hui or datetime.date.today()
+            a_generer = [
+                self.get_outillage(outillage_id)
+                for outillage_id in self.get_verifications_ids((aujourd_hui + datetime.timedelta(days=jours)).isoformat())
+                if self.get_bt_verification_ouvert(outillage_id) is None
+            ]
+            operations = [
+                ("insert", "bons_travail", self._preparer_bon_travail({
+                    "categorie": "Préventive",
+                    "outillage_id": outillage["id"],
+                    "date_prevue": outillage["date_prochaine_verification"],
+                    "equipement": f"{outillage['nom']} ({outillage['reference']})",
+                    "type": TYPE_BT_VERIFICATION,
+                    "technicien": technicien,
+                    "date_planifiee": max(outillage["date_prochaine_verification"], aujourd_hui.isoformat()),
+                    "date_realisation": None,
+                    "statut": "🟢 Planifié",
+                    "priorite": "Haute" if outillage["date_prochaine_verification"] < aujourd_hui.isoformat() else "Normale",
+                    "temps_estime": "1h",
+                    "checklist": list(CHECKLIST_VERIFICATION)
+                }))
+                for outillage in a_generer
+            ]
+            if operations:
+                self._write_batch(operations)
+            return [bt["numero"] for _, _, bt in operations]
     
     def get_all_tiers(self):
-        """Retourne tous les tiers"""
-        all_tiers = self.tiers["fournisseurs"] + self.tiers["soustraitants"]
-        return pd.DataFrame(all_tiers)
+        """Retourne tous les tiers (reconcaténés seulement si une des deux collections a changé)"""
+        with self._lock:
+            versions = (self._versions["fournisseurs"], self._versions["soustraitants"])
+            if self._tiers_frame is None or self._tiers_frame[0] != versions:
+                all_tiers = pd.concat([self._frame("fournisseurs"), self._frame("soustraitants")], ignore_index=True)
+                self._tiers_frame = (versions, all_tiers)
+            return self._tiers_frame[1].copy(deep=False)
     
     def get_fournisseurs(self):
         """Retourne tous les fournisseurs"""
-        return pd.DataFrame(self.tiers["fournisseurs"])
+        return self._frame("fournisseurs")
     
     def get_soustraitants(self):
         """Retourne tous les sous-traitants"""
-        return pd.DataFrame(self.tiers["soustraitants"])
+        return self._frame("soustraitants")
+    
+    def add_fournisseur(self, fournisseur_data):
+        """Ajoute un nouveau fournisseur"""
+        fournisseur_data["id"] = self._next_id("fournisseurs")
+        self._insert("fournisseurs", fournisseur_data)
+        return fournisseur_data["id"]
+    
+    def add_soustraitant(self, soustraitant_data):
+        """Ajoute un nouveau sous-traitant (ids à partir de 101)"""
+        soustraitant_data["id"] = self._next_id("soustraitants", floor=100)
+        self._insert("soustraitants", soustraitant_data)
+        return soustraitant_data["id"]
+    
+    def importer(self, collection, blocs, mettre_a_jour=False, tout_ou_rien=True):
+        """Importe des blocs de lignes (voir lire_blocs) en une seule écriture ; retourne le compte rendu de l'import"""
+        schema = SCHEMAS_IMPORT[collection]
+        cle = schema["cle"]
+        rapport = {"lignes": 0, "crees": 0, "mis_a_jour": 0, "erreurs": [], "colonnes_ignorees": []}
+        # Lecture et validation hors verrou : les autres sessions lisent et écrivent pendant l'analyse du fichier
+        vus = set()
+        # (ligne, clé, enregistrement complet pour une création, cellules renseignées pour une mise à jour)
+        candidats = []
+        correspondances = None
+        for bloc in blocs:
+            if correspondances is None:
+                correspondances = colonnes_import(bloc.columns, schema)
+                rapport["colonnes_ignorees"] = [entete for entete in bloc.columns if entete not in correspondances]
+            rapport["lignes"] += len(bloc)
+            champs, vides, erreurs = valider_bloc(bloc, schema, correspondances)
+            
+            # Clé métier unique dans le fichier ; son existence est contrôlée sous verrou, juste avant l'écriture
+            cles = champs[cle]
+            doublon = (cles.duplicated() | cles.isin(vus)) & ~vides[cle]
+            erreurs += [(index + 2, schema["colonnes"][cle][0], cles.at[index], "en double dans le fichier")
+                        for index in doublon[doublon].index]
+            vus.update(cles[~vides[cle]])
+            rapport["erreurs"] += erreurs
+            
+            valides = ~champs.index.isin([ligne - 2 for ligne, _, _, _ in erreurs])
+            completes = champs[valides]
+            if schema.get("completer"):
+                completes = completes.assign(**schema["completer"](completes))
+            # Une mise à jour ne remplace que les cellules renseignées
+            if mettre_a_jour:
+                renseignes = [{champ: valeur for (champ, valeur), garde in zip(ligne.items(), masque) if garde}
+                              for ligne, masque in zip(champs[valides].to_dict("records"), (~vides[valides]).to_numpy())]
+            else:
+                renseignes = [None] * len(completes)
+            candidats += zip(completes.index + 2, cles[valides].where(~vides[cle][valides], None),
+                             completes.to_dict("records"), renseignes)
+        
+        if correspondances is None:
+            raise ImportInvalideError("Le fichier ne contient aucune ligne de données")
+        # Colonnes absentes du fichier : valeurs par défaut du schéma, puis champs fixés à la création
+        absents = {champ: defaut for champ, (_, _, defaut) in schema["colonnes"].items()
+                   if champ not in correspondances.values()}
+        
+        with self._lock:
+            # Clés relues sous verrou : une fiche créée pendant l'analyse par une autre session est prise en compte
+            existants = {record.get(cle): record for record in self._records(collection)}
+            creations, modifications = [], []
+            for ligne, valeur, record, renseignes_ligne in candidats:
+                existant = existants.get(valeur) if valeur is not None else None
+                if existant is None:
+                    creations.append(record)
+                elif mettre_a_jour:
+                    modifications.append({**existant, **renseignes_ligne})
+                else:
+                    rapport["erreurs"].append((ligne, schema["colonnes"][cle][0], valeur, "existe déjà"))
+            rapport["erreurs"].sort()
+            if rapport["erreurs"] and tout_ou_rien:
+                return rapport
+            
+            ids = self._next_ids(collection, len(creations), floor=schema.get("premier_id", 0))
+            operations = [("insert", collection, {"id": record_id, **absents, **schema.get("fixes", {}), **record})
+                          for record_id, record in zip(ids, creations)]
+            operations += [("update", collection, record) for record in modifications]
+            if collection == "personnels":
+                # Titres d'habilitation dans le même lot : l'import reste tout ou rien
+                operations += self._operations_habilitations(*(record for _, _, record in operations))
+            if operations:
+                self._write_batch(operations)
+            rapport["crees"], rapport["mis_a_jour"] = len(creations), len(modifications)
+            return rapport
+    
+    def exporter(self, collection, format_export, taille=TAILLE_BLOC_EXPORT):
+        """Exporte une collection, lue par blocs dans le stockage, vers un fichier temporaire (relu depuis le début)"""
+        fichier = tempfile.TemporaryFile()
+        try:
+            ecrire_export(fichier, format_export, lambda: self.storage.iter_blocs(collection, taille))
+        except BaseException:
+            fichier.close()
+            raise
+        return relire_export(fichier)
+    
+    def sauvegarder(self, taille=TAILLE_BLOC_EXPORT):
+        """Archive zip de toutes les collections (un fichier JSON lignes chacune) dans un fichier temporaire"""
+        fichier = tempfile.TemporaryFile()
+        try:
+            with zipfile.ZipFile(fichier, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for collection in self.COLLECTIONS:
+                    with archive.open(f"{collection}.jsonl", "w") as membre:
+                        ecrire_export(membre, "jsonl", lambda: self.storage.iter_blocs(collection, taille))
+        except BaseException:
+            fichier.close()
+            raise
+        return relire_export(fichier)
+ 
+    def create_default_interventions(self):
+        """Crée l'historique d'interventions de démonstration"""
+        return [
+            {"id": 1, "bt_id": "BT-P-090", "equipement": "Pompe centrifuge P-101", "type": "Préventive", "date": "2025-07-03",
+             "technicien": "Ali ben salah", "duree_arret": 2.0, "temps_passe": 2.0, "cout": 180.0,
+             "description": "Graissage et contrôle vibrations"},
+            {"id": 2, "bt_id": "BT-C-081", "equipement": "Compresseur CMP-01", "type": "Corrective", "date": "2025-07-11",
+             "technicien": "Mohamed Trabelsi", "duree_arret": 5.5, "temps_passe": 5.0, "cout": 920.0,
+             "description": "Remplacement clapet refoulement"},
+            {"id": 3, "bt_id": "BT-P-094", "equipement": "Convoyeur bande C-205", "type": "Préventive", "date": "2025-07-24",
+             "technicien": "Karim Chaouch", "duree_arret": 1.5, "temps_passe": 1.5, "cout": 120.0,
+             "description": "Tension courroie et nettoyage rouleaux"},
+            {"id": 4, "bt_id": "BT-C-085", "equipement": "Pompe centrifuge P-101", "type": "Corrective", "date": "2025-08-06",
+             "technicien": "Ali ben salah", "duree_arret": 4.0, "temps_passe": 4.5, "cout": 640.0,
+             "description": "Fuite garniture mécanique"},
+            {"id": 5, "bt_id": "BT-P-101", "equipement": "Four F-03", "type": "Préventive", "date": "2025-08-19",
+             "technicien": "Mohamed Trabelsi", "duree_arret": 3.0, "temps_passe": 3.0, "cout": 260.0,
+             "description": "Contrôle brûleurs et réfractaire"},
+            {"id": 6, "bt_id": "BT-P-103", "equipement": "Ventilateur V-45", "type": "Préventive", "date": "2025-08-27",
+             "technicien": "Karim Chaouch", "duree_arret": 1.0, "temps_passe": 1.0, "cout": 75.0,
+             "description": "Équilibrage et graissage paliers"},
+            {"id": 7, "bt_id": "BT-C-090", "equipement": "Convoyeur bande C-205", "type": "Urgente", "date": "2025-09-04",
+             "technicien": "Karim Chaouch", "duree_arret": 6.0, "temps_passe": 7.0, "cout": 1350.0,
+             "description": "Rupture bande transporteuse"},
+            {"id": 8, "bt_id": "BT-P-110", "equipement": "Compresseur CMP-01", "type": "Préventive", "date": "2025-09-16",
+             "technicien": "Mohamed Trabelsi", "duree_arret": 2.5, "temps_passe": 2.5, "cout": 310.0,
+             "description": "Vidange et remplacement filtres"},
+            {"id": 9, "bt_id": "BT-A-004", "equipement": "Four F-03", "type": "Améliorative", "date": "2025-09-29",
+             "technicien": "Ahmed Ben Salah", "duree_arret": 8.0, "temps_passe": 12.0, "cout": 2400.0,
+             "description": "Installation régulation de température"},
+            {"id": 10, "bt_id": "BT-P-118", "equipement": "Pompe centrifuge P-101", "type": "Préventive", "date": "2025-10-02",
+             "technicien": "Ali ben salah", "duree_arret": 2.0, "temps_passe": 2.0, "cout": 180.0,
+             "description": "Graissage et contrôle vibrations"},
+            {"id": 11, "bt_id": "BT-C-097", "equipement": "Ventilateur V-45", "type": "Corrective", "date": "2025-10-14",
+             "technicien": "Fatma Jebali", "duree_arret": 2.5, "temps_passe": 3.0, "cout": 410.0,
+             "description": "Remplacement roulement côté moteur"},
+            {"id": 12, "bt_id": "BT-P-122", "equipement": "Convoyeur bande C-205", "type": "Préventive", "date": "2025-10-23",
+             "technicien": "Karim Chaouch", "duree_arret": 1.5, "temps_passe": 1.5, "cout": 120.0,
+             "description": "Tension courroie et nettoyage rouleaux"},
+            {"id": 13, "bt_id": "BT-P-127", "equipement": "Four F-03", "type": "Préventive", "date": "2025-11-05",
+             "technicien": "Mohamed Trabelsi", "duree_arret": 3.0, "temps_passe": 3.0, "cout": 260.0,
+             "description": "Contrôle brûleurs et réfractaire"},
+            {"id": 14, "bt_id": "BT-C-102", "equipement": "Compresseur CMP-01", "type": "Corrective", "date": "2025-11-18",
+             "technicien": "Mohamed Trabelsi", "duree_arret": 3.5, "temps_passe": 4.0, "cout": 560.0,
+             "description": "Capteur de pression défaillant"},
+            {"id": 15, "bt_id": "BT-P-131", "equipement": "Pompe centrifuge P-101", "type": "Préventive", "date": "2025-12-02",
+             "technicien": "Ali ben salah", "duree_arret": 2.0, "temps_passe": 2.0, "cout": 180.0,
+             "description": "Graissage et contrôle vibrations"},
+            {"id": 16, "bt_id": "BT-C-001", "equipement": "Pompe centrifuge P-101", "type": "Corrective", "date": "2025-12-13",
+             "technicien": "Ali ben salah", "duree_arret": 3.5, "temps_passe": 3.5, "cout": 520.0,
+             "description": "Vibrations anormales - désalignement"}
+        ]
+    
+    def get_all_interventions(self):
+        """Retourne l'historique des interventions"""
+        return self.interventions
+    
+    def add_intervention(self, intervention_data):
+        """Enregistre une intervention réalisée (alimente les indicateurs)"""
+        intervention_data["id"] = self._next_id("interventions")
+        self._insert("interventions", intervention_data)
+        return intervention_data["id"]
+    
+    def get_indicateurs(self):
+        """Retourne les indicateurs de maintenance courants (calculés sur les agrégats, sans relire l'historique)"""
+        with self._lock:
+            return self.kpi.indicateurs()
+    
+    def get_agregats(self, dimension):
+        """Retourne les agrégats d'interventions d'une dimension : valeur -> compteurs"""
+        with self._lock:
+            return {valeur: self.kpi.totaux(dimension, valeur) for valeur in self.kpi.valeurs(dimension)}
+    
+    def get_mttr_par_equipement(self, limit=5):
+        """Retourne (équipement, MTTR, nombre de défaillances) pour les équipements les plus défaillants"""
+        with self._lock:
+            return self.kpi.mttr_par_equipement(limit)
+    
+    def create_default_demandes_intervention(self):
+        """Reprend les défaillances de l'historique des interventions en demandes d'intervention clôturées"""
+        demandes = []
+        for intervention in self.interventions:
+            if intervention.get("type") not in KpiEngine.TYPES_DEFAILLANCE:
+                continue
+            # L'historique n'a que le nom de l'équipement : la référence est lue dans le parc
+            equipement = next((e for e in self.equipements if e["nom"] == intervention.get("equipement")), None)
+            demande_id = len(demandes) + 1
+            demandes.append({
+                "id": demande_id,
+                "numero": f"DI-{demande_id:05d}",
+                "equipement_nom": intervention.get("equipement", ""),
+                "reference_equipement": equipement["code"] if equipement else intervention.get("equipement", ""),
+                "localisation": self.chemin_equipement(equipement["id"]) if equipement else "",
+                "type_panne": "Non spécifié",
+                "criticite": "Critique" if intervention["type"] == "Urgente" else "Moyenne",
+                "demandeur": "",
+                "departement": "Production",
+                "date_detection": intervention["date"],
+                "heure_detection": "08:00:00",
+                "symptomes": intervention.get("description", ""),
+                "impact_production": "Arrêt total" if intervention["type"] == "Urgente" else "Arrêt partiel",
+                "actions_deja_prises": "",
+                "statut": DEMANDE_CLOTUREE,
+                "date_soumission": intervention["date"],
+                "priorite": "Urgente" if intervention["type"] == "Urgente" else "Haute",
+                "bt": intervention.get("bt_id", ""),
+                "duree_arret": intervention.get("duree_arret"),
+                "date_remise_service": intervention["date"]
+            })
+        return demandes
+    
+    def add_demande_intervention(self, demande_data):
+        """Enregistre une demande d'intervention (une défaillance détectée) et lui attribue son numéro"""
+        with self._lock:
+            demande_data["id"] = self._next_id("demandes_intervention")
+            demande_data.setdefault("numero", f"DI-{demande_data['id']:05d}")
+            demande_data.setdefault("statut", DEMANDE_EN_ATTENTE)
+            self._insert("demandes_intervention", demande_data)
+            return demande_data["id"]
+    
+    def get_demande_intervention(self, demande_id):
+        """Retourne une demande d'intervention par id (ou None)"""
+        return self.get_record("demandes_intervention", demande_id)
+    
+    def get_demandes_ids(self, statuts=None, references=None):
+        """Ids des demandes filtrées par statut et équipement, les plus récentes d'abord"""
+        with self._lock:
+            ids = self.query_ids("demandes_intervention", {"statut": statuts, "reference_equipement": references})
+            return self.ordered_ids("demandes_intervention", ids, by="date_detection", reverse=True)
+    
+    def get_demandes_prioritaires(self, n=10):
+        """Les n demandes en attente les plus urgentes (sans les retirer de la file)"""
+        with self._lock:
+            return [self.get_demande_intervention(demande_id) for demande_id in self.file_demandes.peek(n)]
+    
+    def prendre_demandes(self, n=1, responsable=""):
+        """Retire de la file les n demandes les plus urgentes et les passe en prise en charge (une écriture)"""
+        with self._lock:
+            maintenant = datetime.datetime.now().isoformat(timespec="seconds")
+            demandes = [
+                {**self.get_demande_intervention(demande_id), "statut": DEMANDE_PRISE_EN_CHARGE,
+                 "responsable": responsable, "date_prise_en_charge": maintenant}
+                for demande_id in self.file_demandes.pop(n)
+            ]
+            if demandes:
+                try:
+                    self._write_batch([("update", "demandes_intervention", demande) for demande in demandes])
+                except Exception:
+                    # Les demandes retirées reviennent dans la file si l'écriture échoue
+                    self.file_demandes.rebuild(self.demandes_intervention)
+                    raise
+            return demandes
+    
+    def _preparer_suivi_demande(self, bon_travail, **champs):
+        """Copie de la demande d'origine d'un BT avec son avancement (BT émis, remise en service), None si le BT n'a pas de demande"""
+        demande = self.get_demande_intervention(bon_travail.get("demande_id"))
+        return None if demande is None else {**demande, **champs}
+    
+    def get_fiabilite(self):
+        """MTBF, MTTR, paramètres de Weibull et risque par équipement (recalculés seulement si les demandes ont changé)"""
+        with self._lock:
+            versions = (self._versions["demandes_intervention"], datetime.date.today())
+            if self._fiabilite is None or self._fiabilite[0] != versions:
+                self._fiabilite = (versions, analyser_fiabilite(self._frame("demandes_intervention")))
+            return self._fiabilite[1].copy(deep=False)
+    
+    def create_default_bons_travail(self):
+        """Crée les Bons de Travail de démonstration"""
+        return [
+            {
+                "id": 1,
+                "numero": "BT-C-001",
+                "categorie": "Corrective",
+                "equipement": "Pompe centrifuge P-101",
+                "reference": "EQUIP-023",
+                "type": "Mécanique",
+                "technicien": "Ali ben salah",
+                "date_creation": "2025-12-13",
+                "date_debut": "2025-12-13",
+                "date_fin": "",
+                "statut": "🔵 En cours",
+                "priorite": "Haute",
+                "temps_estime": "4h",
+                "temps_reel": "3h30"
+            },
+            {
+                "id": 2,
+                "numero": "BT-C-002",
+                "categorie": "Corrective",
+                "equipement": "Convoyeur bande C-205",
+                "reference": "EQUIP-045",
+                "type": "Électrique",
+                "technicien": "Fatma Jebali",
+                "date_creation": "2025-11-25",
+                "date_debut": "2025-11-25",
+                "date_fin": "2025-11-26",
+                "statut": "🟢 Terminé",
+                "priorite": "Normale",
+                "temps_estime": "2h",
+                "temps_reel": "1h45"
+            },
+            {
+                "id": 3,
+                "numero": "BT-P-001",
+                "categorie": "Préventive",
+                "plan_id": 1,
+                "date_prevue": "2025-12-02",
+                "equipement": "Pompe centrifuge P-101",
+                "type": "Mensuelle",
+                "technicien": "Ali ben salah",
+                "date_creation": "2025-11-25",
+                "date_planifiee": "2025-12-20",
+                "date_realisation": None,
+                "statut": "🟢 Planifié",
+                "priorite": "Normale",
+                "checklist": ["Vérifier vibrations", "Contrôler température", "Graisser roulements"]
+            },
+            {
+                "id": 4,
+                "numero": "BT-P-002",
+                "categorie": "Préventive",
+                "plan_id": 2,
+                "date_prevue": "2025-12-15",
+                "equipement": "Convoyeur bande C-205",
+                "type": "Hebdomadaire",
+                "technicien": "Fatma Jebali",
+                "date_creation": "2025-12-11",
+                "date_planifiee": "2025-12-18",
+                "date_realisation": None,
+                "statut": "🟢 Planifié",
+                "priorite": "Normale",
+                "checklist": ["Vérifier tension courroie", "Nettoyer rouleaux", "Contrôler alignement"]
+            }
+        ]
+    
+    def get_all_bons_travail(self):
+        """Retourne tous les Bons de Travail"""
+        return self.bons_travail
+    
+    def get_bon_travail(self, bt_id):
+        """Retourne un Bon de Travail par id (ou None)"""
+        return self.get_record("bons_travail", bt_id)
+    
+    def get_bon_travail_by_numero(self, numero):
+        """Retourne un Bon de Travail par numéro (ou None)"""
+        return self.get_record_by_key("bons_travail", numero)
+    
+    def _preparer_bon_travail(self, bt_data):
+        """Attribue l'id, le numéro (d'après l'id s'il n'est pas fourni) et la date de création d'un nouveau BT"""
+        if bt_data.get("numero") and self.get_bon_travail_by_numero(bt_data["numero"]) is not None:
+            raise BonTravailInvalideError(f"Le numéro {bt_data['numero']} est déjà utilisé")
+        bt_data["id"] = self._next_id("bons_travail")
+        bt_data.setdefault("categorie", "Corrective")
+        if not bt_data.get("numero"):
+            prefixe = "BT-P" if bt_data["categorie"] == "Préventive" else "BT-C"
+            numero = f"{prefixe}-{bt_data['id']:03d}"
+            # Un numéro saisi à la main peut déjà porter celui de cet id : suffixe jusqu'au premier libre
+            suffixe = 1
+            while self.get_bon_travail_by_numero(numero if suffixe == 1 else f"{numero}-{suffixe}") is not None:
+                suffixe += 1
+            bt_data["numero"] = numero if suffixe == 1 else f"{numero}-{suffixe}"
+        bt_data.setdefault("date_creation", datetime.date.today().isoformat())
+        return bt_data
+    
+    def add_bon_travail(self, bt_data):
+        """Enregistre un nouveau Bon de Travail (et le rattache à sa demande d'intervention)"""
+        with self._lock:
+            operations = [("insert", "bons_travail", self._preparer_bon_travail(bt_data))]
+            # La demande passe à « BT émis » dans la même écriture : elle ne reste jamais en file avec son BT créé
+            demande = self._preparer_suivi_demande(bt_data, statut=DEMANDE_BT_EMIS, bt=bt_data["numero"])
+            if demande is not None:
+                operations.append(("update", "demandes_intervention", demande))
+            self._write_batch(operations)
+            return bt_data["id"]
+    
+    def update_bon_travail(self, bt_id, bt_data, expected_rev=None):
+        """Met à jour un Bon de Travail"""
+        self._update("bons_travail", bt_id, bt_data, expected_rev)
+    
+    def cloturer_bon_travail(self, bt_id, temps_reel, duree_arret, cout, observations="",
+                             statut="🟢 Terminé", date_fin=None, expected_rev=None):
+        """Clôture un Bon de Travail et enregistre l'intervention correspondante (alimente les indicateurs)"""
+        with self._lock:
+            bt = dict(self.get_bon_travail(bt_id))
+            date_fin = date_fin or datetime.date.today().isoformat()
+            bt.update({
+                "statut": statut,
+                "date_debut": bt.get("date_debut") or date_fin,
+                "date_fin": date_fin,
+                "temps_reel": f"{temps_reel:g}h",
+                "observations": observations,
+                # Révision lue à l'ouverture du formulaire (None : sans contrôle)
+                "_rev": expected_rev
+            })
+            # BT, intervention, demande, plan et outillage sont écrits ensemble : la clôture est tout ou rien
+            operations = [("update", "bons_travail", bt), ("insert", "interventions", {
+                "id": self._next_id("interventions"),
+                "bt_id": bt["numero"],
+                "equipement": bt.get("equipement", "Non spécifié"),
+                "type": "Urgente" if bt.get("priorite") == "Urgente" else bt.get("categorie", "Corrective"),
+                "date": date_fin,
+                "technicien": bt.get("technicien", ""),
+                "duree_arret": duree_arret,
+                "temps_passe": temps_reel,
+                "cout": cout,
+                "description": observations or bt.get("description", "")
+            })]
+            # La demande d'origine enregistre la remise en service et la durée d'arrêt (MTTR)
+            demande = self._preparer_suivi_demande(bt, statut=DEMANDE_CLOTUREE, duree_arret=duree_arret,
+                                                   date_remise_service=date_fin)
+            if demande is not None:
+                operations.append(("update", "demandes_intervention", demande))
+            # Un BT issu d'un plan préventif marque son occurrence comme réalisée
+            if bt.get("plan_id") and bt.get("date_prevue") and self.get_plan_preventif(bt["plan_id"]) is not None:
+                operations.append(("update", "plans_preventifs", self._preparer_occurrence(
+                    bt["plan_id"], bt["date_prevue"], "🔵 Réalisé", realisation=date_fin)))
+            # Un BT de vérification reporte la prochaine échéance de l'outillage
+            outillage = self.get_outillage(bt["outillage_id"]) if bt.get("outillage_id") else None
+            if outillage is not None:
+                prochaine = datetime.date.fromisoformat(date_fin[:10]) + datetime.timedelta(days=periodicite_verification(outillage))
+                operations.append(("update", "outillages", {**outillage, "date_derniere_verification": date_fin[:10],
+                                                             "date_prochaine_verification": prochaine.isoformat()}))
+            self._write_batch(operations)
+    
+    def create_default_plans_preventifs(self):
+        """Crée les plans de maintenance préventive de démonstration"""
+        return [
+            {
+                "id": 1,
+                "equipement": "Pompe centrifuge P-101",
+                "type": "Mensuelle",
+                "date_debut": "2025-01-02",
+                "technicien": "Ali ben salah",
+                "duree_estimee": "2h",
+                "taches": ["Vérifier vibrations", "Contrôler température", "Graisser roulements"],
+                "derniere_realisation": "2025-11-02",
+                "actif": True,
+                "exceptions": {"2025-12-02": {"etat": "🟡 En cours", "bt": "BT-P-001"}}
+            },
+            {
+                "id": 2,
+                "equipement": "Convoyeur bande C-205",
+                "type": "Hebdomadaire",
+                "date_debut": "2025-01-06",
+                "technicien": "Fatma Jebali",
+                "duree_estimee": "1h",
+                "taches": ["Vérifier tension courroie", "Nettoyer rouleaux", "Contrôler alignement"],
+                "derniere_realisation": "2025-12-08",
+                "actif": True,
+                "exceptions": {"2025-12-15": {"etat": "🟡 En cours", "bt": "BT-P-002"}}
+            },
+            {
+                "id": 3,
+                "equipement": "Compresseur d'air COMP-01",
+                "type": "Trimestrielle",
+                "date_debut": "2025-03-13",
+                "technicien": "Mohamed Trabelsi",
+                "duree_estimee": "4h",
+                "taches": ["Vidanger", "Remplacer filtres", "Contrôler soupapes"],
+                "derniere_realisation": "2025-09-10",
+                "actif": True,
+                "exceptions": {"2025-12-13": {"etat": "🟡 En cours"}}
+            }
+        ]
+    
+    def get_all_plans_preventifs(self):
+        """Retourne tous les plans préventifs"""
+        return self.plans_preventifs
+    
+    def get_plan_preventif(self, plan_id):
+        """Retourne un plan préventif par id (ou None)"""
+        return self.get_record("plans_preventifs", plan_id)
+    
+    def add_plan_preventif(self, plan_data):
+        """Enregistre un nouveau plan préventif (règle de récurrence, sans occurrences)"""
+        plan_data["id"] = self._next_id("plans_preventifs")
+        plan_data.setdefault("actif", True)
+        plan_data.setdefault("exceptions", {})
+        self._insert("plans_preventifs", plan_data)
+        return plan_data["id"]
+    
+    def update_plan_preventif(self, plan_id, plan_data, expected_rev=None):
+        """Met à jour un plan préventif"""
+        self._update("plans_preventifs", plan_id, plan_data, expected_rev)
+    
+    def marquer_occurrence(self, plan_id, date_prevue, etat, **details):
+        """Enregistre l'état d'une occurrence (report : date, BT généré : bt, réalisation) comme exception du plan"""
+        with self._lock:
+            plan = self._preparer_occurrence(plan_id, date_prevue, etat, **details)
+            self.update_plan_preventif(plan_id, plan, expected_rev=plan["_rev"])
+    
+    def _preparer_occurrence(self, plan_id, date_prevue, etat, **details):
+        """Copie du plan avec l'état de l'occurrence enregistré comme exception"""
+        plan = dict(self.get_plan_preventif(plan_id))
+        exceptions = dict(plan.get("exceptions", {}))
+        exceptions[date_prevue] = {**exceptions.get(date_prevue, {}), **details, "etat": etat}
+        plan["exceptions"] = exceptions
+        if "realisation" in details:
+            plan["derniere_realisation"] = details["realisation"]
+        return plan
+    
+    def get_planning_preventif(self, debut, fin, types=None):
+        """Occurrences des plans (filtrés par type) dans [debut, fin], générées à la demande, et leur nombre"""
+        with self._lock:
+            ids = self.query_ids("plans_preventifs", {"type": types})
+            plans = [self.get_plan_preventif(plan_id) for plan_id in self.ordered_ids("plans_preventifs", ids)]
+        # Les plans sont remplacés (jamais modifiés en place) : la génération peut se poursuivre hors verrou
+        return planning_preventif(plans, debut, fin), sum(compter_occurrences(plan, debut, fin) for plan in plans)
+    
+    def _ordonnancement(self):
+        """Ordonnanceur des techniciens, construit au premier usage (et chaque nouveau jour) puis tenu à jour"""
+        aujourd_hui = datetime.date.today()
+        if self._ordonnanceur is None or self._ordonnanceur.aujourd_hui != aujourd_hui:
+            ordonnanceur = Ordonnanceur(aujourd_hui, self.validites_habilitations)
+            ordonnanceur.charger(self.personnels, self.bons_travail)
+            self._ordonnanceur = ordonnanceur
+        return self._ordonnanceur
+    
+    def get_affectations(self, debut=None, fin=None):
+        """Affectations des BT ouverts sur une période, BT sans technicien (id -> motif) et charges journalières"""
+        with self._lock:
+            ordonnanceur = self._ordonnancement()
+            return ordonnanceur.plan(debut, fin), dict(ordonnanceur.non_affectes), ordonnanceur.charges(debut, fin)
+    
+    def proposer_technicien(self, bt_data):
+        """Technicien et jour que l'ordonnanceur retiendrait pour un nouveau BT (None si aucun)"""
+        with self._lock:
+            return self._ordonnancement().proposer(bt_data)
+    
+    def appliquer_affectations(self, debut=None, fin=None):
+        """Reporte sur les BT le technicien et la date retenus par l'ordonnanceur ; retourne le nombre de BT modifiés"""
+        with self._lock:
+            modifies = 0
+            for ligne in self._ordonnancement().plan(debut, fin):
+                bt = self.get_bon_travail(ligne["bt_id"])
+                jour = ligne["jour"].isoformat()
+                if bt is None or bt.get("statut") in Ordonnanceur.STATUTS_EN_COURS:
+                    continue
+                if bt.get("technicien") == ligne["technicien"] and bt.get("date_planifiee") == jour:
+                    continue
+                self.update_bon_travail(bt["id"], {**bt, "technicien": ligne["technicien"], "date_planifiee": jour},
+                                        expected_rev=bt["_rev"])
+                modifies += 1
+            return modifies
+    
+    def create_default_articles(self):
+        """Crée les articles de démonstration (soldes issus des mouvements d'inventaire initial)"""
+        articles = [
+            ("R001-2024", "Roulement 6205-2RS", "Roulement", 15, 5, "pièce", 45.50, "SKF France", "Magasin - Allée 1"),
+            ("R002-2024", "Courroie synchronisée B85", "Transmission", 8, 10, "pièce", 32.80, "Gates Europe", "Magasin - Allée 1"),
+            ("R003-2024", "Filtre à air industriel", "Filtration", 22, 10, "pièce", 120.00, "Donaldson", "Magasin - Allée 2"),
+            ("R004-2024", "Joint d'étanchéité Ø150mm", "Étanchéité", 45, 20, "pièce", 8.75, "Freudenberg", "Magasin - Allée 2"),
+            ("R005-2024", "Capteur température PT100", "Capteur", 12, 15, "pièce", 89.99, "Endress+Hauser", "Magasin - Armoire"),
+            ("R006-2024", "Graisse industrielle EP2", "Lubrifiant", 5, 8, "kg", 14.20, "Total Energies", "Magasin - Zone huiles")
+        ]
+        return [
+            {
+                "id": i,
+                "reference": reference,
+                "designation": designation,
+                "categorie": categorie,
+                "unite": unite,
+                "seuil_minimum": seuil,
+                "prix_unitaire": prix,
+                "fournisseur": fournisseur,
+                "emplacement": emplacement,
+                "quantite": quantite,
+                "valeur": round(quantite * prix, 2),
+                "dernier_mouvement": i,
+                "derniere_entree": "2024-10-01",
+                "en_commande": None
+            }
+            for i, (reference, designation, categorie, quantite, seuil, unite, prix, fournisseur, emplacement)
+            in enumerate(articles, start=1)
+        ]
+    
+    def create_default_mouvements_stock(self):
+        """Crée les mouvements d'inventaire initial correspondant aux soldes des articles de démonstration"""
+        return [
+            {
+                "id": article["id"],
+                "article_id": article["id"],
+                "type": AJUSTEMENT,
+                "quantite": article["quantite"],
+                "prix_unitaire": article["prix_unitaire"],
+                "valeur": article["valeur"],
+                "solde": article["quantite"],
+                "date": "2024-10-01T08:00:00",
+                "bt": None,
+                "document": "INV-2024-10",
+                "motif": "Inventaire initial",
+                "utilisateur": "admin"
+            }
+            for article in self.create_default_articles()
+        ]
+    
+    def get_all_articles(self):
+        """Retourne tous les articles"""
+        return self.articles
+    
+    def get_articles_frame(self):
+        """Retourne les articles (DataFrame en cache, corrigé à chaque mouvement, à ne pas modifier)"""
+        return self._frame("articles")
+    
+    def get_article(self, article_id):
+        """Retourne un article par id (ou None)"""
+        return self.get_record("articles", article_id)
+    
+    def get_article_by_reference(self, reference):
+        """Retourne un article par référence (ou None)"""
+        return self.get_record_by_key("articles", reference)
+    
+    def add_article(self, article_data):
+        """Crée un article avec un solde nul (le stock initial est saisi par un mouvement)"""
+        article_data.update(id=self._next_id("articles"), quantite=0, valeur=0.0, dernier_mouvement=None, en_commande=None)
+        self._insert("articles", article_data)
+        return article_data["id"]
+    
+    def update_article(self, article_id, article_data, expected_rev=None):
+        """Met à jour la fiche d'un article ; le solde n'est modifié que par les mouvements"""
+        with self._lock:
+            existing = self.get_article(article_id)
+            for champ in ("quantite", "valeur", "dernier_mouvement"):
+                article_data[champ] = existing.get(champ)
+            self._update("articles", article_id, article_data, expected_rev)
+    
+    def enregistrer_mouvement(self, article_id, type_mouvement, quantite, prix_unitaire=None, bt=None,
+                              document="", motif="", utilisateur="", date=None, commande_recue=False):
+        """Enregistre un mouvement (quantité positive, signée pour un ajustement) et le solde de l'article en une écriture"""
+        with self._lock:
+            article = dict(self.get_article(article_id))
+            delta = -quantite if type_mouvement == SORTIE else quantite
+            prix = prix_unitaire if type_mouvement == ENTREE else None
+            stock, valeur = solde_apres_mouvement(article, delta, prix)
+            if prix is None:
+                prix = article["valeur"] / article["quantite"] if article["quantite"] else article.get("prix_unitaire", 0.0)
+            date = date or datetime.datetime.now().isoformat(timespec="seconds")
+            mouvement = {
+                "id": self._next_id("mouvements_stock"),
+                "article_id": article_id,
+                "type": type_mouvement,
+                "quantite": delta,
+                "prix_unitaire": round(prix, 4),
+                "valeur": round(valeur - article["valeur"], 2),
+                "solde": stock,
+                "date": date,
+                "bt": bt or None,
+                "document": document,
+                "motif": motif,
+                "utilisateur": utilisateur
+            }
+            article.update(quantite=stock, valeur=valeur, dernier_mouvement=mouvement["id"])
+            if type_mouvement == ENTREE:
+                article.update(prix_unitaire=prix, derniere_entree=date[:10])
+            if commande_recue:
+                article["en_commande"] = None
+            self._write_batch([("insert", "mouvements_stock", mouvement), ("update", "articles", article)])
+            return mouvement["id"]
+    
+    def commander_article(self, article_id, quantite, fournisseur, delai_jours, urgence="Normale"):
+        """Enregistre la commande fournisseur en cours d'un article (une commande ouverte par article)"""
+        with self._lock:
+            article = dict(self.get_article(article_id))
+            aujourd_hui = datetime.date.today()
+            article["en_commande"] = {
+                "quantite": quantite,
+                "fournisseur": fournisseur,
+                "date": aujourd_hui.isoformat(),
+                "livraison_prevue": (aujourd_hui + datetime.timedelta(days=delai_jours)).isoformat(),
+                "urgence": urgence
+            }
+            self._update("articles", article_id, article, expected_rev=article["_rev"])
+    
+    def receptionner_commande(self, article_id, quantite, prix_unitaire, document="", utilisateur=""):
+        """Entre en stock la livraison de la commande en cours et clôture celle-ci dans la même écriture"""
+        commande = self.get_article(article_id).get("en_commande") or {}
+        return self.enregistrer_mouvement(
+            article_id, ENTREE, quantite, prix_unitaire, document=document,
+            motif=f"Réception commande {commande.get('fournisseur', '')}".strip(), utilisateur=utilisateur,
+            commande_recue=True
+        )
+    
+    def get_mouvements_ids(self, article_id=None, type_mouvement=None, bt=None):
+        """Ids des mouvements filtrés (article, type, BT), du plus récent au plus ancien"""
+        with self._lock:
+            ids = self.query_ids("mouvements_stock", {
+                "article_id": [article_id] if article_id is not None else None,
+                "type": [type_mouvement] if type_mouvement else None,
+                "bt": [bt] if bt else None
+            })
+            return self.ordered_ids("mouvements_stock", ids, by="date", reverse=True)
+    
+    def get_mouvement(self, mouvement_id):
+        """Retourne un mouvement de stock par id (ou None)"""
+        return self.get_record("mouvements_stock", mouvement_id)
+    
+    def get_cout_pieces_bt(self, numero_bt):
+        """Valeur des pièces sorties du stock pour un BT (lue sur l'index des mouvements du BT)"""
+        with self._lock:
+            ids = self.query_ids("mouvements_stock", {"bt": [numero_bt], "type": [SORTIE]}) or set()
+            return round(-sum((self.get_mouvement(mouvement_id)["valeur"] for mouvement_id in ids), 0.0), 2)
+    
+    def get_synthese_stock(self):
+        """Nombre d'articles, valeur totale, articles sous le seuil, ruptures et commandes en cours (lus sur l'index)"""
+        with self._lock:
+            return self.alertes_stock.synthese()
+    
+    def get_articles_critiques(self, limit=None):
+        """Articles sous leur seuil minimum, du plus faible ratio stock/seuil au plus élevé"""
+        with self._lock:
+            return [self.get_article(article_id) for article_id in self.alertes_stock.plus_critiques(limit)]
+    
+    def get_propositions_reappro(self):
+        """Propositions de commande de tous les articles (recalculées seulement si les stocks ou les fournisseurs ont changé)"""
+        with self._lock:
+            versions = (self._versions["articles"], self._versions["mouvements_stock"],
+                        self._versions["fournisseurs"], datetime.date.today())
+            if self._propositions_reappro is None or self._propositions_reappro[0] != versions:
+                propositions = calculer_reapprovisionnement(
+                    self._frame("articles"), self._frame("mouvements_stock"), self._frame("fournisseurs"), versions[-1]
+                )
+                self._propositions_reappro = (versions, propositions)
+            return self._propositions_reappro[1].copy(deep=False)
+    
+    def commander_propositions(self, fournisseur, urgence="Normale"):
+        """Passe en une écriture les commandes proposées pour un fournisseur ; retourne le nombre de lignes commandées"""
+        with self._lock:
+            propositions = self.get_propositions_reappro()
+            lignes = propositions[(propositions["fournisseur"] == fournisseur) & (propositions["quantite_proposee"] > 0)]
+            aujourd_hui = datetime.date.today()
+            operations = []
+            for article_id, ligne in lignes.iterrows():
+                article = dict(self.get_article(article_id))
+                article["en_commande"] = {
+                    "quantite": float(ligne["quantite_proposee"]),
+                    "fournisseur": fournisseur,
+                    "date": aujourd_hui.isoformat(),
+                    "livraison_prevue": (aujourd_hui + datetime.timedelta(days=int(ligne["delai"]))).isoformat(),
+                    "urgence": urgence
+                }
+                operations.append(("update", "articles", article))
+            if operations:
+                self._write_batch(operations)
+            return len(operations)
  
 # Initialiser le gestionnaire de données
-data_manager = DataManager()
+@st.cache_resource
+def get_data_manager():
+    """Retourne l'instance de DataManager partagée par toutes les sessions du processus"""
+    return DataManager()
+
+data_manager = get_data_manager()
+data_manager.refresh()
+
+# ========== COMPOSANTS D'AFFICHAGE ==========
+TAILLES_PAGE = [10, 25, 50, 100]
+
+def paginer(nb_elements, cle, tailles=TAILLES_PAGE):
+    """Affiche le sélecteur de page et retourne la tranche des éléments de la page courante"""
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        taille = st.selectbox("Éléments par page", tailles, key=f"{cle}_taille")
+    
+    nb_pages = max(1, -(-nb_elements // taille))
+    cle_page = f"{cle}_page"
+    # Ramener la page courante dans les bornes si les filtres ont réduit le résultat
+    if st.session_state.get(cle_page, 1) > nb_pages:
+        st.session_state[cle_page] = nb_pages
+    
+    with col2:
+        page = st.number_input(f"Page (sur {nb_pages})", min_value=1, max_value=nb_pages, step=1, key=cle_page)
+    
+    debut = (page - 1) * taille
+    fin = min(debut + taille, nb_elements)
+    with col3:
+        st.caption(f"Éléments {debut + 1} à {fin} sur {nb_elements}")
+    
+    return slice(debut, fin)
+
+def revision_formulaire(cle, record):
+    """Révision de l'enregistrement au premier affichage du formulaire cle, conservée jusqu'à sa fermeture"""
+    # Les champs d'un formulaire gardent leurs valeurs d'ouverture : c'est cette révision que l'enregistrement doit avoir encore
+    return st.session_state.setdefault(f"revision_{cle}", record.get("_rev", 0))
+
+def fermer_formulaire(cle):
+    """Oublie la révision mémorisée d'un formulaire (enregistré, annulé ou en conflit)"""
+    st.session_state.pop(f"revision_{cle}", None)
+
+# Présentation des résultats de recherche par collection : icône, libellé, titre
+RESULTATS_RECHERCHE = {
+    "outillages": ("🛠️", "Outillage", lambda r: f"{r.get('reference', '')} — {r.get('nom', '')}"),
+    "fournisseurs": ("🏭", "Fournisseur", lambda r: r.get("nom", "")),
+    "soustraitants": ("🤝", "Sous-traitant", lambda r: r.get("nom", "")),
+    "personnels": ("👤", "Personnel", lambda r: f"{r.get('nom', '')} ({r.get('matricule', 'N/A')})"),
+    "articles": ("📦", "Article", lambda r: f"{r.get('reference', '')} — {r.get('designation', '')}"),
+    "equipements": ("🏭", "Équipement", lambda r: f"{r.get('code', '')} — {r.get('nom', '')}")
+}
+
+def show_resultats_recherche(texte, limit=10):
+    """Affiche les meilleurs résultats de la recherche globale"""
+    resultats = data_manager.search(texte, limit=limit)
+    if not resultats:
+        st.caption("Aucun résultat")
+        return
+    for collection, record, _ in resultats:
+        icone, libelle, titre = RESULTATS_RECHERCHE[collection]
+        st.markdown(f"{icone} **{titre(record)}**  \n*{libelle}*")
 
 # ========== PAGE D'AUTHENTIFICATION ==========
 def show_login_page():
@@ -551,7 +4719,8 @@ def show_outillages_management():
     st.title("🛠️ Gestion des Outillages")
     
     # Onglets
-    tab1, tab2, tab3 = st.tabs(["📋 Inventaire", "➕ Nouvel outillage", "🔄 Emprunts"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📋 Inventaire", "➕ Nouvel outillage", "🔄 Emprunts", "📅 Réservations",
+                                            "✅ Vérifications"])
     
     with tab1:
         show_outillages_inventory()
@@ -561,6 +4730,12 @@ def show_outillages_management():
     
     with tab3:
         show_emprunts_management()
+    
+    with tab4:
+        show_reservations_outillage()
+    
+    with tab5:
+        show_verifications_outillage()
 
 def show_outillages_inventory():
     """Affiche l'inventaire des outillages"""
@@ -572,6 +4747,8 @@ def show_outillages_inventory():
         st.info("Aucun outillage enregistré")
         return
     
+    search_term = st.text_input("🔎 Rechercher (référence, nom, marque, modèle, n° série)", key="inventaire_recherche")
+    
     # Filtres
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -595,59 +4772,102 @@ def show_outillages_inventory():
     if disponibilite_filter:
         filtered = filtered[filtered["disponibilite"].isin(disponibilite_filter)]
     
+    if search_term:
+        # Résultats classés par pertinence
+        ranked_ids = [record["id"] for _, record, _ in data_manager.search(search_term, ["outillages"], limit=None)]
+        filtered = filtered.loc[[record_id for record_id in ranked_ids if record_id in filtered.index]]
+    
+    if filtered.empty:
+        st.warning("Aucun outillage ne correspond aux filtres")
+        return
+    
     # Affichage
-    if not filtered.empty:
-        for _, outillage in filtered.iterrows():
-            with st.container():
-                col_a1, col_a2 = st.columns([4, 1])
-                with col_a1:
-                    st.markdown(f"### {outillage['nom']}")
-                    st.markdown(f"**Référence:** {outillage['reference']} | **Type:** {outillage['type']}")
-                with col_a2:
-                    st.markdown(f"**{outillage['disponibilite']}**")
-                
-                col_b1, col_b2, col_b3 = st.columns(3)
-                with col_b1:
-                    st.metric("État", outillage["etat"])
-                with col_b2:
-                    st.metric("Localisation", outillage["localisation"])
-                with col_b3:
-                    st.metric("Valeur", f"{outillage['valeur_actuelle']:.0f} €")
-                
-                with st.expander("📝 Détails complets"):
-                    col_c1, col_c2 = st.columns(2)
-                    with col_c1:
-                        st.write(f"**Marque/Modèle:** {outillage['marque']} {outillage['modele']}")
-                        st.write(f"**N° Série:** {outillage['numero_serie']}")
-                        st.write(f"**Date acquisition:** {outillage['date_acquisition']}")
-                        st.write(f"**Utilisation:** {outillage['utilisation']}")
-                    
-                    with col_c2:
-                        st.write(f"**Dernier utilisateur:** {outillage['dernier_utilisateur']}")
-                        st.write(f"**Dernière vérif:** {outillage['date_derniere_verification']}")
-                        st.write(f"**Prochaine vérif:** {outillage['date_prochaine_verification']}")
-                        st.write(f"**Consommables:** {outillage['consommables_associes']}")
-                
-                col_btn1, col_btn2, col_btn3 = st.columns(3)
-                with col_btn1:
-                    if st.button("📝 Emprunter", key=f"borrow_{outillage['id']}"):
-                        st.session_state.outillage_to_borrow = outillage['id']
-                        st.success(f"Formulaire d'emprunt pour {outillage['nom']}")
-                
-                with col_btn2:
-                    if st.button("🔧 Réparer", key=f"repair_{outillage['id']}"):
-                        st.info(f"Bon de réparation pour {outillage['nom']}")
-                
-                with col_btn3:
-                    if st.button("🗑️ Supprimer", key=f"delete_{outillage['id']}"):
-                        if st.button(f"Confirmer suppression", key=f"confirm_del_{outillage['id']}"):
-                            data_manager.delete_outillage(outillage['id'])
-                            st.success(f"Outillage {outillage['nom']} supprimé")
-                            st.rerun()
-                
-                st.markdown("---")
+    mode = st.radio("Affichage", ["🗂️ Cartes", "📊 Tableau"], horizontal=True, key="inventaire_mode")
+    
+    if mode == "📊 Tableau":
+        colonnes = ["reference", "nom", "type", "etat", "disponibilite", "localisation",
+                    "valeur_actuelle", "date_prochaine_verification"]
+        selection = st.dataframe(
+            filtered.reindex(columns=colonnes),
+            column_config={
+                "reference": st.column_config.TextColumn("Référence"),
+                "nom": st.column_config.TextColumn("Nom"),
+                "type": st.column_config.TextColumn("Type"),
+                "etat": st.column_config.TextColumn("État"),
+                "disponibilite": st.column_config.TextColumn("Disponibilité"),
+                "localisation": st.column_config.TextColumn("Localisation"),
+                "valeur_actuelle": st.column_config.NumberColumn("Valeur", format="%.0f €"),
+                "date_prochaine_verification": st.column_config.TextColumn("Prochaine vérif")
+            },
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="single-row",
+            key="inventaire_table"
+        )
+        
+        # Seule la fiche de la ligne sélectionnée est construite
+        lignes = selection.selection.rows
+        if lignes and lignes[0] < len(filtered):
+            st.markdown("---")
+            show_outillage_card(filtered.iloc[lignes[0]])
+        else:
+            st.caption("Sélectionnez une ligne pour afficher la fiche de l'outillage")
     else:
-        st.warning("Aucun outillage ne correspond aux filtres")
+        # Seules les cartes de la page visible sont construites
+        for _, outillage in filtered.iloc[paginer(len(filtered), "inventaire")].iterrows():
+            show_outillage_card(outillage)
+
+def show_outillage_card(outillage):
+    """Affiche la fiche d'un outillage avec ses actions"""
+    with st.container():
+        col_a1, col_a2 = st.columns([4, 1])
+        with col_a1:
+            st.markdown(f"### {outillage['nom']}")
+            st.markdown(f"**Référence:** {outillage['reference']} | **Type:** {outillage['type']}")
+        with col_a2:
+            st.markdown(f"**{outillage['disponibilite']}**")
+        
+        col_b1, col_b2, col_b3 = st.columns(3)
+        with col_b1:
+            st.metric("État", outillage["etat"])
+        with col_b2:
+            st.metric("Localisation", outillage["localisation"])
+        with col_b3:
+            st.metric("Valeur", f"{outillage['valeur_actuelle']:.0f} €")
+        
+        with st.expander("📝 Détails complets"):
+            col_c1, col_c2 = st.columns(2)
+            with col_c1:
+                st.write(f"**Marque/Modèle:** {outillage['marque']} {outillage['modele']}")
+                st.write(f"**N° Série:** {outillage['numero_serie']}")
+                st.write(f"**Date acquisition:** {outillage['date_acquisition']}")
+                st.write(f"**Utilisation:** {outillage['utilisation']}")
+            
+            with col_c2:
+                st.write(f"**Dernier utilisateur:** {outillage['dernier_utilisateur']}")
+                st.write(f"**Dernière vérif:** {outillage['date_derniere_verification']}")
+                st.write(f"**Prochaine vérif:** {outillage['date_prochaine_verification']}")
+                st.write(f"**Consommables:** {outillage['consommables_associes']}")
+        
+        col_btn1, col_btn2, col_btn3 = st.columns(3)
+        with col_btn1:
+            if st.button("📝 Emprunter", key=f"borrow_{outillage['id']}"):
+                st.session_state.outillage_to_borrow = outillage['id']
+                st.success(f"Formulaire d'emprunt et de réservation pour {outillage['nom']} (onglets Emprunts et Réservations)")
+        
+        with col_btn2:
+            if st.button("🔧 Réparer", key=f"repair_{outillage['id']}"):
+                st.info(f"Bon de réparation pour {outillage['nom']}")
+        
+        with col_btn3:
+            if st.button("🗑️ Supprimer", key=f"delete_{outillage['id']}"):
+                if st.button(f"Confirmer suppression", key=f"confirm_del_{outillage['id']}"):
+                    data_manager.delete_outillage(outillage['id'])
+                    st.success(f"Outillage {outillage['nom']} supprimé")
+                    st.rerun()
+        
+        st.markdown("---")
 
 def show_new_outillage_form():
     """Affiche le formulaire pour ajouter un nouvel outillage"""
@@ -723,6 +4943,9 @@ def show_new_outillage_form():
                 st.success(f"✅ Outillage {nom} ajouté avec succès ! Référence: {reference}")
                 st.balloons()
 
+# Emprunteurs proposés dans les formulaires d'emprunt et de réservation
+UTILISATEURS_OUTILLAGE = ["Ali ben salah", "Marie Martin", "Paul Bernard", "Sophie Laurent"]
+
 def show_emprunts_management():
     """Affiche la gestion des emprunts"""
     st.subheader("🔄 Gestion des Emprunts")
@@ -738,23 +4961,29 @@ def show_emprunts_management():
             disponibles = outillages[outillages["disponibilite"] == "🟢 Disponible"]
             if not disponibles.empty:
                 # CORRECTION : Utiliser to_numpy().tolist() pour obtenir une liste de listes
-                outillage_options = disponibles[["id", "nom", "reference"]].to_numpy().tolist()
+                # La révision lue ici permet de rejeter l'emprunt si l'outillage a changé entre-temps
+                outillage_options = disponibles[["id", "nom", "reference", "_rev"]].to_numpy().tolist()
                 
                 # Debug optionnel
                 # st.write("Debug options:", outillage_options[:3])  # Affiche les 3 premières options
                 
+                # Outillage choisi depuis sa fiche (bouton "Emprunter" de l'inventaire)
+                choix = [x[0] for x in outillage_options]
                 outillage_choice = st.selectbox(
                     "Outillage*", 
                     options=outillage_options, 
+                    index=choix.index(st.session_state.get("outillage_to_borrow")) if st.session_state.get("outillage_to_borrow") in choix else 0,
                     format_func=lambda x: f"{x[2]} - {x[1]}"  # x[2] = reference, x[1] = nom
                 )
                 outillage_id = outillage_choice[0] if outillage_choice else None
+                outillage_rev = outillage_choice[3] if outillage_choice else None
             else:
                 st.warning("Aucun outillage disponible")
                 outillage_id = None
+                outillage_rev = None
         
         with col2:
-            utilisateur = st.selectbox("Utilisateur*", ["Ali ben salah", "Marie Martin", "Paul Bernard", "Sophie Laurent", "Autre"])
+            utilisateur = st.selectbox("Utilisateur*", UTILISATEURS_OUTILLAGE + ["Autre"])
             if utilisateur == "Autre":
                 utilisateur = st.text_input("Nom utilisateur")
         
@@ -764,98 +4993,261 @@ def show_emprunts_management():
         
         if st.form_submit_button("📝 Enregistrer l'emprunt", type="primary"):
             if outillage_id and utilisateur and motif:
-                # Chercher l'outillage par ID
-                outillage = None
-                for o in data_manager.outillages["outillages"]:
-                    if o["id"] == outillage_id:
-                        outillage = o.copy()
-                        break
+                outillage = data_manager.get_outillage(outillage_id)
                 
-                if outillage:
-                    outillage["disponibilite"] = "🟡 Emprunté"
-                    outillage["dernier_utilisateur"] = utilisateur
-                    outillage["date_dernier_emprunt"] = date_emprunt.isoformat()
-                    outillage["date_retour_prevue"] = date_retour_prevue.isoformat()
-                    
-                    data_manager.update_outillage(outillage_id, outillage)
-                    
-                    st.success(f"✅ Emprunt enregistré ! {outillage['nom']} emprunté par {utilisateur}")
-                    st.balloons()
-                    st.rerun()
-                else:
+                if outillage is None:
                     st.error("Erreur : outillage non trouvé")
+                else:
+                    try:
+                        data_manager.emprunter_outillage(outillage_id, utilisateur, date_emprunt.isoformat(),
+                                                         date_retour_prevue.isoformat(), motif, expected_rev=outillage_rev)
+                    except ConflictError:
+                        st.error(f"❌ {outillage['nom']} vient d'être emprunté ou modifié par un autre utilisateur, veuillez réessayer")
+                    except ValueError as e:
+                        # ReservationConflitError : le gestionnaire partagé lève la classe de sa première exécution du script
+                        st.error(f"❌ {e}")
+                    else:
+                        st.session_state.pop("outillage_to_borrow", None)
+                        st.success(f"✅ Emprunt enregistré ! {outillage['nom']} emprunté par {utilisateur}")
+                        st.balloons()
+                        st.rerun()
             else:
                 st.error("Veuillez remplir tous les champs")
     
-    # Liste des emprunts en cours
+    # Liste des emprunts en cours, lue sur l'index des dates de retour prévues (retards en tête)
     st.markdown("### 📋 Emprunts en cours")
-    emprunts_en_cours = outillages[outillages["disponibilite"] == "🟡 Emprunté"]
-    
-    if not emprunts_en_cours.empty:
-        for _, emprunt in emprunts_en_cours.iterrows():
+    aujourd_hui = datetime.date.today().isoformat()
+    emprunts_en_cours = data_manager.get_emprunts_en_cours()
+    nb_retards = len(data_manager.get_emprunts_en_retard())
+    col_m1, col_m2 = st.columns(2)
+    with col_m1:
+        st.metric("Emprunts en cours", len(emprunts_en_cours))
+    with col_m2:
+        st.metric("En retard", nb_retards)
+    
+    if st.checkbox("Retards uniquement", key="emprunts_retards"):
+        emprunts_en_cours = emprunts_en_cours[:nb_retards]
+    
+    if emprunts_en_cours:
+        for emprunt in emprunts_en_cours[paginer(len(emprunts_en_cours), "emprunts")]:
+            outillage = data_manager.get_outillage(emprunt["outillage_id"])
             with st.container():
                 col_e1, col_e2, col_e3 = st.columns([3, 2, 1])
                 with col_e1:
-                    st.write(f"**{emprunt['nom']}** ({emprunt['reference']})")
-                    st.write(f"Emprunté par: {emprunt['dernier_utilisateur']}")
+                    st.write(f"**{outillage['nom']}** ({outillage['reference']})")
+                    st.write(f"Emprunté par: {emprunt['utilisateur']}")
                 
                 with col_e2:
-                    st.write(f"Depuis: {emprunt['date_dernier_emprunt']}")
-                    if "date_retour_prevue" in emprunt and emprunt["date_retour_prevue"]:
-                        try:
-                            if isinstance(emprunt["date_retour_prevue"], str):
-                                retour_date = datetime.datetime.fromisoformat(emprunt["date_retour_prevue"]).date()
-                            else:
-                                retour_date = emprunt["date_retour_prevue"]
-                                
-                            if retour_date < datetime.date.today():
-                                st.error(f"⚠️ Retard depuis {retour_date}")
-                            else:
-                                st.write(f"Retour prévu: {retour_date}")
-                        except:
-                            st.write("Date retour: Non spécifiée")
+                    st.write(f"Depuis: {emprunt['date']}")
+                    if emprunt["date_retour_prevue"] < aujourd_hui:
+                        st.error(f"⚠️ Retard depuis {emprunt['date_retour_prevue']}")
+                    else:
+                        st.write(f"Retour prévu: {emprunt['date_retour_prevue']}")
                 
                 with col_e3:
-                    if st.button("✅ Retourner", key=f"return_{emprunt['id']}"):
-                        # Récupérer l'outillage depuis les données
-                        for o in data_manager.outillages["outillages"]:
-                            if o["id"] == emprunt["id"]:
-                                o["disponibilite"] = "🟢 Disponible"
-                                o["date_dernier_emprunt"] = ""
-                                o["date_retour_prevue"] = ""
-                                break
-                        
-                        data_manager.save_outillages()
-                        st.success(f"{emprunt['nom']} retourné avec succès")
-                        st.rerun()
+                    if st.button("✅ Retourner", key=f"return_{emprunt['outillage_id']}"):
+                        try:
+                            data_manager.retourner_outillage(emprunt["outillage_id"], st.session_state.user["username"])
+                        except ConflictError:
+                            st.error(f"❌ {outillage['nom']} a été modifié par un autre utilisateur")
+                        else:
+                            st.success(f"{outillage['nom']} retourné avec succès")
+                            st.rerun()
                 
                 st.markdown("---")
     else:
         st.info("Aucun emprunt en cours")
+    
+    show_historique_emprunts(outillages)
+
+def show_historique_emprunts(outillages):
+    """Historique des emprunts par outillage et par utilisateur"""
+    st.markdown("### 🕓 Historique des emprunts")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        outillage_filtre = st.selectbox(
+            "Outillage", [None] + outillages.index.tolist(), key="historique_outillage",
+            format_func=lambda outillage_id: "Tous" if outillage_id is None
+            else f"{outillages.at[outillage_id, 'reference']} - {outillages.at[outillage_id, 'nom']}"
+        )
+    with col2:
+        utilisateur_filtre = st.selectbox("Utilisateur", [None] + data_manager.get_emprunteurs(), key="historique_utilisateur",
+                                          format_func=lambda utilisateur: utilisateur or "Tous")
+    
+    # Ids lus sur les facettes et l'index des dates : seule la page affichée est matérialisée
+    emprunt_ids = data_manager.get_historique_emprunts(outillage_filtre, utilisateur_filtre)
+    if not emprunt_ids:
+        st.info("Aucun emprunt")
+        return
+    page = []
+    for emprunt_id in emprunt_ids[paginer(len(emprunt_ids), "historique_emprunts")]:
+        emprunt = data_manager.get_emprunt(emprunt_id)
+        retour = data_manager.get_retour(emprunt_id)
+        page.append({
+            "Outillage": (outillages.at[emprunt["outillage_id"], "reference"]
+                          if emprunt["outillage_id"] in outillages.index else f"#{emprunt['outillage_id']} (supprimé)"),
+            "Utilisateur": emprunt["utilisateur"],
+            "Emprunt": emprunt["date"],
+            "Retour prévu": emprunt["date_retour_prevue"],
+            "Retour": retour["date"] if retour else "🟡 En cours",
+            "Motif": emprunt.get("motif", "")
+        })
+    st.dataframe(pd.DataFrame(page), use_container_width=True, hide_index=True)
+
+def show_reservations_outillage():
+    """Réservation d'outillages sur une période future, éventuellement rattachée à un BT"""
+    st.subheader("📅 Réservations d'outillages")
+    
+    outillages = data_manager.get_all_outillages()
+    if outillages.empty:
+        st.info("Aucun outillage enregistré")
+        return
+    
+    st.markdown("### Nouvelle réservation")
+    # Hors formulaire : la liste des outillages libres suit le type, le BT et la période choisis
+    bts_ouverts = {bt["numero"]: bt for bt in data_manager.get_all_bons_travail() if bt.get("statut") not in Ordonnanceur.STATUTS_CLOS}
+    col1, col2 = st.columns(2)
+    with col1:
+        numero_bt = st.selectbox("Bon de Travail", [None] + list(bts_ouverts), key="reservation_bt",
+                                 format_func=lambda numero: "—" if numero is None else f"{numero} - {bts_ouverts[numero]['equipement']}")
+        bt = bts_ouverts.get(numero_bt)
+        # La période proposée par défaut est la date planifiée du BT
+        date_bt = datetime.date.fromisoformat(bt["date_planifiee"][:10]) if bt and bt.get("date_planifiee") else None
+        debut = st.date_input("Du*", max(date_bt or datetime.date.today(), datetime.date.today()), key=f"reservation_debut_{date_bt}")
+        fin = st.date_input("Au*", max(debut, date_bt or debut), key=f"reservation_fin_{date_bt}")
+    with col2:
+        types = sorted(outillages["type"].dropna().unique())
+        outillage_pre = st.session_state.get("outillage_to_borrow")
+        type_pre = outillages.at[outillage_pre, "type"] if outillage_pre in outillages.index else None
+        type_outillage = st.selectbox("Type d'outillage*", types, index=types.index(type_pre) if type_pre in types else 0,
+                                      key="reservation_type")
+        libres = data_manager.get_outillages_libres(type_outillage, debut.isoformat(), fin.isoformat()) if fin >= debut else []
+        outillage_id = st.selectbox(
+            f"Outillage libre* ({len(libres)})", libres, key="reservation_outillage",
+            index=libres.index(outillage_pre) if outillage_pre in libres else 0,
+            format_func=lambda outillage_id: f"{outillages.at[outillage_id, 'reference']} - {outillages.at[outillage_id, 'nom']}"
+        )
+        utilisateur = st.selectbox("Réservé pour*", UTILISATEURS_OUTILLAGE, key="reservation_utilisateur")
+    motif = st.text_input("Motif", key="reservation_motif")
+    
+    if fin < debut:
+        st.error("La date de fin précède la date de début")
+    elif not libres:
+        st.warning(f"Aucun outillage de type {type_outillage} libre sur cette période")
+    elif st.button("📅 Réserver", type="primary"):
+        try:
+            data_manager.reserver_outillage(outillage_id, debut.isoformat(), fin.isoformat(), utilisateur,
+                                            bt["numero"] if bt else None, motif)
+        except ValueError as e:
+            # ReservationConflitError : le gestionnaire partagé lève la classe de sa première exécution du script
+            st.error(f"❌ {e}")
+        except ConflictError:
+            st.error("Une réservation vient d'être enregistrée par un autre utilisateur, veuillez réessayer")
+        else:
+            st.session_state.pop("outillage_to_borrow", None)
+            st.success(f"✅ {outillages.at[outillage_id, 'nom']} réservé du {debut} au {fin} pour {utilisateur}")
+            st.rerun()
+    
+    st.markdown("### 📋 Réservations à venir")
+    outillage_filtre = st.selectbox(
+        "Outillage", [None] + outillages.index.tolist(), key="reservations_outillage_filtre",
+        format_func=lambda outillage_id: "Tous" if outillage_id is None
+        else f"{outillages.at[outillage_id, 'reference']} - {outillages.at[outillage_id, 'nom']}"
+    )
+    reservation_ids = data_manager.get_reservations_ids(outillage_filtre, depuis=datetime.date.today().isoformat())
+    if not reservation_ids:
+        st.info("Aucune réservation à venir")
+        return
+    for reservation_id in reservation_ids[paginer(len(reservation_ids), "reservations")]:
+        reservation = data_manager.get_reservation(reservation_id)
+        col_r1, col_r2, col_r3 = st.columns([3, 2, 1])
+        with col_r1:
+            nom = outillages.at[reservation["outillage_id"], "nom"] if reservation["outillage_id"] in outillages.index else "Outillage supprimé"
+            st.write(f"**{nom}** - {reservation['utilisateur']}")
+            if reservation.get("motif"):
+                st.caption(reservation["motif"])
+        with col_r2:
+            st.write(f"Du {reservation['debut']} au {reservation['fin']}")
+            if reservation.get("bt"):
+                st.write(f"BT: {reservation['bt']}")
+        with col_r3:
+            if st.button("❌ Annuler", key=f"annuler_resa_{reservation_id}"):
+                data_manager.annuler_reservation(reservation_id)
+                st.rerun()
+
+def show_verifications_outillage():
+    """Échéancier des vérifications périodiques et génération des BT de vérification"""
+    st.subheader("✅ Vérifications périodiques")
+    
+    # Échéances lues sur l'index trié des dates de prochaine vérification
+    horizon = st.selectbox("Échéances à", [7, 30, 90], index=1, key="verifications_horizon",
+                           format_func=lambda jours: f"{jours} jours")
+    en_retard = data_manager.get_verifications_en_retard()
+    a_venir = data_manager.get_verifications_a_venir(horizon)
+    nb_suivis = len(data_manager.get_verifications_ids("9999"))
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Vérifications dépassées", len(en_retard))
+    with col2:
+        st.metric(f"À échéance sous {horizon} jours", len(a_venir))
+    with col3:
+        st.metric("Conformité", f"{(1 - len(en_retard) / nb_suivis) * 100:.0f}%" if nb_suivis else "—")
+    
+    echeances = en_retard + a_venir
+    if not echeances:
+        st.success("Aucune vérification dépassée ni à venir sur la période")
+        return
+    
+    aujourd_hui = datetime.date.today().isoformat()
+    page = []
+    for outillage_id in echeances[paginer(len(echeances), "verifications")]:
+        outillage = data_manager.get_outillage(outillage_id)
+        bt = data_manager.get_bt_verification_ouvert(outillage_id)
+        page.append({
+            "Référence": outillage["reference"],
+            "Nom": outillage["nom"],
+            "Dernière vérif": outillage.get("date_derniere_verification", ""),
+            "Échéance": outillage["date_prochaine_verification"],
+            "État": "🔴 Dépassée" if outillage["date_prochaine_verification"] < aujourd_hui else "🟡 À venir",
+            "BT": f"{bt['numero']} ({bt['statut']})" if bt else ""
+        })
+    st.dataframe(pd.DataFrame(page), use_container_width=True, hide_index=True)
+    
+    col_t1, col_t2 = st.columns([2, 1])
+    with col_t1:
+        technicien = st.selectbox("Technicien des BT générés", ["À affecter"] + techniciens_disponibles(), key="verifications_technicien")
+    with col_t2:
+        st.write("")
+        if st.button("🛠️ Générer les BT de vérification", type="primary"):
+            try:
+                numeros = data_manager.generer_bts_verification(horizon, technicien)
+            except ConflictError:
+                st.error("Les Bons de Travail ont été modifiés entre-temps, veuillez réessayer")
+            else:
+                if numeros:
+                    st.success(f"{len(numeros)} BT de vérification générés : {', '.join(numeros[:10])}{'…' if len(numeros) > 10 else ''}")
+                else:
+                    st.info("Chaque outillage à vérifier a déjà son BT")
 
 # ========== GESTION DES INTERVENTIONS ==========
-def calculer_priorite(criticite, impact_production):
-    """Calcule la priorité en fonction de la criticité et de l'impact"""
-    if criticite == "Critique" or impact_production == "Arrêt total":
-        return "Urgente"
-    elif criticite == "Haute" or impact_production == "Arrêt partiel":
-        return "Haute"
-    elif criticite == "Moyenne" or impact_production == "Ralentissement":
-        return "Normale"
-    else:
-        return "Basse"
 def show_interventions():
     """Page principale des interventions"""
     st.title("🔧 Gestion des Interventions")
     
     # Onglets principaux
-    tab_corrective, tab_preventive = st.tabs(["🔴 Interventions Correctives", "🟢 Maintenance Préventive"])
+    tab_corrective, tab_preventive, tab_affectation = st.tabs(
+        ["🔴 Interventions Correctives", "🟢 Maintenance Préventive", "👷 Affectation"])
     
     with tab_corrective:
         show_corrective_interventions()
     
     with tab_preventive:
         show_preventive_interventions()
+    
+    with tab_affectation:
+        show_affectation_techniciens()
 
 # ========== PARTIE CORRECTIVE ==========
 def show_corrective_interventions():
@@ -934,7 +5326,6 @@ def show_demande_intervention():
         if submitted:
             if equipement_nom and reference_equipement and localisation and type_panne and demandeur:
                 demande_data = {
-                    "id": time.time_ns(),  # ID unique
                     "equipement_nom": equipement_nom,
                     "reference_equipement": reference_equipement,
                     "localisation": localisation,
@@ -947,57 +5338,110 @@ def show_demande_intervention():
                     "symptomes": symptomes,
                     "impact_production": impact_production,
                     "actions_deja_prises": actions_deja_prises,
-                    "statut": "🟡 En attente",
+                    "statut": DEMANDE_EN_ATTENTE,
                     "date_soumission": datetime.datetime.now().isoformat(),
                     "priorite": calculer_priorite(criticite, impact_production)
                 }
+                data_manager.add_demande_intervention(demande_data)
                 
                 demande_soumise = True
                 st.session_state.last_demande = demande_data
                 
                 st.success(f"✅ Demande d'intervention pour {equipement_nom} soumise avec succès !")
-                st.info(f"Numéro de demande: DI-{demande_data['id']}")
+                st.info(f"Numéro de demande: {demande_data['numero']}")
             else:
                 st.error("Veuillez remplir tous les champs obligatoires (*)")
     
-    # Bouton pour générer le BT - EN DEHORS du formulaire
-    if demande_soumise:
-        st.markdown("---")
-        col_btn1, col_btn2 = st.columns(2)
-        
-        with col_btn1:
-            if st.button("📄 Générer le Bon de Travail", type="primary"):
-                if demande_data:
-                    show_generer_bt(demande_data)
-                elif 'last_demande' in st.session_state:
-                    show_generer_bt(st.session_state.last_demande)
-        
-        with col_btn2:
-            if st.button("📋 Voir toutes les demandes"):
-                st.session_state.show_demandes_list = True
+    # Boutons EN DEHORS du formulaire ; la liste des demandes enregistrées est toujours accessible
+    st.markdown("---")
+    col_btn1, col_btn2 = st.columns(2)
+    
+    with col_btn1:
+        if (demande_soumise or 'last_demande' in st.session_state) and st.button("📄 Générer le Bon de Travail", type="primary"):
+            st.session_state.generating_bt = True
+    
+    with col_btn2:
+        if st.button("📋 Voir toutes les demandes"):
+            st.session_state.show_demandes_list = True
+    
+    # Le formulaire de génération reste affiché jusqu'à l'enregistrement du BT
+    if st.session_state.get("generating_bt", False):
+        show_generer_bt(demande_data or st.session_state.last_demande)
     
     # Afficher la liste des demandes si demandé
     if st.session_state.get('show_demandes_list', False):
         show_liste_demandes()
 
+def show_liste_demandes():
+    """Liste des demandes d'intervention enregistrées, filtrées sur les index (statut, équipement)"""
+    st.markdown("### 📋 Demandes d'intervention")
+    
+    statut_counts = data_manager.facet_counts("demandes_intervention", "statut")
+    reference_counts = data_manager.facet_counts("demandes_intervention", "reference_equipement")
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        statut_filter = st.multiselect("Statut de la demande", STATUTS_DEMANDE, default=STATUTS_DEMANDE[:3],
+                                       format_func=lambda v: f"{v} ({statut_counts.get(v, 0)})")
+    with col2:
+        reference_filter = st.multiselect("Équipement", sorted(r for r, n in reference_counts.items() if n),
+                                          format_func=lambda v: f"{v} ({reference_counts[v]})")
+    with col3:
+        if st.button("✖️ Masquer la liste"):
+            st.session_state.show_demandes_list = False
+            st.rerun()
+    
+    demande_ids = data_manager.get_demandes_ids(statut_filter, reference_filter)
+    if not demande_ids:
+        st.info("Aucune demande ne correspond aux filtres")
+        return
+    
+    # Seules les demandes de la page visible sont lues
+    demandes = [data_manager.get_demande_intervention(demande_id)
+                for demande_id in demande_ids[paginer(len(demande_ids), "demandes")]]
+    st.dataframe(pd.DataFrame({
+        "Numéro": [d["numero"] for d in demandes],
+        "Équipement": [d["equipement_nom"] for d in demandes],
+        "Référence": [d["reference_equipement"] for d in demandes],
+        "Détection": [f"{d['date_detection']} {d.get('heure_detection', '')[:5]}" for d in demandes],
+        "Criticité": [d["criticite"] for d in demandes],
+        "Priorité": [d["priorite"] for d in demandes],
+        "Statut": [d["statut"] for d in demandes],
+        "BT": [d.get("bt", "") for d in demandes]
+    }), use_container_width=True, hide_index=True)
+
 def show_bons_travail_correctifs():
     """Affiche la gestion des Bons de Travail correctifs"""
     st.markdown("### 📋 Bons de Travail Correctifs")
     
+    # Compteurs par valeur, lus sur les index (sans parcourir les BT)
+    statut_counts = data_manager.facet_counts("bons_travail", "statut")
+    priorite_counts = data_manager.facet_counts("bons_travail", "priorite")
+    technicien_counts = data_manager.facet_counts("bons_travail", "technicien")
+    techniciens = sorted(set(["Ali ben salah", "Fatma Jebali", "Mohamed Trabelsi", "Karim Chaouch"]) | set(technicien_counts))
+    
     # Filtres
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         statut_filter = st.multiselect("Statut", 
             ["🟡 En attente", "🔵 En cours", "🟢 Terminé", "🔴 Annulé"], 
-            default=["🟡 En attente", "🔵 En cours"])
+            default=["🟡 En attente", "🔵 En cours"],
+            format_func=lambda v: f"{v} ({statut_counts.get(v, 0)})")
     
     with col2:
         priorite_filter = st.multiselect("Priorité", 
-            ["Basse", "Normale", "Haute", "Urgente"])
+            ["Basse", "Normale", "Haute", "Urgente"],
+            format_func=lambda v: f"{v} ({priorite_counts.get(v, 0)})")
     
     with col3:
-        technicien_filter = st.multiselect("Technicien", 
-            ["Ali ben salah", "Fatma Jebali", "Mohamed Trabelsi", "Karim Chaouch"])
+        technicien_filter = st.multiselect("Technicien", techniciens,
+            format_func=lambda v: f"{v} ({technicien_counts.get(v, 0)})")
+    
+    with col4:
+        periode = st.selectbox("Créés depuis", ["Toujours", "7 jours", "30 jours", "12 mois"])
+    
+    # Message de création conservé à travers le rerun du formulaire
+    if "bt_cree" in st.session_state:
+        st.success(st.session_state.pop("bt_cree"))
     
     # Bouton pour créer un nouveau BT
     if st.button("➕ Créer un nouveau BT", type="primary"):
@@ -1006,58 +5450,38 @@ def show_bons_travail_correctifs():
     if st.session_state.get("creating_bt", False):
         show_creer_bt_correctif()
     
-    # Liste des BTs (données simulées)
     st.markdown("#### Liste des Bons de Travail")
     
-    # Données de démo
-    bts_demo = [
-        {
-            "id": "BT-C-001",
-            "equipement": "Pompe centrifuge P-101",
-            "reference": "EQUIP-023",
-            "type": "Mécanique",
-            "technicien": "Ali ben salah",
-            "date_creation": "2025-12-13",
-            "date_debut": "2025-12-13",
-            "date_fin": "",
-            "statut": "🔵 En cours",
-            "priorite": "Haute",
-            "temps_estime": "4h",
-            "temps_reel": "3h30"
-        },
-        {
-            "id": "BT-C-002",
-            "equipement": "Convoyeur bande C-205",
-            "reference": "EQUIP-045",
-            "type": "Électrique",
-            "technicien": "Fatma Jebali",
-            "date_creation": "2025-11-25",
-            "date_debut": "2025-11-25",
-            "date_fin": "2025-11-26",
-            "statut": "🟢 Terminé",
-            "priorite": "Normale",
-            "temps_estime": "2h",
-            "temps_reel": "1h45"
-        }
-    ]
+    # Requête sur les index : intersection des facettes puis de la plage de dates de création
+    matching_ids = data_manager.query_ids("bons_travail", {
+        "categorie": ["Corrective"],
+        "statut": statut_filter,
+        "priorite": priorite_filter,
+        "technicien": technicien_filter
+    })
+    if periode != "Toujours":
+        jours = {"7 jours": 7, "30 jours": 30, "12 mois": 365}[periode]
+        depuis = (datetime.date.today() - datetime.timedelta(days=jours)).isoformat()
+        matching_ids &= data_manager.range_ids("bons_travail", "date_creation", debut=depuis)
     
-    for bt in bts_demo:
-        if statut_filter and bt["statut"] not in statut_filter:
-            continue
-        if priorite_filter and bt["priorite"] not in priorite_filter:
-            continue
-        if technicien_filter and bt["technicien"] not in technicien_filter:
-            continue
-        
+    if not matching_ids:
+        st.info("Aucun Bon de Travail ne correspond aux filtres")
+        return
+    
+    # Plus récents d'abord ; seuls les BT de la page visible sont lus
+    ordered_ids = data_manager.ordered_ids("bons_travail", matching_ids, by="date_creation", reverse=True)
+    page_ids = ordered_ids[paginer(len(ordered_ids), "bons_travail")]
+    
+    for bt in (data_manager.get_bon_travail(bt_id) for bt_id in page_ids):
         with st.container():
             col_a1, col_a2, col_a3 = st.columns([3, 2, 1])
             with col_a1:
-                st.markdown(f"**{bt['id']} - {bt['equipement']}**")
-                st.caption(f"Type: {bt['type']} | Technicien: {bt['technicien']}")
+                st.markdown(f"**{bt['numero']} - {bt['equipement']}**")
+                st.caption(f"Type: {bt['type']} | Technicien: {bt['technicien']} | Priorité: {bt['priorite']}")
             
             with col_a2:
                 st.write(f"Créé le: {bt['date_creation']}")
-                if bt['date_debut']:
+                if bt.get('date_debut'):
                     st.write(f"Début: {bt['date_debut']}")
             
             with col_a3:
@@ -1066,37 +5490,87 @@ def show_bons_travail_correctifs():
                            unsafe_allow_html=True)
             
             # Actions
-            col_b1, col_b2, col_b3, col_b4 = st.columns(4)
+            col_b1, col_b2, col_b3, col_b4, col_b5 = st.columns(5)
             with col_b1:
-                if st.button(f"👁️ Voir", key=f"view_{bt['id']}"):
+                if st.button(f"👁️ Voir", key=f"view_{bt['numero']}"):
                     st.session_state.selected_bt = bt
             with col_b2:
                 if bt["statut"] != "🟢 Terminé":
-                    if st.button(f"✏️ Modifier", key=f"edit_{bt['id']}"):
-                        st.info(f"Modification du BT {bt['id']}")
+                    if st.button(f"✏️ Modifier", key=f"edit_{bt['numero']}"):
+                        st.info(f"Modification du BT {bt['numero']}")
             with col_b3:
-                if st.button(f"📄 PDF", key=f"pdf_{bt['id']}"):
-                    st.success(f"Génération PDF pour {bt['id']}")
+                if st.button(f"📄 PDF", key=f"pdf_{bt['numero']}"):
+                    st.success(f"Génération PDF pour {bt['numero']}")
             with col_b4:
-                if st.button(f"📊 Rapport", key=f"report_{bt['id']}"):
+                if st.button(f"📊 Rapport", key=f"report_{bt['numero']}"):
                     show_rapport_bt(bt)
+            with col_b5:
+                if bt["statut"] == "🟡 En attente":
+                    if st.button(f"▶️ Démarrer", key=f"start_{bt['numero']}"):
+                        try:
+                            data_manager.update_bon_travail(bt['id'], {
+                                **bt, "statut": "🔵 En cours", "date_debut": datetime.date.today().isoformat()
+                            }, expected_rev=bt['_rev'])
+                            st.rerun()
+                        except ConflictError:
+                            st.error("Ce BT a été modifié entre-temps, veuillez réessayer")
+                elif bt["statut"] == "🔵 En cours":
+                    if st.button(f"✅ Clôturer", key=f"close_{bt['numero']}"):
+                        st.session_state.bt_a_cloturer = bt['id']
+            
+            # Le formulaire de clôture reste affiché entre les réexécutions
+            if st.session_state.get("bt_a_cloturer") == bt['id']:
+                show_cloturer_bt(bt)
             
             st.markdown("---")
 
+def show_cloturer_bt(bt_data):
+    """Formulaire de clôture d'un BT correctif"""
+    cle = f"cloturer_bt_{bt_data['id']}"
+    revision = revision_formulaire(cle, bt_data)
+    with st.form(f"cloturer_bt_form_{bt_data['id']}"):
+        st.markdown(f"#### ✅ Clôture du BT {bt_data['numero']}")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            temps_reel = st.number_input("Temps réel passé (heures)", 0.25, 72.0, 2.0, 0.25)
+        with col2:
+            duree_arret = st.number_input("Durée d'arrêt équipement (heures)", 0.0, 720.0, 2.0, 0.25)
+        with col3:
+            cout_pieces = st.number_input("Coût des pièces (€)", min_value=0.0,
+                                          value=data_manager.get_cout_pieces_bt(bt_data["numero"]), step=10.0,
+                                          help="Pré-rempli avec la valeur des sorties de stock imputées au BT")
+        observations = st.text_area("Travaux réalisés et observations")
+        
+        if st.form_submit_button("✅ Clôturer le BT", type="primary"):
+            try:
+                cout = temps_reel * cout_horaire_technicien(bt_data.get("technicien", "")) + cout_pieces
+                data_manager.cloturer_bon_travail(bt_data['id'], temps_reel, duree_arret, cout, observations,
+                                                  expected_rev=revision)
+                fermer_formulaire(cle)
+                st.session_state.bt_a_cloturer = None
+                st.success(f"BT {bt_data['numero']} clôturé")
+                st.rerun()
+            except ConflictError:
+                fermer_formulaire(cle)
+                st.error("Ce BT a été modifié par un autre utilisateur depuis l'ouverture du formulaire : vérifiez-le puis validez à nouveau")
+
 def show_suivi_correctif():
     """Affiche le suivi des interventions correctives"""
     st.markdown("### 📊 Suivi des Interventions Correctives")
     
-    # Métriques
+    # Métriques lues sur l'index des statuts de demande
+    statut_counts = data_manager.facet_counts("demandes_intervention", "statut")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("En attente", "5")
+        st.metric("En attente", len(data_manager.file_demandes))
     with col2:
-        st.metric("En cours", "3")
+        st.metric("Prises en charge", statut_counts.get(DEMANDE_PRISE_EN_CHARGE, 0))
     with col3:
-        st.metric("Terminées (mois)", "24")
+        st.metric("BT émis", statut_counts.get(DEMANDE_BT_EMIS, 0))
     with col4:
-        st.metric("Temps moyen", "2.3h")
+        st.metric("Clôturées", statut_counts.get(DEMANDE_CLOTUREE, 0))
+    
+    show_file_demandes()
     
     # Graphiques
     col_a, col_b = st.columns(2)
@@ -1117,6 +5591,44 @@ def show_suivi_correctif():
         })
         st.line_chart(evolution_data.set_index('Mois'))
 
+def show_file_demandes():
+    """File d'attente des demandes : les plus urgentes (priorité, criticité, impact, ancienneté) et leur prise en charge"""
+    st.markdown("#### 🚦 File d'attente")
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        n = st.number_input("Demandes affichées", min_value=1, max_value=100, value=10, step=5, key="file_demandes_n")
+    with col2:
+        st.caption(f"Score = priorité + criticité + impact + {VIEILLISSEMENT_PAR_HEURE:g} point par heure d'attente")
+        if st.button("🚀 Prendre en charge la plus urgente", type="primary", disabled=not len(data_manager.file_demandes)):
+            prises = data_manager.prendre_demandes(1, st.session_state.user.get("full_name", ""))
+            if prises:
+                # Le formulaire de BT s'ouvre sur cette demande dans l'onglet Demande d'Intervention (rendu avant celui-ci)
+                st.session_state.last_demande = prises[0]
+                st.session_state.generating_bt = True
+                st.session_state.demande_prise = prises[0]["numero"]
+                st.rerun()
+        if "demande_prise" in st.session_state:
+            st.success(f"{st.session_state.pop('demande_prise')} prise en charge : générez son BT dans l'onglet Demande d'Intervention")
+    
+    demandes = data_manager.get_demandes_prioritaires(int(n))
+    if not demandes:
+        st.success("Aucune demande en attente")
+        return
+    
+    maintenant = datetime.datetime.now()
+    scores = [score_demande(d, maintenant) for d in demandes]
+    st.dataframe(pd.DataFrame({
+        "Rang": range(1, len(demandes) + 1),
+        "Numéro": [d["numero"] for d in demandes],
+        "Équipement": [d["equipement_nom"] for d in demandes],
+        "Priorité": [d["priorite"] for d in demandes],
+        "Criticité": [d["criticite"] for d in demandes],
+        "Impact": [d.get("impact_production", "") for d in demandes],
+        "Attente (h)": [round((score - points_demande(d)) / VIEILLISSEMENT_PAR_HEURE, 1) for d, score in zip(demandes, scores)],
+        "Score": [round(score, 1) for score in scores]
+    }), use_container_width=True, hide_index=True)
+
 # ========== PARTIE PRÉVENTIVE ==========
 def show_preventive_interventions():
     """Affiche la gestion de la maintenance préventive"""
@@ -1145,51 +5657,31 @@ def show_planning_preventif():
             ["Semaine en cours", "Mois en cours", "Trimestre", "Année"])
     
     with col2:
-        type_maintenance = st.multiselect("Type maintenance",
-            ["Hebdomadaire", "Mensuelle", "Trimestrielle", "Semestrielle", "Annuelle"])
+        type_maintenance = st.multiselect("Type maintenance", list(PERIODICITES) + ["Personnalisée"])
     
     with col3:
         etat = st.multiselect("État",
             ["🟢 Planifié", "🟡 En cours", "🔵 Réalisé", "🔴 Reporté"])
     
-    # Planning (données de démo)
+    # Occurrences générées à partir des règles des plans, uniquement pour la période demandée
+    debut, fin = fenetre_periode(periode)
+    occurrences, total = data_manager.get_planning_preventif(debut, fin, type_maintenance)
+    if etat:
+        occurrences = (o for o in occurrences if o["etat"] in etat)
+    
     st.markdown("#### Calendrier des interventions")
+    st.caption(f"Du {debut.strftime('%d/%m/%Y')} au {fin.strftime('%d/%m/%Y')} : {total} intervention(s) prévue(s)")
     
-    planning_data = [
-        {
-            "equipement": "Pompe centrifuge P-101",
-            "type": "Mensuelle",
-            "date_prevue": "2025-12-02",
-            "technicien": "Ali ben salah",
-            "duree_estimee": "2h",
-            "etat": "🟢 Planifié",
-            "derniere_realisation": "2025-11-02"
-        },
-        {
-            "equipement": "Convoyeur bande C-205",
-            "type": "Hebdomadaire",
-            "date_prevue": "2025-12-15",
-            "technicien": "Fatma Jebali",
-            "duree_estimee": "1h",
-            "etat": "🟢 Planifié",
-            "derniere_realisation": "2025-12-08"
-        },
-        {
-            "equipement": "Compresseur d'air COMP-01",
-            "type": "Trimestrielle",
-            "date_prevue": "2025-12-13",
-            "technicien": "Mohamed Trabelsi",
-            "duree_estimee": "4h",
-            "etat": "🟡 En cours",
-            "derniere_realisation": "2025-09-10"
-        }
-    ]
+    # Seules les occurrences affichées sont produites (une de plus pour savoir s'il en reste)
+    limite = st.session_state.get("planning_limite", 20)
+    affichees = list(itertools.islice(occurrences, limite + 1))
     
-    for plan in planning_data:
-        if type_maintenance and plan["type"] not in type_maintenance:
-            continue
-        if etat and plan["etat"] not in etat:
-            continue
+    if not affichees:
+        st.info("Aucune intervention préventive sur la période")
+    
+    for occurrence in affichees[:limite]:
+        plan = occurrence["plan"]
+        cle = f"{plan['id']}_{occurrence['date_prevue']}"
         
         with st.container():
             col_a1, col_a2, col_a3 = st.columns([3, 2, 1])
@@ -1198,33 +5690,79 @@ def show_planning_preventif():
                 st.caption(f"Type: {plan['type']} | Technicien: {plan['technicien']}")
             
             with col_a2:
-                st.write(f"Date prévue: {plan['date_prevue']}")
+                st.write(f"Date prévue: {occurrence['date']}")
+                if occurrence["date"] != occurrence["date_prevue"]:
+                    st.caption(f"Initialement le {occurrence['date_prevue']}")
                 st.write(f"Durée: {plan['duree_estimee']}")
             
             with col_a3:
-                color = "green" if plan["etat"] == "🟢 Planifié" else "orange" if plan["etat"] == "🟡 En cours" else "blue"
-                st.markdown(f'<span style="color: {color}; font-weight: bold;">{plan["etat"]}</span>', 
+                color = {"🟢 Planifié": "green", "🟡 En cours": "orange", "🔴 Reporté": "red"}.get(occurrence["etat"], "blue")
+                st.markdown(f'<span style="color: {color}; font-weight: bold;">{occurrence["etat"]}</span>', 
                            unsafe_allow_html=True)
+                if occurrence.get("bt"):
+                    st.caption(occurrence["bt"])
             
             # Actions
-            col_b1, col_b2, col_b3 = st.columns(3)
+            col_b1, col_b2, col_b3, col_b4 = st.columns(4)
+            a_faire = occurrence["etat"] in ("🟢 Planifié", "🔴 Reporté")
             with col_b1:
-                if plan["etat"] == "🟢 Planifié":
-                    if st.button(f"📄 Générer BT", key=f"gen_{plan['equipement']}"):
-                        show_generer_bt_preventif(plan)
+                if a_faire:
+                    if st.button(f"📄 Générer BT", key=f"gen_{cle}"):
+                        st.session_state.occurrence_bt = cle
             with col_b2:
-                if st.button(f"🔄 Reporter", key=f"report_{plan['equipement']}"):
-                    st.warning(f"Report de l'intervention sur {plan['equipement']}")
+                if a_faire:
+                    if st.button(f"🔄 Reporter", key=f"report_{cle}"):
+                        st.session_state.occurrence_a_reporter = cle
             with col_b3:
-                if st.button(f"📋 Historique", key=f"hist_{plan['equipement']}"):
+                if a_faire:
+                    if st.button(f"⏭️ Sauter", key=f"skip_{cle}"):
+                        try:
+                            data_manager.marquer_occurrence(plan['id'], occurrence['date_prevue'], "⏭️ Sautée")
+                            st.rerun()
+                        except ConflictError:
+                            st.error("Ce plan a été modifié entre-temps, veuillez réessayer")
+            with col_b4:
+                if st.button(f"📋 Historique", key=f"hist_{cle}"):
                     show_historique_preventif(plan)
             
+            # Les formulaires restent affichés entre les réexécutions jusqu'à leur validation
+            if st.session_state.get("occurrence_a_reporter") == cle:
+                show_reporter_occurrence(occurrence)
+            if st.session_state.get("occurrence_bt") == cle:
+                show_generer_bt_preventif(occurrence)
+            
             st.markdown("---")
     
+    if len(affichees) > limite:
+        if st.button("⬇️ Afficher plus"):
+            st.session_state.planning_limite = limite + 20
+            st.rerun()
+    
     # Bouton pour planifier une nouvelle intervention
     if st.button("➕ Planifier une nouvelle intervention", type="primary"):
+        st.session_state.planifier_plan = True
+    
+    if st.session_state.get("planifier_plan", False):
         show_planifier_intervention()
 
+def show_reporter_occurrence(occurrence):
+    """Formulaire de report d'une occurrence de plan préventif"""
+    plan = occurrence["plan"]
+    with st.form(f"reporter_{plan['id']}_{occurrence['date_prevue']}"):
+        st.markdown(f"#### 🔄 Report de l'intervention du {occurrence['date']} - {plan['equipement']}")
+        nouvelle_date = st.date_input("Nouvelle date",
+            datetime.date.fromisoformat(occurrence["date"]) + datetime.timedelta(days=7))
+        motif = st.text_input("Motif du report")
+        
+        if st.form_submit_button("🔄 Reporter", type="primary"):
+            try:
+                data_manager.marquer_occurrence(plan['id'], occurrence['date_prevue'], "🔴 Reporté",
+                                                date=nouvelle_date.isoformat(), motif=motif)
+                st.session_state.occurrence_a_reporter = None
+                st.rerun()
+            except ConflictError:
+                st.error("Ce plan a été modifié entre-temps, veuillez réessayer")
+
 def show_bons_preventifs():
     """Affiche les Bons de Travail préventifs"""
     st.markdown("### 📋 Bons de Travail Préventifs")
@@ -1239,73 +5777,158 @@ def show_bons_preventifs():
         statut_bt = st.multiselect("Statut du BT",
             ["🟢 Planifié", "🟡 En cours", "🔵 Réalisé", "✅ Clôturé"])
     
-    # Liste des BTs préventifs
-    bts_preventifs = [
-        {
-            "id": "BT-P-001",
-            "equipement": "Pompe centrifuge P-101",
-            "type": "Mensuelle",
-            "technicien": "Ali ben salah",
-            "date_planifiee": "2025-12-20",
-            "date_realisation": None,
-            "statut": "🟢 Planifié",
-            "checklist": ["Vérifier vibrations", "Contrôler température", "Graisser roulements"]
-        },
-        {
-            "id": "BT-P-002",
-            "equipement": "Convoyeur bande C-205",
-            "type": "Hebdomadaire",
-            "technicien": "Fatma Jebali",
-            "date_planifiee": "2025-12-18",
-            "date_realisation": None,
-            "statut": "🟢 Planifié",
-            "checklist": ["Vérifier tension courroie", "Nettoyer rouleaux", "Contrôler alignement"]
-        }
-    ]
+    # BT préventifs enregistrés, filtrés sur les index (statut, date planifiée)
+    matching_ids = data_manager.query_ids("bons_travail", {"categorie": ["Préventive"], "statut": statut_bt})
+    if periode_bt != "Tous":
+        debut, fin = fenetre_periode({"Semaine": "Semaine en cours", "Mois": "Mois en cours"}.get(periode_bt, periode_bt))
+        matching_ids &= data_manager.range_ids("bons_travail", "date_planifiee", debut.isoformat(), fin.isoformat())
+    
+    if not matching_ids:
+        st.info("Aucun BT préventif ne correspond aux filtres")
+        return
+    
+    ordered_ids = data_manager.ordered_ids("bons_travail", matching_ids, by="date_planifiee")
+    bts_preventifs = [data_manager.get_bon_travail(bt_id) for bt_id in ordered_ids[paginer(len(ordered_ids), "bons_preventifs")]]
     
     for bt in bts_preventifs:
         with st.container():
             col_a1, col_a2 = st.columns([3, 1])
             with col_a1:
-                st.markdown(f"**{bt['id']} - {bt['equipement']}**")
+                st.markdown(f"**{bt['numero']} - {bt['equipement']}**")
                 st.caption(f"Type: {bt['type']} | Technicien: {bt['technicien']}")
                 st.write(f"Date planifiée: {bt['date_planifiee']}")
+                if bt.get("date_fin"):
+                    st.write(f"Réalisé le: {bt['date_fin']}")
             
             with col_a2:
                 st.markdown(f"**{bt['statut']}**")
             
             # Checklist
             with st.expander("📋 Checklist de maintenance"):
-                for item in bt['checklist']:
-                    st.checkbox(item, key=f"{bt['id']}_{item}")
+                for item in bt.get('checklist', []):
+                    st.checkbox(item, key=f"{bt['numero']}_{item}")
             
             # Actions
             col_b1, col_b2, col_b3 = st.columns(3)
             with col_b1:
                 if bt["statut"] == "🟢 Planifié":
-                    if st.button(f"▶️ Démarrer", key=f"start_{bt['id']}"):
-                        st.session_state.bt_en_cours = bt
-                        st.success(f"BT {bt['id']} démarré")
+                    if st.button(f"▶️ Démarrer", key=f"start_{bt['numero']}"):
+                        try:
+                            data_manager.update_bon_travail(bt['id'], {
+                                **bt, "statut": "🟡 En cours", "date_debut": datetime.date.today().isoformat()
+                            }, expected_rev=bt['_rev'])
+                            st.rerun()
+                        except ConflictError:
+                            st.error("Ce BT a été modifié entre-temps, veuillez réessayer")
             with col_b2:
-                if st.button(f"📝 Remplir BT", key=f"fill_{bt['id']}"):
-                    show_remplir_bt_preventif(bt)
+                if bt["statut"] in ("🟢 Planifié", "🟡 En cours"):
+                    if st.button(f"📝 Remplir BT", key=f"fill_{bt['numero']}"):
+                        st.session_state.bt_preventif_a_remplir = bt['id']
             with col_b3:
-                if st.button(f"📊 Consulter", key=f"consult_{bt['id']}"):
+                if st.button(f"📊 Consulter", key=f"consult_{bt['numero']}"):
                     show_details_bt_preventif(bt)
             
+            # Le formulaire reste affiché entre les réexécutions jusqu'à la clôture
+            if st.session_state.get("bt_preventif_a_remplir") == bt['id']:
+                show_remplir_bt_preventif(bt)
+            
             st.markdown("---")
 
+# ========== AFFECTATION DES TECHNICIENS ==========
+def format_horaire(heures):
+    """Heure de passage lisible à partir du nombre d'heures écoulées depuis le début de journée"""
+    minutes = round((Ordonnanceur.HEURE_DEBUT + heures) * 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def show_affectation_techniciens():
+    """Affiche le plan d'affectation des BT ouverts proposé par l'ordonnanceur"""
+    st.markdown("### 👷 Affectation des Techniciens")
+    st.caption(f"BT ouverts répartis entre les techniciens actifs et aptes : {Ordonnanceur.CAPACITE_JOUR:g}h par jour ouvré, "
+               f"{Ordonnanceur.DEPLACEMENT:g}h de trajet par changement d'atelier")
+    
+    horizon = st.selectbox("Horizon", [7, 14, 30, 90], format_func=lambda jours: f"{jours} prochains jours",
+                           key="affectation_horizon")
+    debut = datetime.date.today()
+    fin = debut + datetime.timedelta(days=horizon - 1)
+    lignes, non_affectes, charges = data_manager.get_affectations(debut, fin)
+    
+    # Métriques
+    journees = [heures for jours in charges.values() for heures in jours.values()]
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("BT affectés", len(lignes))
+    with col2:
+        st.metric("Sans technicien", len(non_affectes))
+    with col3:
+        st.metric("Techniciens mobilisés", len(charges))
+    with col4:
+        taux = sum(journees) / (len(journees) * Ordonnanceur.CAPACITE_JOUR) if journees else 0
+        st.metric("Charge moyenne", f"{taux:.0%}")
+    
+    if st.button("✅ Appliquer les affectations", type="primary", disabled=not lignes,
+                 help="Enregistre le technicien et la date retenus sur chaque BT de l'horizon"):
+        try:
+            modifies = data_manager.appliquer_affectations(debut, fin)
+            st.success(f"{modifies} BT mis à jour")
+            st.rerun()
+        except ConflictError:
+            st.error("Un BT a été modifié entre-temps, veuillez réessayer")
+    
+    if non_affectes:
+        with st.expander(f"⚠️ {len(non_affectes)} BT sans technicien"):
+            for bt_id, motif in non_affectes.items():
+                bt = data_manager.get_bon_travail(bt_id)
+                st.write(f"**{bt['numero']}** - {bt.get('equipement', '')} : {motif}")
+    
+    if not lignes:
+        st.info("Aucun BT à affecter sur cet horizon")
+        return
+    
+    st.markdown("#### Charge journalière (heures)")
+    charge = pd.DataFrame(charges).T.fillna(0.0)
+    charge = charge[sorted(charge.columns)]
+    charge.columns = [jour.strftime("%d/%m") for jour in charge.columns]
+    st.dataframe(charge.sort_index(), use_container_width=True)
+    
+    st.markdown("#### Plan d'affectation")
+    page = []
+    for ligne in lignes[paginer(len(lignes), "affectation")]:
+        bt = data_manager.get_bon_travail(ligne["bt_id"])
+        page.append({
+            "Jour": ligne["jour"].strftime("%d/%m/%Y"),
+            "Horaire": f"{format_horaire(ligne['debut'])} - {format_horaire(ligne['fin'])}",
+            "Technicien": ligne["technicien"],
+            "BT": bt["numero"],
+            "Équipement": bt.get("equipement", ""),
+            "Atelier": atelier_de(bt.get("localisation")),
+            "Priorité": bt.get("priorite", ""),
+            "Affectation actuelle": bt.get("technicien", "")
+        })
+    st.dataframe(pd.DataFrame(page), use_container_width=True, hide_index=True)
+
 # ========== FONCTIONS AUXILIAIRES ==========
-def calculer_priorite(criticite, impact_production):
-    """Calcule la priorité en fonction de la criticité et de l'impact"""
-    if criticite == "Critique" or impact_production == "Arrêt total":
-        return "Urgente"
-    elif criticite == "Haute" or impact_production == "Arrêt partiel":
-        return "Haute"
-    elif criticite == "Moyenne" or impact_production == "Ralentissement":
-        return "Normale"
-    else:
-        return "Basse"
+def cout_horaire_technicien(nom):
+    """Retourne le coût horaire du personnel portant ce nom (0 si inconnu)"""
+    for _, personnel, _ in data_manager.search(nom, ["personnels"], limit=5):
+        if personnel.get("nom") == nom:
+            return float(personnel.get("cout_horaire") or 0)
+    return 0.0
+
+AFFECTATION_AUTOMATIQUE = "🤖 Affectation automatique"
+
+def techniciens_disponibles():
+    """Noms des personnels actifs, dans l'ordre de l'annuaire (statut lu sur l'index)"""
+    ids = data_manager.query_ids("personnels", {"statut": [Ordonnanceur.STATUT_DISPONIBLE]})
+    return [data_manager.get_personnel(personnel_id)["nom"] for personnel_id in data_manager.ordered_ids("personnels", ids)]
+
+def affecter_technicien(bt_data):
+    """Remplace l'affectation automatique par le technicien et la date proposés par l'ordonnanceur"""
+    if bt_data["technicien"] != AFFECTATION_AUTOMATIQUE:
+        return
+    proposition = data_manager.proposer_technicien(bt_data)
+    bt_data["technicien"] = proposition["technicien"] if proposition else "À affecter"
+    if proposition:
+        bt_data["date_planifiee"] = proposition["jour"].isoformat()
 
 def show_generer_bt(demande_data):
     """Affiche le formulaire pour générer un Bon de Travail"""
@@ -1316,9 +5939,10 @@ def show_generer_bt(demande_data):
         
         with col1:
             st.markdown("#### Informations BT")
-            bt_numero = st.text_input("Numéro BT", f"BT-C-{int(time.time())}")
+            bt_numero = st.text_input("Numéro BT", placeholder="Attribué automatiquement si vide")
             technicien_assign = st.selectbox("Technicien assigné*",
-                ["Ali ben salah", "Fatma Jebali", "Mohamed Trabelsi", "Sonia Hammami", "À affecter"])
+                [AFFECTATION_AUTOMATIQUE] + techniciens_disponibles() + ["À affecter"],
+                help="L'affectation automatique retient un technicien actif, apte et disponible à la date prévue")
             date_intervention = st.date_input("Date prévue d'intervention*", datetime.date.today())
             temps_estime = st.selectbox("Temps estimé*", ["1h", "2h", "4h", "8h", "1 jour", "Plus"])
         
@@ -1350,26 +5974,40 @@ def show_generer_bt(demande_data):
         if submitted:
             if technicien_assign and travaux_a_effectuer:
                 bt_data = {
-                    **demande_data,
-                    "bt_numero": bt_numero,
+                    "numero": bt_numero,
+                    "demande_id": demande_data.get("id"),
+                    "equipement": demande_data.get("equipement_nom", ""),
+                    "reference": demande_data.get("reference_equipement", ""),
+                    "localisation": demande_data.get("localisation", ""),
+                    "type": demande_data.get("type_panne", ""),
+                    "priorite": demande_data.get("priorite", "Normale"),
+                    "description": demande_data.get("symptomes", ""),
                     "technicien": technicien_assign,
+                    "date_debut": "",
+                    "date_fin": "",
                     "date_intervention": date_intervention.isoformat(),
                     "temps_estime": temps_estime,
+                    "temps_reel": "",
                     "outillages": outillages,
                     "pieces_detachees": pieces_detachees,
                     "risques": risques,
                     "travaux_a_effectuer": travaux_a_effectuer,
                     "epi_necessaires": epi_necessaires,
                     "consignes_securite": consignes_securite,
-                    "statut_bt": "🟡 En attente"
+                    "statut": "🟡 En attente"
                 }
+                affecter_technicien(bt_data)
+                try:
+                    bt_id = data_manager.add_bon_travail(bt_data)
+                except ValueError as e:
+                    # BonTravailInvalideError : le gestionnaire partagé lève la classe de sa première exécution du script
+                    st.error(f"❌ {e}")
+                    return
+                st.session_state.generating_bt = False
                 
-                st.success(f"✅ Bon de Travail {bt_numero} généré avec succès !")
+                st.success(f"✅ Bon de Travail {data_manager.get_bon_travail(bt_id)['numero']} généré avec succès "
+                           f"(technicien : {bt_data['technicien']})")
                 st.balloons()
-                
-                # Option de téléchargement (simulé)
-                if st.button("📄 Télécharger le BT au format PDF"):
-                    st.info("Fonctionnalité PDF en développement")
             else:
                 st.error("Veuillez remplir tous les champs obligatoires")
 
@@ -1399,7 +6037,7 @@ def show_creer_bt_correctif():
         col3, col4 = st.columns(2)
         with col3:
             technicien = st.selectbox("Technicien responsable*",
-                ["Ali ben salah", "Fatma Jebali", "Mohamed Trabelsi", "Sonia Hammami"])
+                [AFFECTATION_AUTOMATIQUE] + techniciens_disponibles())
             date_planifiee = st.date_input("Date planifiée*", datetime.date.today())
         
         with col4:
@@ -1409,7 +6047,30 @@ def show_creer_bt_correctif():
         
         if submitted:
             if equipement and localisation and description and technicien:
-                st.success(f"✅ BT créé pour {equipement}")
+                bt_data = {
+                    "equipement": equipement,
+                    "reference": reference,
+                    "localisation": localisation,
+                    "type": type_intervention,
+                    "priorite": priorite,
+                    "description": description,
+                    "technicien": technicien,
+                    "date_debut": "",
+                    "date_fin": "",
+                    "date_planifiee": date_planifiee.isoformat(),
+                    "temps_estime": f"{temps_estime:g}h",
+                    "temps_reel": "",
+                    "statut": "🟡 En attente"
+                }
+                affecter_technicien(bt_data)
+                try:
+                    bt_id = data_manager.add_bon_travail(bt_data)
+                except ValueError as e:
+                    # BonTravailInvalideError : le gestionnaire partagé lève la classe de sa première exécution du script
+                    st.error(f"❌ {e}")
+                    return
+                st.session_state.bt_cree = (f"✅ BT {data_manager.get_bon_travail(bt_id)['numero']} créé pour {equipement} "
+                                            f"(technicien : {bt_data['technicien']})")
                 st.session_state.creating_bt = False
                 st.rerun()
             else:
@@ -1417,23 +6078,23 @@ def show_creer_bt_correctif():
 
 def show_rapport_bt(bt_data):
     """Affiche un rapport détaillé pour un BT"""
-    st.markdown(f"### 📊 Rapport détaillé - {bt_data['id']}")
+    st.markdown(f"### 📊 Rapport détaillé - {bt_data['numero']}")
     
     col1, col2 = st.columns(2)
     with col1:
         st.markdown("#### Informations générales")
         st.write(f"**Équipement:** {bt_data['equipement']}")
-        st.write(f"**Référence:** {bt_data['reference']}")
+        st.write(f"**Référence:** {bt_data.get('reference', '')}")
         st.write(f"**Technicien:** {bt_data['technicien']}")
         st.write(f"**Date création:** {bt_data['date_creation']}")
         st.write(f"**Priorité:** {bt_data['priorite']}")
     
     with col2:
         st.markdown("#### Chronologie")
-        st.write(f"**Date début:** {bt_data['date_debut']}")
-        st.write(f"**Date fin:** {bt_data['date_fin']}")
-        st.write(f"**Temps estimé:** {bt_data['temps_estime']}")
-        st.write(f"**Temps réel:** {bt_data['temps_reel']}")
+        st.write(f"**Date début:** {bt_data.get('date_debut', '')}")
+        st.write(f"**Date fin:** {bt_data.get('date_fin', '')}")
+        st.write(f"**Temps estimé:** {bt_data.get('temps_estime', '')}")
+        st.write(f"**Temps réel:** {bt_data.get('temps_reel', '')}")
         st.write(f"**Statut:** {bt_data['statut']}")
     
     # Section commentaires
@@ -1444,14 +6105,15 @@ def show_rapport_bt(bt_data):
     if st.button("💾 Enregistrer le rapport"):
         st.success("Rapport enregistré avec succès")
 
-def show_generer_bt_preventif(plan_data):
-    """Génère un BT préventif à partir du planning"""
+def show_generer_bt_preventif(occurrence):
+    """Génère un BT préventif pour une occurrence du planning"""
+    plan_data = occurrence["plan"]
     st.markdown(f"### 📄 Génération BT Préventif - {plan_data['equipement']}")
     
     with st.form("bt_preventif_form"):
         st.markdown("#### Checklist de maintenance")
         
-        # Checklist générique selon le type
+        # Checklist générique selon le type, remplacée par les tâches du plan si elles sont définies
         checklist_items = []
         if plan_data['type'] == "Mensuelle":
             checklist_items = [
@@ -1468,6 +6130,8 @@ def show_generer_bt_preventif(plan_data):
                 "Nettoyer les surfaces",
                 "Vérifier les serrages"
             ]
+        if plan_data.get("taches"):
+            checklist_items = list(plan_data["taches"])
         
         for item in checklist_items:
             st.checkbox(item, key=f"check_{hash(item)}")
@@ -1487,12 +6151,35 @@ def show_generer_bt_preventif(plan_data):
             placeholder="Notez ici toute observation particulière...")
         
         if st.form_submit_button("✅ Générer le BT Préventif", type="primary"):
-            st.success(f"BT préventif généré pour {plan_data['equipement']}")
-            st.info("Le BT a été ajouté à la liste des Bons Préventifs")
+            try:
+                bt_id = data_manager.add_bon_travail({
+                    "categorie": "Préventive",
+                    "plan_id": plan_data['id'],
+                    "date_prevue": occurrence['date_prevue'],
+                    "equipement": plan_data['equipement'],
+                    "type": plan_data['type'],
+                    "technicien": plan_data['technicien'],
+                    "date_planifiee": occurrence['date'],
+                    "date_realisation": None,
+                    "statut": "🟢 Planifié",
+                    "priorite": "Normale",
+                    "checklist": checklist_items,
+                    "mesures_reference": {"temperature": temperature, "pression": pression, "vibration": vibration},
+                    "observations": observations
+                })
+                numero = data_manager.get_bon_travail(bt_id)['numero']
+                data_manager.marquer_occurrence(plan_data['id'], occurrence['date_prevue'], "🟡 En cours", bt=numero)
+                st.session_state.occurrence_bt = None
+                st.success(f"BT préventif {numero} généré pour {plan_data['equipement']}")
+                st.info("Le BT a été ajouté à la liste des Bons Préventifs")
+            except ConflictError:
+                st.error("Ce plan a été modifié entre-temps, veuillez réessayer")
 
 def show_remplir_bt_preventif(bt_data):
     """Formulaire pour remplir un BT préventif"""
-    st.markdown(f"### 📝 Remplissage du BT Préventif - {bt_data['id']}")
+    st.markdown(f"### 📝 Remplissage du BT Préventif - {bt_data['numero']}")
+    cle = f"remplir_bt_preventif_{bt_data['id']}"
+    revision = revision_formulaire(cle, bt_data)
     
     with st.form("remplir_bt_preventif_form"):
         # Checklist
@@ -1523,6 +6210,8 @@ def show_remplir_bt_preventif(bt_data):
         consommables = st.text_area("Consommables utilisés", 
             placeholder="Graisse, joints, filtres, etc.")  # CORRECTION ICI
         
+        cout_consommables = st.number_input("Coût des consommables (€)", min_value=0.0, value=0.0, step=10.0)
+        
         # Signature
         signature = st.text_input("Nom et signature du technicien",
             value=bt_data.get('technicien', ''))
@@ -1530,12 +6219,25 @@ def show_remplir_bt_preventif(bt_data):
         submitted = st.form_submit_button("✅ Clôturer le BT", type="primary")
         
         if submitted:
-            st.success(f"BT {bt_data['id']} clôturé avec succès !")
-            st.balloons()
+            # La clôture enregistre l'intervention (indicateurs) et marque l'occurrence du plan comme réalisée
+            try:
+                data_manager.cloturer_bon_travail(
+                    bt_data['id'], temps_passe, temps_passe,
+                    temps_passe * cout_horaire_technicien(signature) + cout_consommables,
+                    anomalies or "RAS", statut="✅ Clôturé", date_fin=date_realisation.isoformat(),
+                    expected_rev=revision
+                )
+                fermer_formulaire(cle)
+                st.session_state.bt_preventif_a_remplir = None
+                st.success(f"BT {bt_data['numero']} clôturé avec succès !")
+                st.balloons()
+            except ConflictError:
+                fermer_formulaire(cle)
+                st.error("Ce BT a été modifié par un autre utilisateur depuis l'ouverture du formulaire : vérifiez-le puis validez à nouveau")
 
 def show_details_bt_preventif(bt_data):
     """Affiche les détails d'un BT préventif"""
-    st.markdown(f"### 📋 Détails du BT Préventif - {bt_data['id']}")
+    st.markdown(f"### 📋 Détails du BT Préventif - {bt_data['numero']}")
     
     col1, col2 = st.columns(2)
     with col1:
@@ -1666,11 +6368,10 @@ def show_planifier_intervention():
         with col1:
             equipement = st.text_input("Équipement*", placeholder="Nom de l'équipement")
             reference = st.text_input("Référence équipement")
-            type_maintenance = st.selectbox("Type de maintenance*",
-                ["Hebdomadaire", "Mensuelle", "Trimestrielle", "Semestrielle", "Annuelle"])
+            type_maintenance = st.selectbox("Type de maintenance*", list(PERIODICITES) + ["Personnalisée"])
         
         with col2:
-            frequence = st.number_input("Fréquence (jours)*", 7, 365, 30, 7)
+            frequence = st.number_input("Fréquence (jours, si personnalisée)", 1, 365, 30, 1)
             date_premiere = st.date_input("Date première intervention*", datetime.date.today())
             technicien = st.selectbox("Technicien responsable",
                 ["Ali ben salah", "Karim Chaouch", "Sonia Hammami", "Mohamed Trabelsi", "Fatma Jebali"])
@@ -1688,6 +6389,19 @@ def show_planifier_intervention():
         
         if submitted:
             if equipement and type_maintenance and description_taches:
+                # Seule la règle est enregistrée : les occurrences sont calculées à l'affichage
+                data_manager.add_plan_preventif({
+                    "equipement": equipement,
+                    "reference": reference,
+                    "type": type_maintenance,
+                    "frequence_jours": frequence if type_maintenance == "Personnalisée" else None,
+                    "date_debut": date_premiere.isoformat(),
+                    "technicien": technicien,
+                    "duree_estimee": "2h",
+                    "taches": [t.strip() for t in description_taches.splitlines() if t.strip()],
+                    "derniere_realisation": None
+                })
+                st.session_state.planifier_plan = False
                 st.success(f"Intervention planifiée pour {equipement}")
                 st.info(f"Prochaine intervention: {date_premiere}")
             else:
@@ -1736,153 +6450,465 @@ def show_statistiques_preventives():
         'Jours retard': [15, 10, 5]
     })
     st.dataframe(retards, use_container_width=True)
+def libelle_emplacement(equipement_id):
+    """Chemin complet d'un site, d'une zone ou d'une ligne pour les listes de choix"""
+    equipement = data_manager.get_equipement(equipement_id)
+    chemin = data_manager.chemin_equipement(equipement_id)
+    return f"{chemin} › {equipement['nom']}" if chemin else equipement["nom"]
+
 def show_equipements():
     """Affiche la page équipements"""
     st.title("🏭 Parc d'Équipements")
     
-    # Métriques
+    # Métriques lues sur l'index des états
+    synthese = data_manager.get_synthese_equipements()
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total équipements", "48")
+        st.metric("Total équipements", synthese["total"])
     with col2:
-        st.metric("Opérationnels", "42", "+2")
+        st.metric("Opérationnels", synthese.get(ETATS_EQUIPEMENT[0], 0))
     with col3:
-        st.metric("En maintenance", "5", "-1")
+        st.metric("En maintenance", synthese.get(ETATS_EQUIPEMENT[1], 0))
     with col4:
-        st.metric("Hors service", "1", "0")
+        st.metric("Hors service", synthese.get(ETATS_EQUIPEMENT[2], 0))
     
     # Onglets
-    tab1, tab2 = st.tabs(["📋 Inventaire", "➕ Ajouter"])
+    tab1, tab2, tab3 = st.tabs(["📋 Inventaire", "📈 Fiabilité", "➕ Ajouter"])
     
     with tab1:
-        # Données exemple
-        equipements = pd.DataFrame({
-            "ID": ["EQ-001", "EQ-002", "EQ-003", "EQ-004", "EQ-005"],
-            "Nom": ["Presse hydraulique 100T", "Tour CNC 5 axes", "Four industriel 800°C", "Robot soudeur KUKA", "Compresseur Atlas"],
-            "Type": ["Formage", "Usinage", "Traitement thermique", "Assemblage", "Utilitaire"],
-            "Localisation": ["Atelier A", "Atelier B", "Zone chauffage", "Ligne 2", "Salle technique"],
-            "État": ["✅ Opérationnel", "⚠️ Maintenance", "✅ Opérationnel", "✅ Opérationnel", "❌ Hors service"],
-            "Date installation": ["2020-03-15", "2021-07-22", "2019-11-10", "2022-09-05", "2018-12-18"],
-            "Prochaine maintenance": ["2025-01-15", "2024-12-22", "2024-11-30", "2025-02-05", "-"]
+        show_inventaire_equipements()
+    
+    with tab2:
+        show_fiabilite_equipements()
+    
+    with tab3:
+        show_ajouter_equipement()
+
+def show_inventaire_equipements():
+    """Inventaire filtré par emplacement (sous-arbre), type et état, lu sur les index du parc"""
+    emplacements = [equipement["id"] for equipement in data_manager.get_emplacements()]
+    
+    # Filtres
+    col_f1, col_f2, col_f3 = st.columns(3)
+    with col_f1:
+        racine_id = st.selectbox("Emplacement", [None] + emplacements,
+                                 format_func=lambda equipement_id: "Tous" if equipement_id is None else libelle_emplacement(equipement_id))
+    
+    # Options tirées des facettes, pour inclure les valeurs saisies hors des listes par défaut
+    types = data_manager.facet_counts("equipements", "type")
+    with col_f2:
+        type_filter = st.multiselect("Type", sorted(set(TYPES_EQUIPEMENT) | {t for t, n in types.items() if n and t}))
+    
+    with col_f3:
+        etat_filter = st.multiselect("État", ETATS_EQUIPEMENT, default=[ETATS_EQUIPEMENT[0]])
+    
+    recherche = st.text_input("🔍 Rechercher", placeholder="Code, nom, marque, n° de série...", key="recherche_equipements")
+    
+    equipement_ids = data_manager.get_equipements_ids(racine_id, type_filter, etat_filter, [NIVEAUX_EQUIPEMENT[-1]], recherche)
+    if not equipement_ids:
+        st.info("Aucun équipement ne correspond aux filtres")
+        return
+    
+    def tableau(ids):
+        equipements = [data_manager.get_equipement(equipement_id) for equipement_id in ids]
+        return pd.DataFrame({
+            "Code": [e["code"] for e in equipements],
+            "Nom": [e["nom"] for e in equipements],
+            "Type": [e.get("type", "") for e in equipements],
+            "Localisation": [data_manager.chemin_equipement(e["id"]) for e in equipements],
+            "État": [e.get("etat", "") for e in equipements],
+            "Marque": [e.get("marque", "") for e in equipements],
+            "Date installation": [e.get("date_installation", "") for e in equipements]
         })
+    
+    # Seuls les équipements de la page visible sont lus
+    st.dataframe(tableau(equipement_ids[paginer(len(equipement_ids), "equipements")]),
+                 use_container_width=True, height=400, hide_index=True)
+    
+    # Rapport sur l'ensemble de la sélection, pas seulement la page affichée
+    st.download_button("📊 Générer rapport équipements", data=tableau(equipement_ids).to_csv(index=False),
+                       file_name="rapport_equipements.csv", mime="text/csv", type="primary")
+
+def show_fiabilite_equipements():
+    """Indicateurs de fiabilité par équipement, calculés sur l'historique des demandes d'intervention"""
+    fiabilite = data_manager.get_fiabilite()
+    if fiabilite.empty:
+        st.info("Aucune défaillance enregistrée")
+        return
+    
+    st.caption(f"Classement par risque de panne sous {HORIZON_FIABILITE} jours. "
+               "β > 1 : usure (pannes de plus en plus rapprochées), β < 1 : défaillances de jeunesse.")
+    noms = {reference: (data_manager.get_equipement_by_code(reference) or {}).get("nom", "") for reference in fiabilite.index}
+    st.dataframe(pd.DataFrame({
+        "Référence": fiabilite.index,
+        "Équipement": [noms[reference] for reference in fiabilite.index],
+        "Défaillances": fiabilite["defaillances"].to_numpy(),
+        "MTBF (h)": fiabilite["mtbf"].round(0).to_numpy(),
+        "MTTR (h)": fiabilite["mttr"].round(1).to_numpy(),
+        "β (forme)": fiabilite["beta"].round(2).to_numpy(),
+        "η (échelle, h)": fiabilite["eta"].round(0).to_numpy(),
+        "Dernière panne": fiabilite["derniere"].dt.strftime("%Y-%m-%d").to_numpy(),
+        "Risque": (fiabilite["risque"] * 100).round(0).to_numpy()
+    }), use_container_width=True, height=400, hide_index=True,
+        column_config={"Risque": st.column_config.ProgressColumn("Risque", format="%d%%", min_value=0, max_value=100)})
+
+def show_ajouter_equipement():
+    """Ajout d'un équipement, ou d'un site, d'une zone ou d'une ligne, rattaché à l'arborescence du parc"""
+    st.subheader("Ajouter un équipement")
+    
+    # Hors formulaire : les emplacements proposés dépendent du niveau choisi
+    col1, col2 = st.columns(2)
+    with col1:
+        niveau = st.selectbox("Niveau*", NIVEAUX_EQUIPEMENT, index=len(NIVEAUX_EQUIPEMENT) - 1, key="equipement_niveau")
+    rang = NIVEAUX_EQUIPEMENT.index(niveau)
+    parents = [e["id"] for e in data_manager.get_emplacements() if NIVEAUX_EQUIPEMENT.index(e["niveau"]) < rang]
+    with col2:
+        if rang == 0:
+            parent_id = None
+            st.caption("Un site est à la racine de l'arborescence")
+        else:
+            parent_id = st.selectbox("Localisation*", parents, format_func=libelle_emplacement, key="equipement_parent")
+    
+    with st.form("new_equipement"):
+        col1, col2 = st.columns(2)
+        with col1:
+            code = st.text_input("Code*", placeholder="Ex: EQ-009")
+            nom = st.text_input("Nom de l'équipement*")
+            type_eq = st.selectbox("Type*", TYPES_EQUIPEMENT)
+            marque = st.text_input("Marque")
+            modele = st.text_input("Modèle")
         
-        # Filtres
-        col_f1, col_f2 = st.columns(2)
-        with col_f1:
-            type_filter = st.multiselect("Type", equipements["Type"].unique())
-        
-        with col_f2:
-            etat_filter = st.multiselect("État", equipements["État"].unique(), default=["✅ Opérationnel"])
-        
-        # Application filtres
-        if type_filter:
-            equipements = equipements[equipements["Type"].isin(type_filter)]
-        if etat_filter:
-            equipements = equipements[equipements["État"].isin(etat_filter)]
+        with col2:
+            num_serie = st.text_input("Numéro de série")
+            date_installation = st.date_input("Date d'installation", datetime.date.today())
+            etat = st.selectbox("État*", ETATS_EQUIPEMENT)
         
-        st.dataframe(equipements, use_container_width=True, height=400)
+        notes = st.text_area("Notes techniques")
         
-        # Actions
-        if st.button("📊 Générer rapport équipements", type="primary"):
-            st.success("Rapport généré !")
-    
-    with tab2:
-        st.subheader("Ajouter un équipement")
-        with st.form("new_equipement"):
-            col1, col2 = st.columns(2)
-            with col1:
-                nom = st.text_input("Nom de l'équipement*")
-                type_eq = st.selectbox("Type*", ["Formage", "Usinage", "Traitement thermique", "Assemblage", "Utilitaire", "Transport", "Contrôle"])
-                marque = st.text_input("Marque")
-                modele = st.text_input("Modèle")
-            
-            with col2:
-                localisation = st.text_input("Localisation*")
-                num_serie = st.text_input("Numéro de série")
-                date_installation = st.date_input("Date d'installation", datetime.date.today())
-                etat = st.selectbox("État*", ["✅ Opérationnel", "⚠️ Maintenance", "❌ Hors service"])
-            
-            notes = st.text_area("Notes techniques")
-            
-            if st.form_submit_button("✅ Ajouter l'équipement", type="primary"):
-                st.success(f"Équipement {nom} ajouté avec succès !")
-                st.balloons()
+        if st.form_submit_button("✅ Ajouter l'équipement", type="primary"):
+            if not code or not nom or (rang and parent_id is None):
+                st.error("Veuillez remplir tous les champs obligatoires")
+            else:
+                try:
+                    data_manager.add_equipement({
+                        "code": code,
+                        "nom": nom,
+                        "niveau": niveau,
+                        "parent_id": parent_id,
+                        "type": type_eq if niveau == NIVEAUX_EQUIPEMENT[-1] else "",
+                        "marque": marque,
+                        "modele": modele,
+                        "numero_serie": num_serie,
+                        "date_installation": date_installation.isoformat(),
+                        "etat": etat,
+                        "notes": notes
+                    })
+                except ValueError as e:
+                    # EquipementInvalideError : le gestionnaire partagé lève la classe de sa première exécution du script
+                    st.error(f"❌ {e}")
+                else:
+                    st.success(f"Équipement {nom} ajouté avec succès !")
+                    st.balloons()
 
 def show_stocks():
     """Affiche la page stocks"""
     st.title("📦 Gestion des Stocks")
     
-    # Métriques
+    # Métriques lues sur les soldes matérialisés des articles (sans rejouer les mouvements)
+    synthese = data_manager.get_synthese_stock()
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Articles en stock", "156")
+        st.metric("Articles en stock", synthese["articles"])
     with col2:
-        st.metric("Valeur totale", "18,450 €")
+        st.metric("Valeur totale", f"{synthese['valeur']:,.2f} €")
     with col3:
-        st.metric("À réapprovisionner", "12", "+2")
+        st.metric("À réapprovisionner", synthese["a_reapprovisionner"])
     with col4:
-        st.metric("Ruptures", "3", "-1")
+        st.metric("Ruptures", synthese["ruptures"])
     
     # Onglets
-    tab1, tab2, tab3 = st.tabs(["📋 Inventaire", "🚨 Alertes", "📦 Réapprovisionnement"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📋 Inventaire", "🚨 Alertes", "📦 Réapprovisionnement", "🔄 Mouvements"])
     
     with tab1:
-        # Données exemple
+        show_inventaire_stock()
+    
+    with tab2:
+        show_alertes_stock()
+    
+    with tab3:
+        show_reapprovisionnement()
+    
+    with tab4:
+        show_mouvements_stock()
+
+def libelle_article(article_id):
+    """Référence et désignation d'un article pour les listes de choix"""
+    article = data_manager.get_article(article_id)
+    return f"{article['reference']} — {article['designation']}"
+
+def show_inventaire_stock():
+    """Affiche l'inventaire valorisé à partir des soldes des articles"""
+    articles = data_manager.get_articles_frame()
+    if articles.empty:
+        st.info("Aucun article enregistré")
+    else:
+        quantite = pd.to_numeric(articles["quantite"])
+        seuil = pd.to_numeric(articles["seuil_minimum"])
+        valeur = pd.to_numeric(articles["valeur"])
         stocks = pd.DataFrame({
-            "Référence": ["R001-2024", "R002-2024", "R003-2024", "R004-2024", "R005-2024"],
-            "Désignation": ["Roulement 6205-2RS", "Courroie synchronisée B85", "Filtre à air industriel", "Joint d'étanchéité Ø150mm", "Capteur température PT100"],
-            "Catégorie": ["Roulement", "Transmission", "Filtration", "Étanchéité", "Capteur"],
-            "Quantité": [15, 8, 22, 45, 12],
-            "Seuil minimum": [5, 3, 10, 20, 5],
-            "Unité": ["pièce", "pièce", "pièce", "pièce", "pièce"],
-            "Prix unitaire": [45.50, 32.80, 120.00, 8.75, 89.99],
-            "Valeur": [682.50, 262.40, 2640.00, 393.75, 1079.88],
-            "État": ["✅ Suffisant", "⚠️ Critique", "✅ Suffisant", "✅ Suffisant", "⚠️ Critique"]
+            "Référence": articles["reference"],
+            "Désignation": articles["designation"],
+            "Catégorie": articles["categorie"],
+            "Quantité": quantite,
+            "Seuil minimum": seuil,
+            "Unité": articles["unite"],
+            "Coût moyen": (valeur / quantite).where(quantite > 0, pd.to_numeric(articles["prix_unitaire"])).round(2),
+            "Valeur": valeur,
+            "État": pd.Series("✅ Suffisant", index=articles.index).mask(quantite <= seuil, "⚠️ Critique").mask(quantite <= 0, "🔴 Rupture")
         })
         
-        st.dataframe(stocks, use_container_width=True, height=400)
+        st.dataframe(stocks, use_container_width=True, height=400, hide_index=True)
         
-        # Export
-        csv = stocks.to_csv(index=False)
-        st.download_button("📥 Exporter l'inventaire", data=csv, file_name="inventaire_stock.csv", mime="text/csv")
+        # Export généré au clic seulement (et non à chaque affichage)
+        st.download_button("📥 Exporter l'inventaire", data=lambda: stocks.to_csv(index=False),
+                           file_name="inventaire_stock.csv", mime="text/csv")
     
-    with tab2:
-        st.subheader("🚨 Alertes stock")
-        
-        # Alertes critiques
-        alertes = pd.DataFrame({
-            "Article": ["Courroie B85", "Capteur PT100", "Graisse industrielle"],
-            "Quantité actuelle": [8, 12, 5],
-            "Seuil minimum": [10, 15, 8],
-            "Manquant": [2, 3, 3],
-            "Dernière commande": ["2024-10-15", "2024-10-20", "2024-10-25"],
-            "Fournisseur": ["Gates Europe", "Endress+Hauser", "Total Energies"]
-        })
-        
-        for _, alerte in alertes.iterrows():
-            with st.container():
-                st.error(f"**{alerte['Article']}** - Seuil critique: {alerte['Quantité actuelle']}/{alerte['Seuil minimum']}")
-                col_a1, col_a2 = st.columns(2)
-                with col_a1:
-                    st.write(f"Fournisseur: {alerte['Fournisseur']}")
-                with col_a2:
-                    if st.button(f"Commander {alerte['Article']}", key=f"cmd_{alerte['Article']}"):
-                        st.success(f"Commande lancée pour {alerte['Article']}")
-                st.markdown("---")
+    with st.expander("➕ Nouvel article"):
+        with st.form("nouvel_article_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                reference = st.text_input("Référence*")
+                designation = st.text_input("Désignation*")
+                categorie = st.text_input("Catégorie", placeholder="Ex: Roulement")
+                unite = st.selectbox("Unité", ["pièce", "kg", "litre", "mètre", "lot"])
+            with col2:
+                seuil_minimum = st.number_input("Seuil minimum", min_value=0.0, value=5.0, step=1.0)
+                prix_unitaire = st.number_input("Prix unitaire de référence (€)", min_value=0.0, value=0.0, step=1.0)
+                fournisseur = st.text_input("Fournisseur habituel")
+                emplacement = st.text_input("Emplacement", placeholder="Ex: Magasin - Allée 1")
+            
+            if st.form_submit_button("💾 Créer l'article", type="primary"):
+                if not reference or not designation:
+                    st.error("Veuillez remplir tous les champs obligatoires")
+                elif data_manager.get_article_by_reference(reference):
+                    st.error(f"La référence {reference} existe déjà")
+                else:
+                    data_manager.add_article({
+                        "reference": reference,
+                        "designation": designation,
+                        "categorie": categorie or "Non spécifié",
+                        "unite": unite,
+                        "seuil_minimum": seuil_minimum,
+                        "prix_unitaire": prix_unitaire,
+                        "fournisseur": fournisseur,
+                        "emplacement": emplacement
+                    })
+                    st.success(f"Article {reference} créé (stock initial à saisir dans l'onglet Mouvements)")
+                    st.rerun()
+
+def show_alertes_stock():
+    """Affiche les articles sous leur seuil minimum"""
+    st.subheader("🚨 Alertes stock")
+    
+    # Ensemble critique lu sur l'index des seuils, du plus faible ratio stock/seuil au plus élevé
+    nb_alertes = data_manager.get_synthese_stock()["a_reapprovisionner"]
+    if not nb_alertes:
+        st.success("Aucun article sous son seuil minimum")
+        return
     
-    with tab3:
-        st.subheader("Réapprovisionnement")
-        
-        with st.form("reappro_form"):
-            article = st.selectbox("Article", ["Roulement 6205", "Courroie B85", "Filtre à air", "Joint étanchéité", "Capteur PT100"])
-            fournisseur = st.selectbox("Fournisseur", ["SKF France", "Gates Europe", "Donaldson", "Freudenberg", "Endress+Hauser"])
-            quantite = st.number_input("Quantité", min_value=1, value=10)
-            delai_livraison = st.number_input("Délai estimé (jours)", min_value=1, max_value=30, value=5)
-            urgence = st.selectbox("Urgence", ["Normale", "Urgente", "Très urgente"])
+    page = paginer(nb_alertes, "alertes_stock")
+    for article in data_manager.get_articles_critiques(page.stop)[page]:
+        with st.container():
+            st.error(f"**{article['designation']}** - {etat_stock(article)} : "
+                     f"{article['quantite']:g}/{article['seuil_minimum']:g} {article.get('unite', '')}")
+            col_a1, col_a2 = st.columns(2)
+            with col_a1:
+                st.write(f"Fournisseur: {article.get('fournisseur') or 'Non renseigné'}")
+            with col_a2:
+                commande = article.get("en_commande")
+                if commande:
+                    st.info(f"Commande en cours : {commande['quantite']:g} (livraison prévue le {commande['livraison_prevue']})")
+                elif st.button(f"Commander {article['designation']}", key=f"cmd_{article['id']}"):
+                    # Réapprovisionnement jusqu'à deux fois le seuil minimum
+                    quantite = max(2 * article["seuil_minimum"] - article["quantite"], 1)
+                    try:
+                        data_manager.commander_article(article["id"], quantite, article.get("fournisseur", ""), 5)
+                        st.success(f"Commande lancée pour {quantite:g} {article['designation']}")
+                        st.rerun()
+                    except ConflictError:
+                        st.error("Cet article a été modifié entre-temps, veuillez réessayer")
+            st.markdown("---")
+
+def show_reapprovisionnement():
+    """Passage et réception des commandes fournisseurs"""
+    st.subheader("Réapprovisionnement")
+    
+    article_ids = [article["id"] for article in data_manager.get_all_articles()]
+    if not article_ids:
+        st.info("Aucun article enregistré")
+        return
+    
+    # Propositions calculées sur l'historique des sorties et les délais fournisseurs
+    propositions = data_manager.get_propositions_reappro()
+    a_commander = propositions[propositions["quantite_proposee"] > 0]
+    
+    st.markdown("#### 🧮 Propositions de commande")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Articles à commander", len(a_commander))
+    with col2:
+        st.metric("Fournisseurs", a_commander["fournisseur"].nunique())
+    with col3:
+        st.metric("Montant estimé", f"{a_commander['montant'].sum():,.0f} €".replace(",", " "))
+    
+    if a_commander.empty:
+        st.success("Aucun article n'a atteint son point de commande")
+    else:
+        st.dataframe(regrouper_par_fournisseur(propositions).reset_index().rename(columns={
+            "fournisseur": "Fournisseur", "lignes": "Articles", "quantite": "Quantité",
+            "montant": "Montant (€)", "delai": "Délai (j)"
+        }), use_container_width=True, hide_index=True)
+        fournisseur_choisi = st.selectbox("Fournisseur", sorted(a_commander["fournisseur"].unique()), key="reappro_fournisseur",
+                                          format_func=lambda fournisseur: fournisseur or "Non renseigné")
+        st.dataframe(a_commander[a_commander["fournisseur"] == fournisseur_choisi].rename(columns={
+            "reference": "Référence", "designation": "Désignation", "demande_jour": "Demande/jour",
+            "stock_securite": "Stock de sécurité", "point_commande": "Point de commande",
+            "quantite_economique": "Quantité économique", "position": "Stock + commandes",
+            "quantite_proposee": "Quantité proposée", "montant": "Montant (€)"
+        }).drop(columns=["fournisseur", "delai"]), use_container_width=True, hide_index=True)
+        if st.button(f"📦 Commander chez {fournisseur_choisi or 'Non renseigné'}", type="primary"):
+            try:
+                nb_lignes = data_manager.commander_propositions(fournisseur_choisi)
+                st.success(f"{nb_lignes} article(s) commandé(s) chez {fournisseur_choisi or 'Non renseigné'}")
+                st.rerun()
+            except ConflictError:
+                st.error("Un article a été modifié entre-temps, veuillez réessayer")
+    
+    st.markdown("#### Commande manuelle")
+    # Hors formulaire : quantité, fournisseur et délai par défaut suivent l'article choisi
+    article_id = st.selectbox("Article", article_ids, format_func=libelle_article, key="reappro_article")
+    article = data_manager.get_article(article_id)
+    proposition = propositions.loc[article_id] if article_id in propositions.index else None
+    with st.form("reappro_form"):
+        fournisseur = st.text_input("Fournisseur", value=article.get("fournisseur", ""))
+        quantite = st.number_input("Quantité", min_value=1.0, step=1.0,
+                                   value=float(proposition["quantite_proposee"] or 10.0) if proposition is not None else 10.0)
+        delai_livraison = st.number_input("Délai estimé (jours)", min_value=1, max_value=90,
+                                          value=int(proposition["delai"]) if proposition is not None else 5)
+        urgence = st.selectbox("Urgence", ["Normale", "Urgente", "Très urgente"])
+        
+        if st.form_submit_button("📦 Passer commande", type="primary"):
+            article = data_manager.get_article(article_id)
+            if article.get("en_commande"):
+                st.error(f"Une commande est déjà en cours pour {article['designation']}")
+            else:
+                fournisseur = fournisseur or article.get("fournisseur", "")
+                try:
+                    data_manager.commander_article(article_id, quantite, fournisseur, int(delai_livraison), urgence)
+                    st.success(f"Commande passée pour {quantite:g} {article['designation']} chez {fournisseur}")
+                except ConflictError:
+                    st.error("Cet article a été modifié entre-temps, veuillez réessayer")
+    
+    st.markdown("#### Commandes en cours")
+    commandes = [article for article in data_manager.get_all_articles() if article.get("en_commande")]
+    if not commandes:
+        st.info("Aucune commande en cours")
+    for article in commandes:
+        commande = article["en_commande"]
+        with st.form(f"reception_{article['id']}"):
+            st.markdown(f"**{article['designation']}** - {commande['quantite']:g} {article.get('unite', '')} chez "
+                        f"{commande['fournisseur']} (commandé le {commande['date']}, livraison prévue le {commande['livraison_prevue']})")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                quantite_recue = st.number_input("Quantité reçue", min_value=0.0, value=float(commande["quantite"]), step=1.0)
+            with col2:
+                prix_unitaire = st.number_input("Prix unitaire (€)", min_value=0.0,
+                                                value=float(article.get("prix_unitaire", 0.0)), step=1.0)
+            with col3:
+                bon_livraison = st.text_input("Bon de livraison")
             
-            if st.form_submit_button("📦 Passer commande", type="primary"):
-                st.success(f"Commande passée pour {quantite} {article} chez {fournisseur}")
-                st.balloons()
+            if st.form_submit_button("📥 Réceptionner"):
+                try:
+                    data_manager.receptionner_commande(article["id"], quantite_recue, prix_unitaire, bon_livraison,
+                                                       st.session_state.user["username"])
+                    st.success(f"{quantite_recue:g} {article['designation']} entré(s) en stock")
+                    st.rerun()
+                except ConflictError:
+                    st.error("Cet article a été modifié entre-temps, veuillez réessayer")
+
+def show_mouvements_stock():
+    """Saisie des mouvements (entrées, sorties sur BT, ajustements) et historique"""
+    st.subheader("🔄 Mouvements de stock")
+    
+    article_ids = [article["id"] for article in data_manager.get_all_articles()]
+    if not article_ids:
+        st.info("Aucun article enregistré")
+        return
+    bts_ouverts = [bt["numero"] for bt in data_manager.get_all_bons_travail() if bt.get("statut") not in Ordonnanceur.STATUTS_CLOS]
+    
+    with st.expander("➕ Nouveau mouvement"):
+        with st.form("mouvement_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                article_id = st.selectbox("Article*", article_ids, format_func=libelle_article)
+                type_mouvement = st.selectbox("Type*", [SORTIE, ENTREE, AJUSTEMENT])
+                quantite = st.number_input("Quantité*", value=1.0, step=1.0,
+                                           help="Positive ; pour un ajustement, négative si l'inventaire est inférieur au stock")
+            with col2:
+                bt = st.selectbox("Bon de Travail (sortie)", ["—"] + bts_ouverts)
+                prix_unitaire = st.number_input("Prix unitaire (entrée, €)", min_value=0.0, value=0.0, step=1.0)
+                document = st.text_input("Document", placeholder="Bon de livraison, inventaire...")
+            motif = st.text_input("Motif")
+            
+            if st.form_submit_button("💾 Enregistrer le mouvement", type="primary"):
+                if quantite == 0 or (quantite < 0 and type_mouvement != AJUSTEMENT):
+                    st.error("La quantité doit être positive (seul un ajustement peut être négatif)")
+                else:
+                    try:
+                        data_manager.enregistrer_mouvement(
+                            article_id, type_mouvement, quantite,
+                            prix_unitaire=prix_unitaire or data_manager.get_article(article_id).get("prix_unitaire", 0.0),
+                            bt=bt if type_mouvement == SORTIE and bt != "—" else None,
+                            document=document, motif=motif, utilisateur=st.session_state.user["username"]
+                        )
+                        st.success(f"Mouvement enregistré : {libelle_article(article_id)}")
+                        st.rerun()
+                    except ValueError as e:
+                        # StockInsuffisantError : le gestionnaire partagé lève la classe de sa première exécution du script
+                        st.error(str(e))
+                    except ConflictError:
+                        st.error("Cet article a été modifié entre-temps, veuillez réessayer")
+    
+    st.markdown("#### Historique")
+    col1, col2 = st.columns(2)
+    with col1:
+        article_filtre = st.selectbox("Article", [None] + article_ids, key="mouvements_article",
+                                      format_func=lambda article_id: "Tous" if article_id is None else libelle_article(article_id))
+    with col2:
+        type_filtre = st.selectbox("Type", [None] + list(TYPES_MOUVEMENT), key="mouvements_type",
+                                   format_func=lambda type_mouvement: type_mouvement or "Tous")
+    
+    # Ids lus sur les index (facettes et date) : seule la page affichée est matérialisée
+    mouvement_ids = data_manager.get_mouvements_ids(article_filtre, type_filtre)
+    if not mouvement_ids:
+        st.info("Aucun mouvement")
+        return
+    page = []
+    for mouvement_id in mouvement_ids[paginer(len(mouvement_ids), "mouvements")]:
+        mouvement = data_manager.get_mouvement(mouvement_id)
+        page.append({
+            "Date": mouvement["date"].replace("T", " "),
+            "Article": libelle_article(mouvement["article_id"]),
+            "Type": mouvement["type"],
+            "Quantité": mouvement["quantite"],
+            "Valeur (€)": mouvement["valeur"],
+            "Solde": mouvement["solde"],
+            "BT": mouvement.get("bt") or "",
+            "Document": mouvement.get("document", ""),
+            "Motif": mouvement.get("motif", ""),
+            "Utilisateur": mouvement.get("utilisateur", "")
+        })
+    st.dataframe(pd.DataFrame(page), use_container_width=True, hide_index=True)
 
 def show_tiers_management():
     """Page de gestion des tiers (fournisseurs et sous-traitants)"""
@@ -1918,7 +6944,7 @@ def show_all_tiers():
     with col2:
         contrat_filter = st.multiselect("Contrat", ["Actif", "Inactif"])
     with col3:
-        search_term = st.text_input("Rechercher par nom")
+        search_term = st.text_input("Rechercher (nom, spécialité, contact)")
     
     # Appliquer les filtres
     filtered = all_tiers.copy()
@@ -1933,7 +6959,13 @@ def show_all_tiers():
             filtered = filtered[filtered["contrat_actif"] == False]
     
     if search_term:
-        filtered = filtered[filtered["nom"].str.contains(search_term, case=False, na=False)]
+        hits = data_manager.search(search_term, ["fournisseurs", "soustraitants"], limit=None)
+        fournisseur_ids = {record["id"] for collection, record, _ in hits if collection == "fournisseurs"}
+        soustraitant_ids = {record["id"] for collection, record, _ in hits if collection == "soustraitants"}
+        filtered = filtered[
+            ((filtered["type"] == "fournisseur") & filtered["id"].isin(fournisseur_ids))
+            | ((filtered["type"] == "soustraitant") & filtered["id"].isin(soustraitant_ids))
+        ]
     
     # Affichage
     if not filtered.empty:
@@ -2051,7 +7083,6 @@ def show_fournisseurs():
             if st.form_submit_button("➕ Ajouter le fournisseur", type="primary"):
                 if nom and specialite and contact_nom and contact_email and contact_telephone and adresse:
                     fournisseur_data = {
-                        "id": max([f["id"] for f in data_manager.tiers["fournisseurs"]], default=0) + 1,
                         "nom": nom,
                         "type": "fournisseur",
                         "specialite": specialite,
@@ -2069,8 +7100,7 @@ def show_fournisseurs():
                         "notes": notes
                     }
                     
-                    data_manager.tiers["fournisseurs"].append(fournisseur_data)
-                    data_manager.save_tiers()
+                    data_manager.add_fournisseur(fournisseur_data)
                     st.success(f"✅ Fournisseur {nom} ajouté avec succès !")
                     st.balloons()
                 else:
@@ -2148,7 +7178,6 @@ def show_soustraitants():
             if st.form_submit_button("➕ Ajouter le sous-traitant", type="primary"):
                 if nom and specialite and contact_nom and contact_email and contact_telephone and adresse:
                     soustraitant_data = {
-                        "id": max([s["id"] for s in data_manager.tiers["soustraitants"]], default=100) + 1,
                         "nom": nom,
                         "type": "soustraitant",
                         "specialite": specialite,
@@ -2168,8 +7197,7 @@ def show_soustraitants():
                         "notes": notes
                     }
                     
-                    data_manager.tiers["soustraitants"].append(soustraitant_data)
-                    data_manager.save_tiers()
+                    data_manager.add_soustraitant(soustraitant_data)
                     st.success(f"✅ Sous-traitant {nom} ajouté avec succès !")
                     st.balloons()
                 else:
@@ -2245,44 +7273,43 @@ def show_liste_personnel():
         st.info("Aucun personnel enregistré. Ajoutez votre premier membre !")
         return
     
-    # Filtres
+    # Filtres (résolus sur les index de DataManager, les compteurs ne parcourent pas les fiches)
+    service_counts = data_manager.facet_counts("personnels", "service")
+    statut_counts = data_manager.facet_counts("personnels", "statut")
+    
     col1, col2, col3 = st.columns(3)
     with col1:
-        services = sorted(list(set([p.get("service", "Non spécifié") for p in personnels])))
-        service_filter = st.multiselect("Service/Département", services)
+        service_filter = st.multiselect("Service/Département", sorted(service_counts),
+                                        format_func=lambda s: f"{s} ({service_counts.get(s, 0)})")
     
     with col2:
-        statuts = sorted(list(set([p.get("statut", "Non spécifié") for p in personnels])))
-        statut_filter = st.multiselect("Statut", statuts)
+        statut_filter = st.multiselect("Statut", sorted(statut_counts),
+                                       format_func=lambda s: f"{s} ({statut_counts.get(s, 0)})")
     
     with col3:
         search_term = st.text_input("Rechercher par nom/matricule")
     
     # Application des filtres
-    filtered_personnels = personnels.copy()
-    
-    if service_filter:
-        filtered_personnels = [p for p in filtered_personnels if p.get("service") in service_filter]
-    
-    if statut_filter:
-        filtered_personnels = [p for p in filtered_personnels if p.get("statut") in statut_filter]
-    
-    if search_term:
-        search_term = search_term.lower()
-        filtered_personnels = [
-            p for p in filtered_personnels 
-            if search_term in p.get("nom", "").lower() or search_term in p.get("matricule", "").lower()
-        ]
+    matching_ids = data_manager.query_ids(
+        "personnels",
+        {"service": service_filter, "statut": statut_filter},
+        search_term
+    )
+    nb_filtered = len(personnels) if matching_ids is None else len(matching_ids)
     
     # Métriques
-    st.markdown(f"**Total:** {len(personnels)} membres | **Filtrés:** {len(filtered_personnels)}")
+    st.markdown(f"**Total:** {len(personnels)} membres | **Filtrés:** {nb_filtered}")
     
     # Affichage
-    if not filtered_personnels:
+    if not nb_filtered:
         st.warning("Aucun personnel ne correspond aux critères")
         return
     
-    for personnel in filtered_personnels:
+    # Seules les fiches de la page visible sont lues
+    page_ids = data_manager.ordered_ids("personnels", matching_ids)[paginer(nb_filtered, "personnel")]
+    page_personnels = [data_manager.get_personnel(personnel_id) for personnel_id in page_ids]
+    
+    for personnel in page_personnels:
         with st.container():
             col_a1, col_a2, col_a3 = st.columns([3, 2, 1])
             with col_a1:
@@ -2354,10 +7381,14 @@ def show_liste_personnel():
                         with col_conf1:
                             if st.button(f"✅ Oui", key=f"confirm_yes_{personnel['id']}"):
                                 # Supprimer via DataManager
-                                data_manager.delete_personnel(personnel['id'])
-                                st.success(f"Personnel {personnel['nom']} supprimé avec succès")
-                                time.sleep(1)
-                                st.rerun()
+                                try:
+                                    data_manager.delete_personnel(personnel['id'])
+                                except ConflictError:
+                                    st.error(f"❌ {personnel['nom']} a été modifié par un autre utilisateur, veuillez réessayer")
+                                else:
+                                    st.success(f"Personnel {personnel['nom']} supprimé avec succès")
+                                    time.sleep(1)
+                                    st.rerun()
                         with col_conf2:
                             if st.button(f"❌ Non", key=f"confirm_no_{personnel['id']}"):
                                 st.rerun()
@@ -2461,8 +7492,7 @@ def show_ajouter_personnel():
         if submitted:
             if nom and matricule and telephone and email and poste and service:
                 # Vérifier si le matricule existe déjà
-                personnels = data_manager.get_all_personnels()
-                matricule_existe = any(p.get("matricule") == matricule for p in personnels)
+                matricule_existe = data_manager.get_personnel_by_matricule(matricule) is not None
                 
                 if matricule_existe:
                     st.error(f"❌ Le matricule {matricule} existe déjà ! Veuillez utiliser un matricule unique.")
@@ -2730,12 +7760,8 @@ def show_modifier_technicien(personnel):
         if submitted:
             if nom and matricule and telephone and email and poste and service:
                 # Vérifier si le matricule est unique (sauf pour le personnel en cours)
-                personnels = data_manager.get_all_personnels()
-                matricule_existe = False
-                for p in personnels:
-                    if p["matricule"] == matricule and p["id"] != personnel["id"]:
-                        matricule_existe = True
-                        break
+                homonyme = data_manager.get_personnel_by_matricule(matricule)
+                matricule_existe = homonyme is not None and homonyme["id"] != personnel["id"]
                 
                 if matricule_existe:
                     st.error(f"❌ Le matricule {matricule} existe déjà pour un autre membre !")
@@ -2784,16 +7810,22 @@ def show_modifier_technicien(personnel):
                         "date_modification": datetime.datetime.now().isoformat()
                     }
                     
-                    # Mettre à jour via DataManager
-                    data_manager.update_personnel(personnel['id'], personnel_data)
-                    
-                    st.success(f"✅ Personnel {nom} modifié avec succès !")
-                    st.balloons()
-                    
-                    # Attendre 2 secondes puis revenir à la liste
-                    time.sleep(2)
-                    st.session_state.editing_personnel = None
-                    st.rerun()
+                    # Mettre à jour via DataManager ; personnel est la fiche mémorisée à l'ouverture du formulaire
+                    try:
+                        data_manager.update_personnel(personnel['id'], personnel_data, expected_rev=personnel.get('_rev', 0))
+                    except ConflictError:
+                        if data_manager.get_personnel(personnel['id']) is None:
+                            st.error(f"❌ {nom} a été supprimé par un autre utilisateur depuis l'ouverture du formulaire. Revenez à la liste.")
+                        else:
+                            st.error(f"❌ {nom} a été modifié par un autre utilisateur depuis l'ouverture du formulaire. Revenez à la liste et recommencez.")
+                    else:
+                        st.success(f"✅ Personnel {nom} modifié avec succès !")
+                        st.balloons()
+                        
+                        # Attendre 2 secondes puis revenir à la liste
+                        time.sleep(2)
+                        st.session_state.editing_personnel = None
+                        st.rerun()
             else:
                 st.error("Veuillez remplir tous les champs obligatoires (*)")
         
@@ -2817,6 +7849,17 @@ def show_gestion_habilitations():
     with tab3:
         show_ajouter_habilitation()
 
+def statut_habilitation(titre, aujourd_hui, alerte_jours=90):
+    """Libellé de validité d'un titre d'habilitation"""
+    expiration = titre.get("date_expiration")
+    if not expiration:
+        return "✓ Valide"
+    if expiration < aujourd_hui.isoformat():
+        return f"❌ Expirée le {expiration}"
+    if expiration <= (aujourd_hui + datetime.timedelta(days=alerte_jours)).isoformat():
+        return f"⚠️ Expire le {expiration}"
+    return f"✓ Valide jusqu'au {expiration}"
+
 def show_habilitations_par_personne():
     """Affiche les habilitations par personne"""
     st.markdown("### 📋 Habilitations par Technicien")
@@ -2827,18 +7870,27 @@ def show_habilitations_par_personne():
         st.info("Aucun technicien enregistré")
         return
     
-    for personnel in personnels:
+    aujourd_hui = datetime.date.today()
+    for personnel in personnels[paginer(len(personnels), "habilitations_personnes")]:
         with st.container():
             st.markdown(f"**{personnel.get('nom')}** ({personnel.get('matricule')})")
             
-            habilitations = personnel.get('habilitations', [])
-            if habilitations:
-                for hab in habilitations:
+            # Seul le titre en vigueur de chaque habilitation est affiché (les renouvellements sont conservés)
+            titres = [titre for titre in data_manager.get_habilitations_personnel(personnel["id"])
+                      if data_manager.validites_habilitations.est_en_vigueur(titre)]
+            if titres:
+                for titre in titres:
                     col_h1, col_h2 = st.columns([4, 1])
                     with col_h1:
-                        st.write(f"• {hab}")
+                        st.write(f"• {titre['libelle']}")
                     with col_h2:
-                        st.success("✓ Valide")
+                        statut = statut_habilitation(titre, aujourd_hui)
+                        if statut.startswith("❌"):
+                            st.error(statut)
+                        elif statut.startswith("⚠️"):
+                            st.warning(statut)
+                        else:
+                            st.success(statut)
             else:
                 st.info("Aucune habilitation enregistrée")
             
@@ -2848,15 +7900,85 @@ def show_validites_habilitations():
     """Affiche les validités des habilitations"""
     st.markdown("### 📅 Suivi des Validités")
     
-    st.info("Fonctionnalité en développement")
-    st.write("Cette section permettra de suivre les dates d'expiration des habilitations")
+    # Échéances lues sur l'index trié des dates d'expiration de tout l'effectif
+    horizon = st.selectbox("Expirant sous", [30, 60, 90], key="validites_horizon",
+                           format_func=lambda jours: f"{jours} jours")
+    expirees = data_manager.get_habilitations_expirees()
+    a_renouveler = data_manager.get_habilitations_a_renouveler(horizon)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Habilitations expirées", len(expirees))
+    with col2:
+        st.metric(f"À renouveler sous {horizon} jours", len(a_renouveler))
+    
+    titres = expirees + a_renouveler
+    if not titres:
+        st.success("Aucune habilitation expirée ni à renouveler sur la période")
+        return
+    
+    aujourd_hui = datetime.date.today()
+    page = []
+    for titre in titres[paginer(len(titres), "validites")]:
+        personnel = data_manager.get_personnel(titre["personnel_id"]) or {}
+        page.append({
+            "Personnel": personnel.get("nom", ""),
+            "Matricule": personnel.get("matricule", ""),
+            "Habilitation": titre["libelle"],
+            "Obtention": titre.get("date_obtention", ""),
+            "Expiration": titre["date_expiration"],
+            "Statut": statut_habilitation(titre, aujourd_hui, horizon)
+        })
+    st.dataframe(pd.DataFrame(page), use_container_width=True, hide_index=True)
 
 def show_ajouter_habilitation():
     """Formulaire pour ajouter une habilitation"""
     st.markdown("### ➕ Ajouter une Nouvelle Habilitation")
     
-    st.info("Fonctionnalité en développement")
-    st.write("Cette section permettra d'ajouter de nouvelles habilitations aux techniciens")
+    personnels = data_manager.get_all_personnels()
+    if not personnels:
+        st.info("Aucun technicien enregistré")
+        return
+    
+    # Hors formulaire : l'échéance proposée suit l'habilitation choisie
+    libelles = sorted(data_manager.facet_counts("habilitations", "libelle"))
+    col1, col2 = st.columns(2)
+    with col1:
+        personnel_id = st.selectbox("Personnel*", [p["id"] for p in personnels], key="habilitation_personnel",
+                                    format_func=lambda personnel_id: f"{data_manager.get_personnel(personnel_id)['nom']} "
+                                                                     f"({data_manager.get_personnel(personnel_id)['matricule']})")
+        libelle = st.selectbox("Habilitation*", libelles + ["Autre"], key="habilitation_libelle")
+        if libelle == "Autre":
+            libelle = st.text_input("Libellé de l'habilitation*", key="habilitation_autre").strip()
+    annees = validite_habilitation(libelle) if libelle else None
+    
+    with st.form("ajouter_habilitation_form"):
+        col3, col4 = st.columns(2)
+        with col3:
+            date_obtention = st.date_input("Date d'obtention*", datetime.date.today())
+            organisme = st.text_input("Organisme de formation")
+        with col4:
+            sans_echeance = st.checkbox("Sans échéance", value=annees is None)
+            date_expiration = st.date_input(
+                "Date d'expiration", datetime.date.fromisoformat(ajouter_annees(datetime.date.today().isoformat(), annees or 1)),
+                help=f"Validité usuelle : {annees} ans" if annees else None
+            )
+            numero = st.text_input("N° de titre / certificat")
+        
+        if st.form_submit_button("💾 Enregistrer l'habilitation", type="primary"):
+            if not libelle:
+                st.error("Veuillez indiquer l'habilitation")
+            elif not sans_echeance and date_expiration <= date_obtention:
+                st.error("La date d'expiration doit suivre la date d'obtention")
+            else:
+                try:
+                    data_manager.ajouter_habilitation(
+                        personnel_id, libelle, date_obtention.isoformat(),
+                        "" if sans_echeance else date_expiration.isoformat(), organisme, numero
+                    )
+                    st.success(f"✅ {libelle} enregistrée pour {data_manager.get_personnel(personnel_id)['nom']}")
+                except ConflictError:
+                    st.error("Ce personnel a été modifié entre-temps, veuillez réessayer")
 
 def show_statistiques_personnel():
     """Affiche les statistiques du personnel"""
@@ -2934,6 +8056,63 @@ def show_performance_technicien(personnel):
     st.info("Fonctionnalité en développement")
     st.write("Cette section affichera les statistiques de performance du technicien")
 
+def show_import_donnees():
+    """Import en masse d'outillages, de personnels, de fournisseurs ou de sous-traitants depuis un fichier CSV ou Excel"""
+    st.subheader("Import en masse")
+    
+    collection = st.selectbox("Données à importer", list(SCHEMAS_IMPORT), format_func=lambda c: SCHEMAS_IMPORT[c]["libelle"])
+    schema = SCHEMAS_IMPORT[collection]
+    obligatoires = ", ".join(schema["colonnes"][champ][0] for champ in schema["obligatoires"])
+    st.caption(f"Colonnes obligatoires : {obligatoires} · Listes séparées par « {SEPARATEUR_LISTE} » · "
+               f"Dates AAAA-MM-JJ ou JJ/MM/AAAA · Clé de rapprochement : {schema['colonnes'][schema['cle']][0]}")
+    st.download_button("📄 Télécharger le modèle CSV", data=modele_import(collection),
+                       file_name=f"modele_{collection}.csv", mime="text/csv")
+    
+    fichier = st.file_uploader("Fichier à importer", type=["csv", "xlsx"], key="fichier_import")
+    col_i1, col_i2 = st.columns(2)
+    with col_i1:
+        mettre_a_jour = st.checkbox("Mettre à jour les existants", value=False,
+                                    help="Les lignes dont la clé existe déjà mettent à jour l'enregistrement (cellules renseignées uniquement)")
+    with col_i2:
+        tout_ou_rien = st.checkbox("Tout ou rien", value=True,
+                                   help="N'importer aucune ligne si le fichier contient au moins une erreur")
+    
+    if st.button("📥 Importer", type="primary", disabled=fichier is None):
+        try:
+            with st.spinner("Import en cours..."):
+                rapport = data_manager.importer(collection, lire_blocs(fichier, fichier.name),
+                                                mettre_a_jour=mettre_a_jour, tout_ou_rien=tout_ou_rien)
+        except ValueError as e:
+            # ImportInvalideError : le gestionnaire partagé lève la classe de sa première exécution du script
+            st.session_state.pop("rapport_import", None)
+            st.error(f"❌ {e}")
+            return
+        # Compte rendu conservé pour la pagination des erreurs
+        st.session_state.rapport_import = {**rapport, "collection": collection, "tout_ou_rien": tout_ou_rien}
+    
+    rapport = st.session_state.get("rapport_import")
+    if rapport and rapport["collection"] == collection:
+        tout_ou_rien = rapport["tout_ou_rien"]
+        col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+        col_r1.metric("Lignes lues", rapport["lignes"])
+        col_r2.metric("Créés", rapport["crees"])
+        col_r3.metric("Mis à jour", rapport["mis_a_jour"])
+        col_r4.metric("Erreurs", len(rapport["erreurs"]))
+        
+        if rapport["erreurs"] and tout_ou_rien:
+            st.error(f"❌ {len(rapport['erreurs'])} erreur(s) : aucune ligne importée")
+        elif rapport["erreurs"]:
+            st.warning(f"⚠️ Lignes en erreur ignorées ({len({ligne for ligne, _, _, _ in rapport['erreurs']})})")
+        else:
+            st.success("✅ Import terminé")
+        if rapport["colonnes_ignorees"]:
+            st.info(f"ℹ️ Colonnes non reconnues ignorées : {', '.join(map(str, rapport['colonnes_ignorees']))}")
+        if rapport["erreurs"]:
+            erreurs = pd.DataFrame(rapport["erreurs"], columns=["Ligne", "Colonne", "Valeur", "Erreur"])
+            st.dataframe(erreurs.iloc[paginer(len(erreurs), "erreurs_import")], use_container_width=True, hide_index=True)
+            st.download_button("📥 Exporter les erreurs", data=erreurs.to_csv(index=False, sep=";"),
+                               file_name=f"erreurs_import_{collection}.csv", mime="text/csv")
+
 def show_admin():
     """Affiche la page administration"""
     st.title("⚙️ Administration")
@@ -2943,7 +8122,7 @@ def show_admin():
         return
     
     # Onglets
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 Système", "👥 Utilisateurs", "🔐 Sécurité", "💾 Backup"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Système", "👥 Utilisateurs", "🔐 Sécurité", "💾 Backup", "📥 Import"])
     
     with tab1:
         st.subheader("Informations système")
@@ -2952,7 +8131,7 @@ def show_admin():
         with col_s1:
             st.metric("Version", "2.0.0")
             st.metric("Utilisateurs actifs", "3")
-            st.metric("Base de données", "JSON")
+            st.metric("Base de données", data_manager.storage.label)
         
         with col_s2:
             st.metric("Espace disque", "85%")
@@ -3014,11 +8193,20 @@ def show_admin():
         
         with col_b1:
             st.markdown("### 💾 Sauvegarde")
-            if st.button("Sauvegarder maintenant", use_container_width=True):
-                st.success("Sauvegarde effectuée !")
+            # Fichiers produits au clic, par blocs lus dans le stockage
+            st.download_button("Sauvegarder maintenant", data=data_manager.sauvegarder,
+                               file_name=f"gmao_sauvegarde_{datetime.date.today().isoformat()}.zip",
+                               mime="application/zip", use_container_width=True)
             
-            if st.button("Exporter en CSV", use_container_width=True):
-                st.success("Export CSV lancé !")
+            collection_export = st.selectbox("Données à exporter", list(COLLECTIONS_EXPORT),
+                                             format_func=COLLECTIONS_EXPORT.get)
+            format_export = st.selectbox("Format", formats_export(), format_func=lambda f: FORMATS_EXPORT[f][0])
+            _, extension, mime = FORMATS_EXPORT[format_export]
+            st.download_button(f"Exporter en {FORMATS_EXPORT[format_export][0]}",
+                               data=lambda: data_manager.exporter(collection_export, format_export),
+                               file_name=f"{collection_export}.{extension}", mime=mime, use_container_width=True)
+            if pq is None:
+                st.caption("Export Parquet indisponible : installer le paquet pyarrow")
             
             backup_freq = st.selectbox("Fréquence auto", ["Quotidienne", "Hebdomadaire", "Mensuelle"])
         
@@ -3033,6 +8221,9 @@ def show_admin():
                         st.success("Restauration réussie !")
                 else:
                     st.error("Veuillez sélectionner un fichier")
+    
+    with tab5:
+        show_import_donnees()
 
 def show_dashboard():
     """Tableau de bord amélioré avec KPI de maintenance (sans matplotlib)"""
@@ -3043,6 +8234,12 @@ def show_dashboard():
     total_outillages = len(outillages) if not outillages.empty else 0
     outillages_disponibles = len(outillages[outillages["disponibilite"] == "🟢 Disponible"]) if not outillages.empty else 0
     
+    # Indicateurs calculés à partir des agrégats d'interventions (aucun parcours de l'historique)
+    kpi = data_manager.get_indicateurs()
+    agregats_mois = data_manager.get_agregats("mois")
+    mois_courant = datetime.date.today().strftime("%Y-%m")
+    mois_precedent = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m")
+    
     # ========== PREMIÈRE LIGNE : KPI PRINCIPAUX ==========
     st.markdown("### 📊 KPI Principaux")
     
@@ -3051,48 +8248,37 @@ def show_dashboard():
     with col1:
         st.metric(
             label="Taux Disponibilité",
-            value="92.4%",
-            delta="+1.2%",
-            delta_color="normal"
+            value=f"{kpi['disponibilite'] * 100:.1f}%" if kpi["disponibilite"] is not None else "—"
         )
         st.caption("Équipements opérationnels")
     
     with col2:
         st.metric(
             label="MTBF Moyen",
-            value="450h",
-            delta="+25h",
-            delta_color="normal"
+            value=f"{kpi['mtbf']:.0f}h" if kpi["mtbf"] is not None else "—"
         )
         st.caption("Mean Time Between Failures")
     
     with col3:
         st.metric(
             label="MTTR Moyen",
-            value="3.2h",
-            delta="-0.8h",
-            delta_color="inverse"
+            value=f"{kpi['mttr']:.1f}h" if kpi["mttr"] is not None else "—"
         )
         st.caption("Mean Time To Repair")
     
     with col4:
-        taux_preventive = 78  # Donnée simulée
         st.metric(
             label="Maintenance Préventive",
-            value=f"{taux_preventive}%",
-            delta="+5%",
-            delta_color="normal"
+            value=f"{kpi['taux_preventive'] * 100:.0f}%" if kpi["taux_preventive"] is not None else "—"
         )
         st.caption("Part préventive vs corrective")
     
     with col5:
         st.metric(
             label="Coût Maintenance/Mois",
-            value="12.4k€",
-            delta="-1.2k€",
-            delta_color="inverse"
+            value=f"{kpi['cout_mensuel'] / 1000:.1f}k€" if kpi["cout_mensuel"] is not None else "—"
         )
-        st.caption("Économies réalisées")
+        st.caption(f"Moyenne sur {kpi['nb_mois']} mois")
     
     # ========== DEUXIÈME LIGNE : STATISTIQUES ==========
     st.markdown("### 📈 Statistiques d'Activité")
@@ -3100,10 +8286,12 @@ def show_dashboard():
     col_a, col_b, col_c, col_d = st.columns(4)
     
     with col_a:
+        interventions_mois = agregats_mois.get(mois_courant, {}).get("interventions", 0)
+        interventions_precedent = agregats_mois.get(mois_precedent, {}).get("interventions", 0)
         st.metric(
             label="Interventions",
-            value="24",
-            delta="+3",
+            value=str(interventions_mois),
+            delta=f"{interventions_mois - interventions_precedent:+d}",
             delta_color="normal"
         )
         st.caption("Ce mois")
@@ -3118,13 +8306,14 @@ def show_dashboard():
         st.caption(f"{outillages_disponibles}/{total_outillages} disponibles")
     
     with col_c:
+        synthese_equipements = data_manager.get_synthese_equipements()
         st.metric(
             label="Équipements",
-            value="12",
-            delta="0",
+            value=str(synthese_equipements["total"]),
+            delta=f"{synthese_equipements.get(ETATS_EQUIPEMENT[2], 0)} hors service",
             delta_color="off"
         )
-        st.caption("En service")
+        st.caption(f"{synthese_equipements.get(ETATS_EQUIPEMENT[0], 0)}/{synthese_equipements['total']} en service")
     
     with col_d:
         st.metric(
@@ -3144,11 +8333,15 @@ def show_dashboard():
     with chart_col1:
         st.markdown("#### 🔧 Répartition des Interventions")
         
-        # Données pour le tableau
+        # Répartition calculée sur les agrégats par type
+        agregats_type = data_manager.get_agregats("type")
+        total_interventions = max(kpi["interventions"], 1)
+        types = ['Préventive', 'Corrective', 'Améliorative', 'Urgente']
+        nombres = [agregats_type.get(t, {}).get("interventions", 0) for t in types]
         intervention_data = {
-            'Type': ['Préventive', 'Corrective', 'Améliorative', 'Urgente'],
-            'Nombre': [65, 25, 8, 2],
-            'Pourcentage': ['65%', '25%', '8%', '2%']
+            'Type': types,
+            'Nombre': nombres,
+            'Pourcentage': [f"{n / total_interventions * 100:.0f}%" for n in nombres]
         }
         
         # Affichage sous forme de tableau avec barres de progression
@@ -3169,7 +8362,7 @@ def show_dashboard():
                     st.markdown(f"🔴 **{type_int}**")
             
             with col_prog:
-                progress_value = nombre / 100
+                progress_value = nombre / total_interventions
                 if type_int == 'Préventive':
                     st.progress(progress_value, text=pourcent)
                 elif type_int == 'Corrective':
@@ -3184,13 +8377,17 @@ def show_dashboard():
     with chart_col2:
         st.markdown("#### 📅 Évolution Mensuelle")
         
-        # Données pour le tableau
+        # Quatre derniers mois d'activité
+        derniers_mois = sorted(agregats_mois)[-4:]
+        preventives = [agregats_mois[m]["preventives"] for m in derniers_mois]
+        totaux_mois = [agregats_mois[m]["interventions"] for m in derniers_mois]
         evolution_data = pd.DataFrame({
-            'Mois': ['Septembre', 'Octobre', 'Novembre', 'Décembre'],
-            'Préventive': [18, 20, 22, 24],
-            'Corrective': [8, 6, 5, 4],
-            'Total': [26, 26, 27, 28]
+            'Mois': [MOIS_FR[int(m[5:7]) - 1] if len(m) >= 7 else m for m in derniers_mois],
+            'Préventive': preventives,
+            'Corrective': [t - p for t, p in zip(totaux_mois, preventives)],
+            'Total': totaux_mois
         })
+        max_mois = max(totaux_mois, default=0) or 1
         
         # Affichage du tableau
         st.dataframe(
@@ -3202,14 +8399,14 @@ def show_dashboard():
                     help="Nombre d'interventions préventives",
                     format="%d",
                     min_value=0,
-                    max_value=30,
+                    max_value=max_mois,
                 ),
                 "Corrective": st.column_config.ProgressColumn(
                     "Corrective",
-                    help="Nombre d'interventions correctives",
+                    help="Nombre d'interventions non préventives",
                     format="%d",
                     min_value=0,
-                    max_value=30,
+                    max_value=max_mois,
                 ),
                 "Total": st.column_config.NumberColumn(
                     "Total",
@@ -3231,12 +8428,15 @@ def show_dashboard():
     with chart_col3:
         st.markdown("#### ⏱️ Temps d'Intervention (MTTR)")
         
-        # Données pour MTTR
+        # MTTR des équipements les plus défaillants
+        mttr_equipements = data_manager.get_mttr_par_equipement()
         mttr_data = pd.DataFrame({
-            'Équipement': ['Pompes', 'Ventilateurs', 'Convoyeurs', 'Compresseurs', 'Autres'],
-            'MTTR (h)': [4.2, 2.8, 3.5, 5.1, 2.3],
-            'Objectif (h)': [3.5, 2.5, 3.0, 4.0, 2.0]
+            'Équipement': [equipement for equipement, _, _ in mttr_equipements],
+            'MTTR (h)': [round(mttr, 1) for _, mttr, _ in mttr_equipements],
+            'Objectif (h)': [KpiEngine.OBJECTIF_MTTR] * len(mttr_equipements)
         })
+        if mttr_data.empty:
+            st.info("Aucune défaillance enregistrée")
         
         # Affichage avec barres de progression
         for _, row in mttr_data.iterrows():
@@ -3260,13 +8460,15 @@ def show_dashboard():
     with chart_col4:
         st.markdown("#### 💰 Coûts de Maintenance")
         
-        # Données pour les coûts
+        # Coûts des trois derniers mois d'activité, par type
+        agregats_mois_type = data_manager.get_agregats("mois_type")
+        mois_couts = sorted(agregats_mois)[-3:]
         cost_data = pd.DataFrame({
-            'Mois': ['Sept', 'Oct', 'Nov'],
-            'Préventive (k€)': [8.5, 9.2, 9.8],
-            'Corrective (k€)': [4.2, 3.8, 3.2],
-            'Urgente (k€)': [1.2, 0.8, 0.6],
-            'Total (k€)': [13.9, 13.8, 13.6]
+            'Mois': [MOIS_FR[int(m[5:7]) - 1][:4] if len(m) >= 7 else m for m in mois_couts],
+            'Préventive (k€)': [agregats_mois_type.get((m, "Préventive"), {}).get("cout", 0.0) / 1000 for m in mois_couts],
+            'Corrective (k€)': [agregats_mois_type.get((m, "Corrective"), {}).get("cout", 0.0) / 1000 for m in mois_couts],
+            'Urgente (k€)': [agregats_mois_type.get((m, "Urgente"), {}).get("cout", 0.0) / 1000 for m in mois_couts],
+            'Total (k€)': [agregats_mois[m]["cout"] / 1000 for m in mois_couts]
         })
         
         # Affichage sous forme de tableau
@@ -3311,16 +8513,19 @@ def show_dashboard():
     with col_crit1:
         with st.container():
             st.markdown("#### 🔴 À Surveiller")
-            critical_equipment = [
-                {"nom": "Compresseur CMP-01", "probleme": "Vibrations élevées", "jours": 3},
-                {"nom": "Pompe P-205", "probleme": "Température anormale", "jours": 7},
-                {"nom": "Convoyeur CV-12", "probleme": "Courroie usée", "jours": 2}
-            ]
+            # Équipements les plus exposés à une panne dans l'horizon, d'après l'historique des demandes
+            fiabilite = data_manager.get_fiabilite().dropna(subset=["risque"]).head(3)
+            if fiabilite.empty:
+                st.success("Historique de pannes insuffisant")
             
-            for eq in critical_equipment:
-                st.markdown(f"**{eq['nom']}**")
-                st.caption(f"{eq['probleme']} - Depuis {eq['jours']} jours")
-                st.progress(min(eq['jours'] * 10, 100) / 100)
+            for reference, eq in fiabilite.iterrows():
+                equipement = data_manager.get_equipement_by_code(reference)
+                st.markdown(f"**{equipement['nom'] if equipement else reference}**")
+                weibull = f" · β {eq['beta']:.2f}" if pd.notna(eq["beta"]) else ""
+                mttr = f"{eq['mttr']:.1f} h" if pd.notna(eq["mttr"]) else "—"
+                st.caption(f"MTBF {eq['mtbf']:.0f} h · MTTR {mttr}{weibull} - "
+                           f"Dernière panne il y a {eq['depuis'] / 24:.0f} jours")
+                st.progress(float(eq["risque"]), text=f"Risque de panne sous {HORIZON_FIABILITE} jours : {eq['risque']:.0%}")
     
     with col_crit2:
         with st.container():
@@ -3341,16 +8546,14 @@ def show_dashboard():
     with col_crit3:
         with st.container():
             st.markdown("#### 📦 Stocks Faibles")
-            low_stocks = [
-                {"piece": "Roulement 6205", "stock": 2, "seuil": 10},
-                {"piece": "Joint SPI 50mm", "stock": 5, "seuil": 15},
-                {"piece": "Courroie 5PK800", "stock": 3, "seuil": 8}
-            ]
+            low_stocks = data_manager.get_articles_critiques(limit=3)
+            if not low_stocks:
+                st.success("Aucun article sous son seuil")
             
             for stock in low_stocks:
-                percentage = (stock['stock'] / stock['seuil']) * 100
-                st.markdown(f"**{stock['piece']}**")
-                st.caption(f"Stock: {stock['stock']} / Seuil: {stock['seuil']}")
+                percentage = ratio_stock(stock) * 100
+                st.markdown(f"**{stock['designation']}**")
+                st.caption(f"Stock: {stock['quantite']:g} / Seuil: {stock['seuil_minimum']:g}")
                 if percentage < 30:
                     st.error(f"⚠️ {percentage:.0f}% du seuil")
                 elif percentage < 50:
@@ -3363,33 +8566,36 @@ def show_dashboard():
     
     kpi_col1, kpi_col2, kpi_col3, kpi_col4 = st.columns(4)
     
+    oee = kpi["oee"] or 0.0
+    disponibilite = kpi["disponibilite"] or 0.0
+    
     with kpi_col1:
         st.markdown("#### 🎯 OEE")
-        st.markdown('<div style="text-align: center; font-size: 36px; font-weight: bold; color: #4CAF50;">86.2%</div>', 
+        st.markdown(f'<div style="text-align: center; font-size: 36px; font-weight: bold; color: #4CAF50;">{oee * 100:.1f}%</div>', 
                    unsafe_allow_html=True)
         st.caption("Overall Equipment Effectiveness")
-        st.progress(0.862)
+        st.progress(oee)
     
     with kpi_col2:
         st.markdown("#### ⚡ Disponibilité")
-        st.markdown('<div style="text-align: center; font-size: 36px; font-weight: bold; color: #2196F3;">94.7%</div>', 
+        st.markdown(f'<div style="text-align: center; font-size: 36px; font-weight: bold; color: #2196F3;">{disponibilite * 100:.1f}%</div>', 
                    unsafe_allow_html=True)
         st.caption("Taux de disponibilité équipements")
-        st.progress(0.947)
+        st.progress(disponibilite)
     
     with kpi_col3:
         st.markdown("#### ✅ Qualité")
-        st.markdown('<div style="text-align: center; font-size: 36px; font-weight: bold; color: #9C27B0;">98.3%</div>', 
+        st.markdown(f'<div style="text-align: center; font-size: 36px; font-weight: bold; color: #9C27B0;">{kpi["qualite"] * 100:.1f}%</div>', 
                    unsafe_allow_html=True)
-        st.caption("Taux de bonne qualité")
-        st.progress(0.983)
+        st.caption("Taux de bonne qualité (valeur de référence)")
+        st.progress(kpi["qualite"])
     
     with kpi_col4:
         st.markdown("#### 📊 Performance")
-        st.markdown('<div style="text-align: center; font-size: 36px; font-weight: bold; color: #FF9800;">91.5%</div>', 
+        st.markdown(f'<div style="text-align: center; font-size: 36px; font-weight: bold; color: #FF9800;">{kpi["performance"] * 100:.1f}%</div>', 
                    unsafe_allow_html=True)
-        st.caption("Performance opérationnelle")
-        st.progress(0.915)
+        st.caption("Performance opérationnelle (valeur de référence)")
+        st.progress(kpi["performance"])
     
     # ========== DERNIÈRE LIGNE : BOUTONS RAPIDES ==========
     st.markdown("### 🚀 Actions Rapides")
@@ -3451,6 +8657,14 @@ def show_main_app():
         
         st.markdown("---")
         
+        st.markdown("### 🔎 Recherche")
+        recherche = st.text_input("Recherche globale", placeholder="Outillage, tiers, personnel...",
+                                  label_visibility="collapsed", key="recherche_globale")
+        if recherche:
+            show_resultats_recherche(recherche)
+        
+        st.markdown("---")
+        
         if st.button("🚪 Déconnexion", type="secondary", use_container_width=True):
             for key in list(st.session_state.keys()):
                 del st.session_state[key]